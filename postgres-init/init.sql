@@ -5,3 +5,44 @@ CREATE TABLE test_data (
 );
 
 INSERT INTO test_data (value) VALUES (10), (20), (30), (40), (50);
+
+
+-- Group data loaded by the Flask DatabaseService (database_service.py keeps the same schema).
+-- All tables are in long format: one row per value.
+
+CREATE TABLE IF NOT EXISTS trial_samples (
+    group_name TEXT NOT NULL,
+    trial TEXT NOT NULL,
+    sample INTEGER NOT NULL,
+    time_ms BIGINT NOT NULL,
+    metric TEXT NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (group_name, trial, metric, sample)
+);
+CREATE INDEX IF NOT EXISTS trial_samples_metric_time ON trial_samples (group_name, metric, time_ms);
+
+CREATE TABLE IF NOT EXISTS aggregates (
+    group_name TEXT NOT NULL,
+    sample INTEGER NOT NULL,
+    time_ms BIGINT NOT NULL,
+    metric TEXT NOT NULL,
+    statistic TEXT NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (group_name, metric, statistic, sample)
+);
+CREATE INDEX IF NOT EXISTS aggregates_metric_time ON aggregates (group_name, metric, statistic, time_ms);
+
+CREATE TABLE IF NOT EXISTS trial_summaries (
+    group_name TEXT NOT NULL,
+    trial TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (group_name, trial, metric)
+);
+
+CREATE TABLE IF NOT EXISTS group_summaries (
+    group_name TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (group_name, metric)
+);
@@ -0,0 +1,50 @@
+"""
+Gunicorn configuration for running the Flask app in production: gunicorn -c gunicorn.conf.py
+
+The app is imported once in the master process, which ingests all groups and loads their aggregate data, and is then
+forked into the workers. The preloaded objects are frozen out of garbage collection before forking, so the collector
+in the workers does not write to them and the memory pages stay shared copy-on-write instead of being copied into
+every worker. Experiments are kept in a SQLite file shared by all workers, and the metrics are collected in
+prometheus_client multiprocess mode, so /metrics sums the counters of all workers.
+"""
+import gc
+import os
+import shutil
+
+# This file is read before the app is imported. No collections while the app is loaded: they would only touch objects
+# that are frozen before forking anyway
+gc.disable()
+
+# Every process writes its metrics to files in this folder (see metrics). It has to be set before prometheus_client
+# is imported with the app, and is emptied so the values of a previous server are not counted
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/energibridge-metrics')
+shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+# One worker by default: preloading only shares the state that exists when the workers are forked. Groups ingested
+# later (uploads, outlier policy changes) are reloaded by every other worker from the version file of the group (see
+# GroupService), each into its own memory, so with more workers the group data is no longer shared copy-on-write and
+# a worker answers with the previous group until its next request checks the version files
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('THREADS', 2))
+timeout = 120
+preload_app = True
+
+
+def when_ready(server):
+    # The app is loaded (preload_app) and the workers are not forked yet
+    from app import data_service, group_service
+    data_service.preload([group.name for group in group_service.get_groups()])
+    gc.freeze()
+    server.log.info('Preloaded %d groups, %d objects frozen', len(group_service.get_groups()), gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    gc.enable()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
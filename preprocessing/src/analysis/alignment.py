@@ -0,0 +1,131 @@
+"""
+Phase alignment of the trials of a group before aggregation.
+
+Workloads start their heavy phase at slightly different offsets after EnergiBridge launches, which smears the
+per-timestep statistics of a group. The lag of every trial is estimated against a reference trial, the medoid of the
+group, by the FFT cross-correlation of CPU_POWER (W), for all trials in one batched FFT. Trials are then shifted by
+their lag before they are aggregated.
+
+Lags only depend on the data of a trial and of the reference, so they are cached per trial fingerprint and
+aggregating the same trials again costs nothing.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from models.trial import Trial
+
+ALIGN_TRIALS = os.environ.get('ALIGN_TRIALS', '') not in ('', '0', 'false')
+# Largest lag searched, as a fraction of the length of the reference trial
+ALIGN_MAX_LAG = float(os.environ.get('ALIGN_MAX_LAG', '0.25'))
+
+ALIGNMENT_COLUMN = 'CPU_POWER (W)'
+
+LAGS_FILE = 'alignment.json'
+
+
+def _series(trials: List[Trial]) -> np.ndarray:
+    """
+    :return: ALIGNMENT_COLUMN of the trials without their mean, one row per trial, padded with 0
+    """
+    lengths = [len(trial.preprocessed_data) for trial in trials]
+    series = np.zeros((len(trials), max(lengths)))
+    for index, trial in enumerate(trials):
+        values = trial.column(ALIGNMENT_COLUMN).to_numpy(dtype=np.float64)
+        values = np.where(np.isfinite(values), values, 0)
+        series[index, :lengths[index]] = values - values.mean()
+    return series
+
+
+def medoid(trials: List[Trial]) -> int:
+    """
+    :param trials: Trials of a group
+    :return: Index of the trial with the smallest sum of (Euclidean) distances to the other trials
+    """
+    series = _series(trials)
+    squares = (series ** 2).sum(axis=1)
+    distances = np.sqrt(np.maximum(squares[:, None] + squares[None, :] - 2 * series @ series.T, 0))
+    return int(np.argmin(distances.sum(axis=1)))
+
+
+def estimate_lags(trials: List[Trial], reference: Trial, max_lag: int) -> np.ndarray:
+    """
+    Estimate the lags of trials against a reference by FFT cross-correlation, batched over all trials.
+
+    :param trials: Trials to align
+    :param reference: Reference trial
+    :param max_lag: Largest lag in samples, in both directions
+    :return: Lag per trial in samples, positive when the trial is behind the reference
+    """
+    series = _series(trials + [reference])
+    # Zero padding to twice the length, so the cross-correlation is not circular
+    size = 1 << int(2 * series.shape[1] - 1).bit_length()
+    spectra = np.fft.rfft(series, n=size, axis=1)
+    correlation = np.fft.irfft(spectra[:-1] * np.conj(spectra[-1]), n=size, axis=1)
+    # Index k of the correlation is lag k, index size - k is lag -k
+    lags = np.arange(-max_lag, max_lag + 1)
+    return lags[np.argmax(correlation[:, lags % size], axis=1)]
+
+
+def _trial_key(trial: Trial) -> str:
+    return f'{trial.filename}:{trial.fingerprint()}'
+
+
+def align(trials: List[Trial], output_folder: str, max_lag: float = ALIGN_MAX_LAG) -> Dict[str, int]:
+    """
+    Lags of the trials of a group against its medoid, computed only for trials that are new or changed since the
+    lags were last cached. The medoid is chosen again only when the trials of the group changed.
+
+    :param trials: Trials of a group
+    :param output_folder: Output folder of the group, where the lags are cached
+    :param max_lag: Largest lag, as a fraction of the length of the reference trial
+    :return: Lag in samples per trial name
+    """
+    path = os.path.join(output_folder, LAGS_FILE)
+    try:
+        with open(path, 'r') as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        cached = {}
+
+    keys = [_trial_key(trial) for trial in trials]
+    group_key = hashlib.sha256('\n'.join(sorted(keys)).encode()).hexdigest()
+    if cached.get('group') == group_key and cached.get('reference') in keys:
+        reference_index = keys.index(cached['reference'])
+    else:
+        reference_index = medoid(trials)
+
+    reference = trials[reference_index]
+    lag_samples = int(max_lag * len(reference.preprocessed_data))
+    lags = cached.get('lags', {}) if cached.get('reference') == keys[reference_index] and \
+        cached.get('max_lag') == lag_samples else {}
+    missing = [index for index, key in enumerate(keys) if key not in lags]
+    if missing:
+        estimated = estimate_lags([trials[index] for index in missing], reference, lag_samples)
+        for index, lag in zip(missing, estimated):
+            lags[keys[index]] = int(lag)
+
+    lags = {key: lags[key] for key in keys}
+    contents = {'group': group_key, 'reference': keys[reference_index], 'max_lag': lag_samples, 'lags': lags}
+    if contents != cached:
+        with open(path, 'w') as file:
+            json.dump(contents, file, indent=2)
+    return {trial.filename: lags[key] for trial, key in zip(trials, keys)}
+
+
+def shifted_slices(length: int, lag: int, rows: int) -> Tuple[slice, slice]:
+    """
+    Slices to copy a trial shifted by its lag into an array of the aggregated length.
+
+    :param length: Number of samples of the trial
+    :param lag: Lag of the trial, the trial is moved lag samples earlier
+    :param rows: Number of rows of the destination
+    :return: (source slice, destination slice)
+    """
+    start = max(lag, 0)
+    destination = max(-lag, 0)
+    count = max(0, min(length - start, rows - destination))
+    return slice(start, start + count), slice(destination, destination + count)
@@ -0,0 +1,115 @@
+"""
+Attribution of the energy of every core to its logical processors (SMT siblings), in proportion to their usage.
+
+EnergiBridge measures the energy per core (DIFF_CORE<c>_ENERGY (J)) and the usage per logical processor
+(CPU_USAGE_<n>), so which sibling of a core used its energy is not measured. In every sample, the energy of a core is
+split over its logical processors by their share of the usage of the core, and evenly when none of them is used:
+
+    DIFF_LOGICAL<n>_ENERGY (J) = DIFF_CORE<c>_ENERGY (J) * CPU_USAGE_<n> / sum of CPU_USAGE_<m> over the siblings m of n
+
+The logical processors of a core are detected from the schema of the trials: with k logical processors per core,
+logical processor n belongs to core n % cores when the siblings are interleaved (Linux: 0 and cores are siblings) or
+to core n // k when they are adjacent (0 and 1 are siblings), see SMT_LAYOUT.
+"""
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from models.schema import TrialSchema
+from models.trial import Trial
+
+ATTRIBUTE_ENERGY = os.environ.get('ATTRIBUTE_ENERGY', '1') not in ('', '0', 'false')
+# Numbering of the logical processors: interleaved or adjacent siblings
+SMT_LAYOUT = os.environ.get('SMT_LAYOUT', 'interleaved')
+
+LAYOUTS = ('interleaved', 'adjacent')
+
+
+def energy_column(logical: int) -> str:
+    return f'DIFF_LOGICAL{logical}_ENERGY (J)'
+
+
+def power_column(logical: int) -> str:
+    return f'LOGICAL{logical}_POWER (W)'
+
+
+def siblings(schema: TrialSchema, layout: str = SMT_LAYOUT) -> Dict[int, List[int]]:
+    """
+    Detect the logical processors of every core from the columns of a schema.
+
+    :param schema: Schema of the trials
+    :param layout: Numbering of the logical processors, one of LAYOUTS
+    :return: Core number -> logical processor numbers, empty when the trials do not have energy per core and usage
+             per logical processor, or when the logical processors cannot be divided evenly over the cores
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f'Unknown SMT layout "{layout}", valid layouts are: {list(LAYOUTS)}')
+    cores = sorted({core for column, core in schema.cores.items() if schema.kinds[column] == 'diff_energy'})
+    logical = sorted({number for column, number in schema.logical.items() if schema.kinds[column] == 'usage'})
+    if not cores or not logical or len(logical) % len(cores) != 0:
+        return {}
+    threads = len(logical) // len(cores)
+    if layout == 'interleaved':
+        return {core: logical[index::len(cores)] for index, core in enumerate(cores)}
+    return {core: logical[index * threads:(index + 1) * threads] for index, core in enumerate(cores)}
+
+
+def split(energy: np.ndarray, usage: np.ndarray, mapping: np.ndarray) -> np.ndarray:
+    """
+    Split the energy of the cores over their logical processors by usage, for all samples at once.
+
+    :param energy: Energy of the cores, samples x cores
+    :param usage: Usage of the logical processors, samples x logical processors (missing values are 0)
+    :param mapping: Index in usage of the logical processors of every core, cores x logical processors per core
+    :return: Energy of the logical processors, with the shape of usage
+    """
+    usage = np.where(np.isfinite(usage) & (usage > 0), usage, 0.0)
+    shares = usage[:, mapping]
+    totals = shares.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(totals > 0, shares / totals, 1 / mapping.shape[1])
+    attributed = np.zeros_like(usage)
+    attributed[:, mapping.ravel()] = (energy[:, :, None] * shares).reshape(len(energy), -1)
+    return attributed
+
+
+def attribute(trials: List[Trial], layout: str = SMT_LAYOUT) -> List[str]:
+    """
+    Add the energy and power of every logical processor to the trials of a group. The samples of all trials are
+    split in one vectorized operation.
+
+    :param trials: Trials of the group
+    :param layout: Numbering of the logical processors, one of LAYOUTS
+    :return: Names of the added columns, empty when the energy cannot be attributed
+    """
+    cores = siblings(trials[0].schema, layout)
+    energy_columns = [f'DIFF_CORE{core}_ENERGY (J)' for core in cores]
+    usage_columns = [f'CPU_USAGE_{number}' for number in sorted(n for numbers in cores.values() for n in numbers)]
+    if not cores or any(column not in trial.columns for trial in trials for column in energy_columns + usage_columns):
+        return []
+
+    positions = {int(column.rsplit('_', 1)[1]): index for index, column in enumerate(usage_columns)}
+    mapping = np.array([[positions[number] for number in numbers] for numbers in cores.values()])
+    energy = np.concatenate([np.column_stack([trial.column(column).to_numpy(dtype=np.float64)
+                                              for column in energy_columns]) for trial in trials])
+    usage = np.concatenate([np.column_stack([trial.column(column).to_numpy(dtype=np.float64)
+                                             for column in usage_columns]) for trial in trials])
+    deltas = np.concatenate([trial.column('Delta').to_numpy(dtype=np.float64) for trial in trials])
+
+    attributed = split(energy, usage, mapping)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power = attributed / (deltas / 1000)[:, None]
+    power[~np.isfinite(power)] = 0
+
+    numbers = sorted(positions)
+    start = 0
+    for trial in trials:
+        end = start + len(trial.preprocessed_data)
+        columns = {}
+        for number in numbers:
+            columns[energy_column(number)] = attributed[start:end, positions[number]]
+            columns[power_column(number)] = power[start:end, positions[number]]
+        trial.add_columns(columns)
+        start = end
+    return [column for number in numbers for column in (energy_column(number), power_column(number))]
@@ -0,0 +1,183 @@
+"""
+Correlation matrices of the metrics of a group, to see whether more energy goes with a higher frequency, voltage,
+usage or memory use.
+
+Pearson and Spearman (Pearson of the ranks) correlations are computed on two levels:
+
+- samples: between the columns of a trial over time, for every trial, combined over the trials of the group by
+  averaging their Fisher z-transforms,
+- trials: between the metrics of trial_summary.csv over the trials of the group that are not excluded as outliers.
+
+Every matrix is a single product of standardized columns (Z^T Z), batched over all trials for the samples level,
+instead of a loop over the pairs of columns.
+"""
+import warnings
+from typing import List
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, rankdata
+
+from analysis import outliers
+from models.trial import Trial
+
+METHODS = ('pearson', 'spearman')
+LEVELS = ('samples', 'trials')
+
+CORRELATION_FILE = 'correlations.csv'
+COMPARISON_FILE = 'correlation_comparison.csv'
+
+# Column kinds left out of the samples level: time, and the cumulative energy counters, which grow with time and
+# correlate with everything that does
+EXCLUDED_KINDS = ('time', 'energy')
+
+# Correlations are clipped to this absolute value before the Fisher z-transform, which is infinite at -1 and 1
+_FISHER_LIMIT = 1 - 1e-12
+
+
+def sample_columns(trials: List[Trial]) -> List[str]:
+    """
+    :param trials: Trials of a group
+    :return: The columns of the samples level, in header order of the first trial, without the columns that are
+             constant in all trials
+    """
+    varying = {column for trial in trials for column in trial.columns if column not in trial.constants}
+    trial = trials[0]
+    return [column for column in trial.columns
+            if column in varying and trial.schema.kinds.get(column) not in EXCLUDED_KINDS]
+
+
+def correlate(block: np.ndarray, method: str = 'pearson') -> np.ndarray:
+    """
+    Correlation matrices of the columns of a block, in one (batched) product of the standardized columns. Missing
+    (NaN) values are left out of the ranks and count as the mean of their column, so padding to a common length does
+    not change the correlations.
+
+    :param block: Observations x columns, or a batch of them (e.g. trials x samples x columns)
+    :param method: "pearson" or "spearman"
+    :return: Columns x columns correlation matrices (one per batch entry), NaN for columns without variation
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unknown correlation method "{method}", valid methods are: {list(METHODS)}')
+    block = np.where(np.isfinite(block), block, np.nan)
+    if method == 'spearman':
+        block = rankdata(block, axis=-2, nan_policy='omit')
+
+    with warnings.catch_warnings():
+        # Columns without a value are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        centred = block - np.nanmean(block, axis=-2, keepdims=True)
+    centred = np.where(np.isnan(centred), 0.0, centred)
+    norms = np.sqrt((centred ** 2).sum(axis=-2, keepdims=True))
+    varying = norms > 1e-12 * np.maximum(np.abs(centred).max(axis=-2, keepdims=True), 1.0)
+    standardized = np.where(varying, centred / np.where(varying, norms, 1.0), 0.0)
+
+    matrices = np.clip(np.swapaxes(standardized, -1, -2) @ standardized, -1.0, 1.0)
+    defined = np.swapaxes(varying, -1, -2) & varying
+    return np.where(defined, matrices, np.nan)
+
+
+def fisher(correlations: np.ndarray) -> np.ndarray:
+    """
+    :param correlations: Correlations
+    :return: Fisher z-transforms of the correlations (arctanh), which are about normal with a variance of 1 / (n - 3)
+    """
+    return np.arctanh(np.clip(correlations, -_FISHER_LIMIT, _FISHER_LIMIT))
+
+
+def fisher_mean(matrices: np.ndarray) -> np.ndarray:
+    """
+    :param matrices: Batch of correlation matrices (e.g. one per trial)
+    :return: Mean correlation matrix, averaged in Fisher z-space and ignoring NaN
+    """
+    with warnings.catch_warnings():
+        # Pairs of columns without a correlation in any trial are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.tanh(np.nanmean(fisher(matrices), axis=0))
+
+
+def sample_block(trials: List[Trial], columns: List[str]) -> np.ndarray:
+    """
+    :return: (trials x samples x columns) block of the columns, shorter trials padded with NaN
+    """
+    lengths = [len(trial.preprocessed_data) for trial in trials]
+    block = np.full((len(trials), max(lengths), len(columns)), np.nan)
+    for index, trial in enumerate(trials):
+        for column_index, column in enumerate(columns):
+            if column in trial.columns:
+                block[index, :lengths[index], column_index] = trial.column(column).to_numpy(dtype=np.float64)
+    return block
+
+
+def _long(matrix: np.ndarray, columns: List[str], level: str, method: str) -> pd.DataFrame:
+    rows, cols = np.meshgrid(np.arange(len(columns)), np.arange(len(columns)), indexing='ij')
+    names = np.array(columns, dtype=object)
+    return pd.DataFrame({'Level': level, 'Method': method, 'Row': names[rows.ravel()],
+                         'Column': names[cols.ravel()], 'Correlation': matrix.ravel()})
+
+
+def correlations(trials: List[Trial], trial_summary: pd.DataFrame) -> pd.DataFrame:
+    """
+    Correlation matrices of a group on both levels and with both methods.
+
+    :param trials: Trials of the group
+    :param trial_summary: Contents of trial_summary.csv of the group
+    :return: DataFrame with one row per level, method and pair of columns: Level, Method, Row, Column, Correlation
+    """
+    frames = []
+    columns = sample_columns(trials)
+    block = sample_block(trials, columns)
+    for method in METHODS:
+        frames.append(_long(fisher_mean(correlate(block, method)), columns, 'samples', method))
+
+    # Trials excluded as outliers are not part of the samples, like in the group summary
+    metrics = outliers.included(trial_summary).drop(columns=['Trial']).select_dtypes('number')
+    metrics = metrics.loc[:, metrics.nunique() > 1]
+    values = metrics.to_numpy(dtype=np.float64)
+    for method in METHODS:
+        trial_matrix = correlate(values, method) if len(values) >= 3 else np.full((values.shape[1],) * 2, np.nan)
+        frames.append(_long(trial_matrix, list(metrics.columns), 'trials', method))
+    return pd.concat(frames, ignore_index=True)
+
+
+def matrix(data: pd.DataFrame, level: str, method: str, value: str = 'Correlation') -> pd.DataFrame:
+    """
+    :param data: Contents of correlations.csv or correlation_comparison.csv
+    :param level: One of LEVELS
+    :param method: One of METHODS
+    :param value: Column with the values of the matrix
+    :return: The matrix of a level and method as a square DataFrame, in the order of the columns
+    """
+    selected = data[(data['Level'] == level) & (data['Method'] == method)]
+    order = list(dict.fromkeys(selected['Row']))
+    return selected.pivot(index='Row', columns='Column', values=value).reindex(index=order, columns=order)
+
+
+def compare(data0: pd.DataFrame, data1: pd.DataFrame, name0: str, name1: str, trials0: int,
+            trials1: int) -> pd.DataFrame:
+    """
+    Compare the correlation matrices of two groups on the pairs of columns both groups have.
+
+    :param data0: Correlations of the first group
+    :param data1: Correlations of the second group
+    :param name0: Name of the first group
+    :param name1: Name of the second group
+    :param trials0: Number of trials in the trials level of the first group
+    :param trials1: Number of trials in the trials level of the second group
+    :return: DataFrame with Level, Method, Row, Column, the correlation of both groups, their difference and for the
+             trials level the p-value of the Fisher z-test of the difference (NaN for the samples level, whose samples
+             are not independent)
+    """
+    keys = ['Level', 'Method', 'Row', 'Column']
+    merged = data0.merge(data1, on=keys, suffixes=(f'_{name0}', f'_{name1}'))
+    r0 = merged[f'Correlation_{name0}'].to_numpy(dtype=np.float64)
+    r1 = merged[f'Correlation_{name1}'].to_numpy(dtype=np.float64)
+    merged['Difference'] = r1 - r0
+
+    # Differences of the Fisher z-transforms are normal with variance 1 / (n0 - 3) + 1 / (n1 - 3)
+    if min(trials0, trials1) > 3:
+        z = (fisher(r1) - fisher(r0)) / np.sqrt(1 / (trials0 - 3) + 1 / (trials1 - 3))
+        merged['P_Value'] = np.where(merged['Level'] == 'trials', 2 * norm.sf(np.abs(z)), np.nan)
+    else:
+        merged['P_Value'] = np.nan
+    return merged
@@ -0,0 +1,379 @@
+"""
+Derived metrics: metrics defined by an expression over the columns of the preprocessed trials, e.g. the power of the
+CPU package that is not used by the cores or the energy-delay product of a trial:
+
+    "UNCORE_POWER (W)": "[CPU_POWER (W)] - sum_of([CORE*_POWER (W)])"
+    "CPU_EDP (J*s)": "total([DIFF_CPU_ENERGY (J)]) * duration"
+
+Expressions consist of:
+
+- [column]: a column of the trials. A * in the name matches several columns (e.g. [CORE*_POWER (W)]), such a column
+  set is combined element-wise with other sets of the same size and reduced with sum_of, mean_of, min_of or max_of,
+- numbers, +, -, *, /, ** and parentheses,
+- abs, sqrt, log, exp: element-wise functions,
+- total, mean, min, max, std: reductions of a series to one value per trial,
+- duration: the duration of a trial in seconds.
+
+A metric with a column outside of a reduction is a per-sample metric: it is added as a column to the trials, so it is
+aggregated and plotted like the other columns. Any other metric is a per-trial metric and added to trial_summary.csv,
+so it gets statistics in group_summary.csv and significance tests in group_comparison.csv.
+
+The metrics are defined in DERIVED_METRICS_FILE, a JSON object mapping the metric names to their expressions, and are
+evaluated in that order, so an expression can use the per-sample metrics defined before it. Every expression is
+compiled once and evaluated over all trials of a group at once, on (sample x trial) matrices with the shorter trials
+padded with NaN. Results are cached in the output folder of the group per expression and trial fingerprints.
+"""
+import ast
+import hashlib
+import json
+import os
+import re
+import warnings
+from functools import lru_cache
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from analysis import outliers, phases
+from models.trial import Trial
+
+DERIVED_METRICS_FILE = os.environ.get('DERIVED_METRICS_FILE', 'csv-data/derived_metrics.json')
+
+# Folder in the output folder of a group with the cached results
+CACHE_FOLDER = 'derived'
+
+_REFERENCE = re.compile(r'\[([^\[\]]+)]')
+_INVALID_NAME = re.compile(r'[/\\\[\]"\']')
+# Names of the placeholders the columns are replaced with, which an expression cannot use itself
+_PLACEHOLDER = re.compile(r'\b_c\d+\b')
+# Columns of trial_summary.csv and of the trials a metric cannot be named after, as it would clash with them (per-trial
+# metrics) or replace them (per-sample metrics)
+_RESERVED = re.compile(
+    r'^(Time|Delta|Trial|(DIFF_)?(CORE|LOGICAL)\d+_.+|CPU_(USAGE|FREQUENCY)_\d+|'
+    r'(CPU|CORE\d+)_(Total_Energy \(J\)|Peak_Power \(W\))|'
+    rf'CPU_({"|".join(phase.capitalize() for phase in phases.PHASES)})_(Energy \(J\)|Duration \(s\)|Mean_Power \(W\)))$')
+
+ELEMENTWISE: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'log': np.log,
+    'exp': np.exp
+}
+# Reductions of column sets, which are stacked on the first axis
+ACROSS_COLUMNS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    'sum_of': lambda values: np.sum(values, axis=0),
+    'mean_of': lambda values: np.mean(values, axis=0),
+    'min_of': lambda values: np.min(values, axis=0),
+    'max_of': lambda values: np.max(values, axis=0)
+}
+# Reductions over the samples of every trial, ignoring the padding
+PER_TRIAL: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    'total': lambda values: np.nansum(values, axis=0, keepdims=True),
+    'mean': lambda values: np.nanmean(values, axis=0, keepdims=True),
+    'min': lambda values: np.nanmin(values, axis=0, keepdims=True),
+    'max': lambda values: np.nanmax(values, axis=0, keepdims=True),
+    'std': lambda values: np.nanstd(values, axis=0, keepdims=True)
+}
+VARIABLES = ('duration',)
+
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)
+# Levels of sub-expressions, a combination has the highest level of its parts
+_LEVELS = ('constant', 'trial', 'sample')
+
+
+class DerivedMetric:
+    """
+    A derived metric, compiled from its expression.
+    """
+    name: str
+    expression: str
+    # 'sample' for per-sample metrics, 'trial' for per-trial metrics
+    level: str
+    # Column names or patterns (with *) in the order of the placeholders of the compiled expression
+    references: List[str]
+
+    def __init__(self, name: str, expression: str):
+        """
+        :param name: Name of the metric, the name of its column
+        :param expression: Expression of the metric, see the module documentation
+        :raises ValueError: When the name or the expression is not valid
+        """
+        if not isinstance(name, str) or not name or not isinstance(expression, str):
+            raise ValueError(f'Derived metric {name!r}: name and expression must be non-empty strings')
+        # The name is used in file names (plots) and panel templates
+        if _INVALID_NAME.search(name):
+            raise ValueError(f'Derived metric "{name}": the name must not contain / \\ [ ] or quotes')
+        if reserved(name):
+            raise ValueError(f'Derived metric "{name}": the name is a column of the trials or of trial_summary.csv')
+        placeholder_name = _PLACEHOLDER.search(_REFERENCE.sub(' ', expression))
+        if placeholder_name:
+            raise ValueError(f'Derived metric "{name}": unknown name "{placeholder_name.group()}", columns are written '
+                             f'as [column]')
+        self.name = name
+        self.expression = expression
+        self.references = []
+
+        def placeholder(match: re.Match) -> str:
+            self.references.append(match.group(1).strip())
+            return f'_c{len(self.references) - 1}'
+
+        try:
+            tree = ast.parse(_REFERENCE.sub(placeholder, expression).strip(), mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f'Derived metric "{name}": invalid expression "{expression}": {e.msg}') from e
+        level, is_set = self._check(tree.body)
+        if is_set:
+            raise ValueError(f'Derived metric "{name}": a column set must be reduced with '
+                             f'{", ".join(ACROSS_COLUMNS)}')
+        if level == 'constant':
+            raise ValueError(f'Derived metric "{name}": the expression does not use any column')
+        self.level = level
+        self._code = compile(tree, f'<derived metric {name}>', 'eval')
+
+    def _check(self, node: ast.AST) -> Tuple[str, bool]:
+        """
+        Check that a node of the expression only uses the elements of the language.
+
+        :return: Level of the node and whether it is a column set
+        """
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            # Numbers are evaluated as floats, so e.g. 9**9**9 overflows instead of computing a huge integer
+            try:
+                node.value = float(node.value)
+            except OverflowError:
+                raise ValueError(f'Derived metric "{self.name}": the number {node.value} is too large') from None
+            return 'constant', False
+        if isinstance(node, ast.Name):
+            if re.fullmatch(r'_c\d+', node.id):
+                return 'sample', '*' in self.references[int(node.id[2:])]
+            if node.id in VARIABLES:
+                return 'trial', False
+            raise ValueError(f'Derived metric "{self.name}": unknown name "{node.id}", columns are written as '
+                             f'[column]')
+        if isinstance(node, ast.BinOp) and isinstance(node.op, _OPERATORS):
+            (left, left_set), (right, right_set) = self._check(node.left), self._check(node.right)
+            return max(left, right, key=_LEVELS.index), left_set or right_set
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+            return self._check(node.operand)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            function = node.func.id
+            if len(node.args) != 1 or node.keywords:
+                raise ValueError(f'Derived metric "{self.name}": {function}() takes exactly one argument')
+            level, is_set = self._check(node.args[0])
+            if function in ELEMENTWISE:
+                return level, is_set
+            if function in ACROSS_COLUMNS:
+                if not is_set:
+                    raise ValueError(f'Derived metric "{self.name}": {function}() needs a column set, e.g. '
+                                     f'[CORE*_POWER (W)]')
+                return level, False
+            if function in PER_TRIAL:
+                if is_set:
+                    raise ValueError(f'Derived metric "{self.name}": reduce the column set before {function}()')
+                return 'trial', False
+            raise ValueError(f'Derived metric "{self.name}": unknown function "{function}"')
+        raise ValueError(f'Derived metric "{self.name}": unsupported expression "{ast.unparse(node)}"')
+
+    def key(self, trials: List[Trial], previous: str = '') -> str:
+        """
+        :param trials: Trials the metric is evaluated on
+        :param previous: Key of the metrics defined before this metric, which this metric may use
+        :return: Hash of the expression and the trial fingerprints
+        """
+        digest = hashlib.sha256('\n'.join([previous, self.name, self.expression]).encode())
+        for trial in trials:
+            digest.update(f'{trial.filename}:{trial.fingerprint()}\n'.encode())
+        return digest.hexdigest()
+
+    def evaluate(self, trials: List[Trial], matrices: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Evaluate the metric over all trials at once.
+
+        :param trials: Trials of a group
+        :param matrices: Column or pattern -> (sample x trial) matrix, or (column x sample x trial) for column sets,
+                         filled with the missing ones
+        :return: (sample x trial) matrix for a per-sample metric, one value per trial for a per-trial metric
+        :raises KeyError: When the trials do not have a referenced column
+        """
+        for reference in self.references:
+            if reference not in matrices:
+                matrices[reference] = _matrix(trials, reference)
+        lengths = [len(trial.preprocessed_data) for trial in trials]
+        if 'duration' not in matrices:
+            matrices['duration'] = np.array([[trial.column('Delta').sum() / 1000 for trial in trials]], dtype=float)
+
+        namespace: Dict[str, Any] = {f'_c{index}': matrices[reference] for index, reference in
+                                     enumerate(self.references)}
+        namespace.update(ELEMENTWISE)
+        namespace.update(ACROSS_COLUMNS)
+        namespace.update(PER_TRIAL)
+        namespace['duration'] = matrices['duration']
+        with warnings.catch_warnings(), np.errstate(all='ignore'):
+            # Reductions of the padding of shorter trials warn about empty slices
+            warnings.simplefilter('ignore', RuntimeWarning)
+            try:
+                result = eval(self._code, {'__builtins__': {}}, namespace)
+            except ValueError as e:
+                raise ValueError(f'Derived metric "{self.name}": {e}') from e
+        result = np.asarray(result, dtype=np.float64)
+        if self.level == 'trial':
+            return np.broadcast_to(result, (1, len(trials)))[0].copy()
+        return np.broadcast_to(result, (max(lengths), len(trials))).copy()
+
+
+@lru_cache(maxsize=None)
+def compile_metric(name: str, expression: str) -> DerivedMetric:
+    """
+    :return: The compiled metric, compiled only once per name and expression
+    """
+    return DerivedMetric(name, expression)
+
+
+def _matrix(trials: List[Trial], reference: str) -> np.ndarray:
+    rows = max(len(trial.preprocessed_data) for trial in trials)
+    if '*' in reference:
+        pattern = re.compile('^' + '.*'.join(re.escape(part) for part in reference.split('*')) + '$')
+        columns = [column for column in trials[0].columns if pattern.match(column)]
+        if not columns:
+            raise KeyError(reference)
+        return np.stack([_matrix(trials, column) for column in columns])
+    matrix = np.full((rows, len(trials)), np.nan)
+    for index, trial in enumerate(trials):
+        if reference not in trial.columns:
+            raise KeyError(reference)
+        matrix[:len(trial.preprocessed_data), index] = trial.column(reference).to_numpy(dtype=np.float64)
+    return matrix
+
+
+def reserved(name: str, columns: Collection[str] = ()) -> bool:
+    """
+    :param name: Name of a metric
+    :param columns: Further columns of the trials, e.g. of the groups that are ingested
+    :return: Whether a metric cannot have the name, as it is a column of the trials or of trial_summary.csv
+    """
+    return bool(_RESERVED.match(name)) or name in outliers.DECISION_COLUMNS or name in columns
+
+
+def parse_metrics(definitions: Dict[str, str]) -> List[DerivedMetric]:
+    """
+    :param definitions: Metric name -> expression
+    :return: The compiled metrics, in order
+    :raises ValueError: When an expression is not valid
+    """
+    if not isinstance(definitions, dict) \
+            or not all(isinstance(expression, str) for expression in definitions.values()):
+        raise ValueError('Derived metrics must be a JSON object mapping metric names to expressions')
+    return [compile_metric(name, expression) for name, expression in definitions.items()]
+
+
+def load_metrics(path: Optional[str] = None, skip_invalid: bool = False) -> List[DerivedMetric]:
+    """
+    :param path: Path of the definitions, DERIVED_METRICS_FILE if None
+    :param skip_invalid: Skip the metrics that are not valid instead of raising a ValueError
+    :return: The compiled metrics, none when the file does not exist
+    """
+    path = path or DERIVED_METRICS_FILE
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as file:
+        definitions = json.load(file)
+    if not skip_invalid:
+        return parse_metrics(definitions)
+    metrics = []
+    for name, expression in (definitions.items() if isinstance(definitions, dict) else []):
+        try:
+            metrics.extend(parse_metrics({name: expression}))
+        except ValueError as e:
+            print(f'{e}, the metric is skipped')
+    return metrics
+
+
+def save_metrics(definitions: Dict[str, str], path: Optional[str] = None,
+                 columns: Collection[str] = ()) -> List[DerivedMetric]:
+    """
+    Check and save metric definitions.
+
+    :param definitions: Metric name -> expression
+    :param path: Path of the definitions, DERIVED_METRICS_FILE if None
+    :param columns: Columns of the trials of the groups, which a metric cannot be named after
+    :return: The compiled metrics
+    :raises ValueError: When a name or an expression is not valid, nothing is saved then
+    """
+    metrics = parse_metrics(definitions)
+    for metric in metrics:
+        if reserved(metric.name, columns):
+            raise ValueError(f'Derived metric "{metric.name}": the name is a column of the trials')
+    with open(path or DERIVED_METRICS_FILE, 'w') as file:
+        json.dump(definitions, file, indent=2)
+    return metrics
+
+
+def _cached(path: str, key: str) -> Optional[np.ndarray]:
+    try:
+        with np.load(path) as cached:
+            if str(cached['key']) == key:
+                return cached['values']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def derive(trials: List[Trial], output_folder: str, metrics: Optional[List[DerivedMetric]] = None,
+           columns: Collection[str] = ()) -> Tuple[List[str], pd.DataFrame]:
+    """
+    Evaluate the derived metrics for the trials of a group. Per-sample metrics are added as columns to the trials.
+    Metrics whose columns the trials do not have, that are named after a column of the trials or that fail to
+    evaluate are skipped, so one metric cannot fail the ingestion of the group.
+
+    :param trials: Trials of a group
+    :param output_folder: Output folder of the group, where the results are cached
+    :param metrics: Metrics to evaluate, the valid metrics of DERIVED_METRICS_FILE if None
+    :param columns: Further columns added to the trials, which a metric cannot be named after
+    :return: Names of the per-sample metrics added to the trials, and a DataFrame indexed by trial name with the
+             per-trial metrics
+    """
+    metrics = load_metrics(skip_invalid=True) if metrics is None else metrics
+    names = [trial.filename for trial in trials]
+    per_sample = []
+    per_trial = pd.DataFrame(index=pd.Index(names, name='Trial'))
+    if not metrics:
+        return per_sample, per_trial
+
+    cache_folder = os.path.join(output_folder, CACHE_FOLDER)
+    os.makedirs(cache_folder, exist_ok=True)
+    matrices: Dict[str, np.ndarray] = {}
+    # The columns of the preprocessed files, derived columns of an earlier ingestion of the trials are replaced
+    measured = [column for column in trials[0].columns if column not in trials[0].added_columns]
+    previous = ''
+    for metric in metrics:
+        if reserved(metric.name, measured + list(columns)):
+            print(f'Derived metric "{metric.name}" skipped, the trials already have a column with its name')
+            continue
+        previous = key = metric.key(trials, previous)
+        path = os.path.join(cache_folder, f'{hashlib.sha256(metric.name.encode()).hexdigest()[:16]}.npz')
+        values = _cached(path, key)
+        if values is None:
+            try:
+                values = metric.evaluate(trials, matrices)
+            except KeyError as e:
+                print(f'Derived metric "{metric.name}" skipped, the trials have no column {e}')
+                continue
+            except Exception as e:  # e.g. column sets of different sizes or an overflow
+                print(f'Derived metric "{metric.name}" skipped, it failed to evaluate: {e}')
+                continue
+            np.savez(path, key=key, values=values)
+
+        if metric.level == 'trial':
+            per_trial[metric.name] = values
+        else:
+            # Later metrics may use this metric
+            matrices[metric.name] = values
+            per_sample.append(metric.name)
+
+    # The per-sample metrics are added to the trials at once, so the trial data is compacted only once
+    if per_sample:
+        for index, trial in enumerate(trials):
+            trial.add_columns({name: matrices[name][:len(trial.preprocessed_data), index] for name in per_sample})
+    return per_sample, per_trial
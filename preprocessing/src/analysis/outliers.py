@@ -0,0 +1,215 @@
+"""
+Detection of outlier trials, e.g. a trial disturbed by a background update, before a group is aggregated.
+
+Every trial gets two robust z-scores (based on the median and the median absolute deviation instead of the mean and the
+standard deviation, so the outliers do not hide themselves):
+
+- energy_z: z-score of the total CPU energy of the trial among the trials of the group,
+- deviation_z: z-score of the mean deviation of the trial from the per-timestep median of all trials, the highest over
+  the power columns.
+
+A trial is an outlier when the absolute energy_z or the deviation_z is above the threshold of the policy of its group.
+The scores only depend on the trials, so they are cached and changing the policy does not scan the data again.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from analysis.alignment import shifted_slices
+from models.trial import Trial
+
+OUTLIER_MODE = os.environ.get('OUTLIER_MODE', 'flag')
+OUTLIER_THRESHOLD = float(os.environ.get('OUTLIER_THRESHOLD', '3.5'))
+
+# off: no detection, flag: outliers are marked in trial_summary.csv, exclude: outliers are also left out of the
+# aggregate data and the group summary
+MODES = ('off', 'flag', 'exclude')
+
+# Columns with the outlier decisions in trial_summary.csv
+SCORE_COLUMNS = ['Outlier_Energy_Z', 'Outlier_Deviation_Z']
+DECISION_COLUMNS = SCORE_COLUMNS + ['Outlier', 'Excluded']
+
+# Scale of the median absolute deviation that makes it a consistent estimator of the standard deviation
+MAD_SCALE = 1.4826
+
+# Robust z-scores need a few trials to estimate the spread
+MIN_TRIALS = 3
+
+POLICY_FILE = 'outliers.json'
+SCORES_FILE = 'outlier_scores.json'
+# Part of the key of the cached scores, to be increased whenever the scoring changes
+SCORES_VERSION = 1
+
+
+class OutlierPolicy:
+    """
+    Outlier policy of a group, stored as outliers.json in the input folder of the group.
+    """
+    mode: str
+    threshold: float
+
+    def __init__(self, mode: str = OUTLIER_MODE, threshold: float = OUTLIER_THRESHOLD):
+        if mode not in MODES:
+            raise ValueError(f'Unknown outlier mode "{mode}", valid modes are: {list(MODES)}')
+        if not threshold > 0:
+            raise ValueError(f'Outlier threshold must be positive, got {threshold}')
+        self.mode = mode
+        self.threshold = float(threshold)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'OutlierPolicy':
+        return cls(str(data.get('mode', OUTLIER_MODE)), float(data.get('threshold', OUTLIER_THRESHOLD)))
+
+    def to_dict(self) -> dict:
+        return {'mode': self.mode, 'threshold': self.threshold}
+
+    @classmethod
+    def load(cls, folder: str) -> 'OutlierPolicy':
+        """
+        :param folder: Input folder of the group
+        :return: Policy of the group, the default policy (OUTLIER_MODE, OUTLIER_THRESHOLD) if it has none
+        """
+        path = os.path.join(folder, POLICY_FILE)
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r') as file:
+            return cls.from_dict(json.load(file))
+
+    def save(self, folder: str) -> None:
+        """
+        :param folder: Input folder of the group
+        """
+        with open(os.path.join(folder, POLICY_FILE), 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+def robust_z(values: np.ndarray) -> np.ndarray:
+    """
+    :param values: Values, one per trial
+    :return: Robust z-scores (value - median) / (1.4826 * MAD), 0 for all values when the MAD is 0
+    """
+    median = np.nanmedian(values)
+    mad = np.nanmedian(np.abs(values - median)) * MAD_SCALE
+    if not mad > 0:
+        return np.zeros(len(values))
+    return (values - median) / mad
+
+
+def power_columns(trial: Trial) -> List[str]:
+    """
+    :param trial: A trial of the group
+    :return: The measured power columns the deviation of the trials is measured on, without the columns attributed
+             or derived from them
+    """
+    return trial.measured_columns('power')
+
+
+def score_trials(trials: List[Trial], columns: List[str], lags: Optional[Dict[str, int]] = None) -> pd.DataFrame:
+    """
+    Score all trials in one vectorized pass over a (trials x time x column) block. Trials are shifted by their lag,
+    like in the aggregation, and shorter trials are padded with NaN, which is ignored.
+
+    :param trials: Trials of a group
+    :param columns: Power columns to measure the deviation on
+    :param lags: Lag in samples per trial name, None if the trials are not aligned
+    :return: DataFrame indexed by trial name with the columns energy_z and deviation_z
+    """
+    lags = lags or {}
+    lengths = [len(trial.preprocessed_data) for trial in trials]
+    block = np.full((len(trials), max(lengths), len(columns)), np.nan)
+    for index, trial in enumerate(trials):
+        source, destination = shifted_slices(lengths[index], lags.get(trial.filename, 0), block.shape[1])
+        for column_index, column in enumerate(columns):
+            block[index, destination, column_index] = trial.column(column).to_numpy(dtype=np.float64)[source]
+    block[~np.isfinite(block)] = np.nan
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Per timestep and column: median and MAD over the trials. Timesteps where (almost) all trials have the same
+        # value carry no information on the spread and are left out
+        deviation = np.abs(block - np.nanmedian(block, axis=0))
+        mad = np.nanmedian(deviation, axis=0) * MAD_SCALE
+        z = deviation / np.where(mad > 0, mad, np.nan)
+        # Mean deviation of every trial per column, so a deviation in one column is not averaged away by the others
+        mean_deviation = np.nanmean(z, axis=1)
+    mean_deviation[np.isnan(mean_deviation)] = 0
+    deviation_z = np.max([robust_z(mean_deviation[:, column]) for column in range(len(columns))], axis=0,
+                         initial=0.0)
+
+    energy = np.array([trial.column('DIFF_CPU_ENERGY (J)').sum() for trial in trials], dtype=np.float64)
+    return pd.DataFrame({'energy_z': robust_z(energy), 'deviation_z': deviation_z},
+                        index=[trial.filename for trial in trials])
+
+
+def _scores_key(trials: List[Trial], columns: List[str], lags: Dict[str, int]) -> str:
+    digest = hashlib.sha256('\n'.join([str(SCORES_VERSION)] + columns).encode())
+    for fingerprint in sorted(f'{trial.filename}:{trial.fingerprint()}:{lags.get(trial.filename, 0)}'
+                              for trial in trials):
+        digest.update(fingerprint.encode())
+    return digest.hexdigest()
+
+
+def cached_scores(trials: List[Trial], output_folder: str, lags: Optional[Dict[str, int]] = None) -> pd.DataFrame:
+    """
+    Scores of the trials, computed only when the trials or their lags changed since they were last scored.
+
+    :param trials: Trials of a group
+    :param output_folder: Output folder of the group, where the scores are cached
+    :param lags: Lag in samples per trial name, None if the trials are not aligned
+    :return: DataFrame indexed by trial name with the columns energy_z and deviation_z
+    """
+    lags = lags or {}
+    columns = power_columns(trials[0])
+    key = _scores_key(trials, columns, lags)
+    path = os.path.join(output_folder, SCORES_FILE)
+    try:
+        with open(path, 'r') as file:
+            cached = json.load(file)
+        if cached.get('key') == key:
+            return pd.DataFrame.from_dict(cached['scores'], orient='index')
+    except (OSError, ValueError, KeyError):
+        pass
+
+    scores = score_trials(trials, columns, lags)
+    with open(path, 'w') as file:
+        json.dump({'key': key, 'columns': columns, 'scores': scores.to_dict(orient='index')}, file, indent=2)
+    return scores
+
+
+def decide(trials: List[Trial], output_folder: str, policy: OutlierPolicy,
+           lags: Optional[Dict[str, int]] = None) -> pd.DataFrame:
+    """
+    Decide which trials are outliers according to the policy of the group.
+
+    :param trials: Trials of a group
+    :param output_folder: Output folder of the group, where the scores are cached
+    :param policy: Outlier policy of the group
+    :param lags: Lag in samples per trial name, None if the trials are not aligned
+    :return: DataFrame indexed by trial name with the DECISION_COLUMNS
+    """
+    names = [trial.filename for trial in trials]
+    if policy.mode == 'off' or len(trials) < MIN_TRIALS:
+        return pd.DataFrame({'Outlier_Energy_Z': np.nan, 'Outlier_Deviation_Z': np.nan, 'Outlier': 0, 'Excluded': 0},
+                            index=names)
+
+    scores = cached_scores(trials, output_folder, lags).loc[names]
+    outlier = (scores['energy_z'].abs() > policy.threshold) | (scores['deviation_z'] > policy.threshold)
+    return pd.DataFrame({
+        'Outlier_Energy_Z': scores['energy_z'],
+        'Outlier_Deviation_Z': scores['deviation_z'],
+        'Outlier': outlier.astype(int),
+        'Excluded': (outlier & (policy.mode == 'exclude')).astype(int)
+    }, index=names)
+
+
+def included(trial_summary: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param trial_summary: Contents of a trial_summary.csv
+    :return: The rows of the trials that are not excluded, without the decision columns
+    """
+    if 'Excluded' in trial_summary.columns:
+        trial_summary = trial_summary[trial_summary['Excluded'] != 1]
+    return trial_summary.drop(columns=DECISION_COLUMNS, errors='ignore')
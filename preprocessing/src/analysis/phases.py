@@ -0,0 +1,210 @@
+"""
+Segmentation of the trials into the phases of a workload, so idle warm-up and tear-down do not dilute the comparison
+of the part of a run that matters.
+
+The CPU_POWER (W) series of a trial is split where its mean changes by PELT (see kernels.change_points). Samples
+without a duration (Delta 0, such as the padding rows at the start and end of a trial) have no power, so they are left
+out of the segmentation and of the energy and duration of the phases. The segments are labelled by their median
+power relative to the power range of the trial, and neighbouring segments in the same band (below IDLE_LEVEL, between
+IDLE_LEVEL and STEADY_LEVEL, at or above STEADY_LEVEL) are merged:
+
+- steady: the longest merged segment at or above STEADY_LEVEL, so short spikes elsewhere in the run do not stretch it,
+- idle: the merged segment at the start if it is below IDLE_LEVEL,
+- ramp: the segments between idle and steady,
+- tail: the segments after steady (ramp down and idle after the workload).
+
+Each phase is one contiguous range of samples, and phases may be empty. A trial without a clear change in power is
+steady as a whole.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import kernels
+from models.trial import Trial
+
+# Penalty per change point, in multiples of the noise variance times the log of the length of the trial (BIC like)
+PHASE_PENALTY = float(os.environ.get('PHASE_PENALTY', '2'))
+# Smallest number of samples of a segment
+PHASE_MIN_SAMPLES = int(os.environ.get('PHASE_MIN_SAMPLES', '3'))
+# Number of threads segmenting the trials of a group
+PHASE_WORKERS = int(os.environ.get('PHASE_WORKERS', str(os.cpu_count() or 1)))
+
+PHASES = ('idle', 'ramp', 'steady', 'tail')
+
+PHASE_COLUMN = 'CPU_POWER (W)'
+
+# Levels of the segment means as a fraction of the power range of the trial (5th to 95th percentile)
+IDLE_LEVEL = 0.2
+STEADY_LEVEL = 0.5
+
+# Scale of the median absolute deviation that makes it a consistent estimator of the standard deviation
+MAD_SCALE = 1.4826
+
+
+class TrialPhases:
+    """
+    Phases of a trial as ranges of samples.
+    """
+    # Indices where a new segment of constant mean power starts, without 0
+    change_points: np.ndarray
+    # Phase -> (first sample, end sample), empty phases have first == end
+    ranges: Dict[str, Tuple[int, int]]
+
+    def __init__(self, change_points: np.ndarray, ranges: Dict[str, Tuple[int, int]]):
+        self.change_points = change_points
+        self.ranges = ranges
+
+
+def column(phase: str, quantity: str) -> str:
+    """
+    :param phase: One of PHASES
+    :param quantity: "Energy (J)", "Duration (s)" or "Mean_Power (W)"
+    :return: Name of the column of the phase in trial_summary.csv, e.g. "CPU_Steady_Energy (J)"
+    """
+    return f'CPU_{phase.capitalize()}_{quantity}'
+
+
+def noise_level(values: np.ndarray) -> float:
+    """
+    :param values: Series of a trial
+    :return: Robust estimate of the standard deviation of the noise, from the differences of consecutive samples, so
+             it is not inflated by the changes of the mean
+    """
+    if len(values) < 3:
+        return 0.0
+    differences = np.diff(values)
+    return float(np.median(np.abs(differences - np.median(differences))) * MAD_SCALE / np.sqrt(2))
+
+
+def label(values: np.ndarray, change_points: np.ndarray) -> Dict[str, Tuple[int, int]]:
+    """
+    Label the segments of a series with the phases.
+
+    :param values: Series of a trial
+    :param change_points: Change points of the series
+    :return: Phase -> (first sample, end sample)
+    """
+    n = len(values)
+    bounds = np.concatenate(([0], change_points, [n])).astype(np.int64)
+    low, high = np.percentile(values, [5, 95]) if n > 0 else (0.0, 0.0)
+    # Without a clear change in power (within twice the noise), the whole trial is steady
+    if len(bounds) < 3 or high - low <= 2 * noise_level(values):
+        return {'idle': (0, 0), 'ramp': (0, 0), 'steady': (0, n), 'tail': (n, n)}
+
+    # The median is not pulled by the outliers in a segment
+    levels = np.array([(np.median(values[start:end]) - low) / (high - low)
+                       for start, end in zip(bounds[:-1], bounds[1:])])
+    bands = np.digitize(levels, [IDLE_LEVEL, STEADY_LEVEL])
+    # Merge neighbouring segments in the same band
+    keep = np.concatenate(([True], bands[1:] != bands[:-1]))
+    bounds = np.concatenate((bounds[:-1][keep], [n]))
+    bands = bands[keep]
+    lengths = np.diff(bounds)
+
+    candidates = np.flatnonzero(bands == 2)
+    if len(candidates) == 0:
+        candidates = np.arange(len(bands))
+    steady = int(candidates[np.argmax(lengths[candidates])])
+    idle = 1 if steady > 0 and bands[0] == 0 else 0
+    return {
+        'idle': (0, int(bounds[idle])),
+        'ramp': (int(bounds[idle]), int(bounds[steady])),
+        'steady': (int(bounds[steady]), int(bounds[steady + 1])),
+        'tail': (int(bounds[steady + 1]), n)
+    }
+
+
+def change_point_penalty(values: np.ndarray, scale: float = PHASE_PENALTY) -> float:
+    """
+    :param values: Series of a trial
+    :param scale: See PHASE_PENALTY
+    :return: Penalty per change point of the series
+    """
+    # A small floor keeps the penalty positive for noiseless (e.g. synthetic) series
+    variance = max(noise_level(values) ** 2, 1e-9 * max(float(values.var()) if len(values) else 0.0, 1.0))
+    return scale * variance * np.log(max(len(values), 2))
+
+
+def segment(trial: Trial, scale: float = PHASE_PENALTY, min_size: int = PHASE_MIN_SAMPLES) -> TrialPhases:
+    """
+    :param trial: Preprocessed trial
+    :param scale: Scale of the penalty per change point, see PHASE_PENALTY
+    :param min_size: Smallest number of samples of a segment
+    :return: Phases of the trial
+    """
+    return segment_series(trial.column(PHASE_COLUMN).to_numpy(dtype=np.float64),
+                          trial.column('Delta').to_numpy(dtype=np.float64), scale, min_size)
+
+
+def segment_series(power: np.ndarray, deltas: np.ndarray, scale: float = PHASE_PENALTY,
+                   min_size: int = PHASE_MIN_SAMPLES) -> TrialPhases:
+    """
+    :param power: Power series of a trial
+    :param deltas: Duration of every sample in ms
+    :param scale: Scale of the penalty per change point, see PHASE_PENALTY
+    :param min_size: Smallest number of samples of a segment
+    :return: Phases of the trial, with the samples without a duration in the phase of the next sample with one
+    """
+    n = len(power)
+    # Indices of the samples with a duration, the segmentation runs on these only
+    rows = np.flatnonzero(deltas > 0)
+    values = power[rows]
+    values = np.where(np.isfinite(values), values, 0)
+    change_points = kernels.change_points(values, change_point_penalty(values, scale), min_size)
+
+    def position(bound: int) -> int:
+        # Position in the trial of a bound in the samples with a duration
+        return 0 if bound == 0 else n if bound >= len(rows) else int(rows[bound])
+
+    ranges = {phase: (position(start), position(end)) for phase, (start, end) in label(values, change_points).items()}
+    return TrialPhases(rows[change_points].astype(np.int64), ranges)
+
+
+def segment_trials(trials: List[Trial], workers: int = PHASE_WORKERS) -> Dict[str, TrialPhases]:
+    """
+    Segment all trials of a group, in parallel threads. The compiled kernel releases the GIL, so the threads run at
+    the same time with the numba kernel backend.
+
+    :param trials: Trials of a group
+    :param workers: Number of threads
+    :return: Trial name -> phases
+    """
+    # The kernel backend is selected per thread, so the threads use the backend of the caller
+    backend = kernels.get_backend().name
+
+    def run(trial: Trial) -> TrialPhases:
+        with kernels.using(backend):
+            return segment(trial)
+
+    if workers > 1 and len(trials) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(trials))) as executor:
+            results = list(executor.map(run, trials))
+    else:
+        results = [segment(trial) for trial in trials]
+    return {trial.filename: phases for trial, phases in zip(trials, results)}
+
+
+def summarize(trial: Trial, phases: Optional[TrialPhases] = None) -> dict:
+    """
+    Energy, duration and mean power of every phase of a trial.
+
+    :param trial: Preprocessed trial
+    :param phases: Phases of the trial, segmented if None
+    :return: Dictionary with the columns of the phases (see column())
+    """
+    phases = phases or segment(trial)
+    deltas = trial.column('Delta').to_numpy(dtype=np.float64)
+    # Energy and duration are summed over the same samples: energy of samples without a duration is left out
+    energy = np.where(deltas > 0, trial.column('DIFF_CPU_ENERGY (J)').to_numpy(dtype=np.float64), 0)
+    summary = {}
+    for phase in PHASES:
+        start, end = phases.ranges[phase]
+        phase_energy = float(np.nansum(energy[start:end]))
+        duration = float(deltas[start:end].sum()) / 1000
+        summary[column(phase, 'Energy (J)')] = phase_energy
+        summary[column(phase, 'Duration (s)')] = duration
+        summary[column(phase, 'Mean_Power (W)')] = phase_energy / duration if duration > 0 else None
+    return summary
@@ -0,0 +1,208 @@
+"""
+Group-sequential comparison of two groups, re-evaluated every time a new trial arrives.
+"""
+import math
+import os
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, ttest_ind
+
+import artifacts
+from models.group import Group
+from models.trial import Trial
+
+
+class SequentialTest:
+    """
+    Group-sequential A/B test on the trial summaries of two groups.
+
+    The test looks at the data after every new trial (pair). At each look the Welch t-test p-value of a metric is
+    compared to the nominal level of that look: the increment of a Lan-DeMets O'Brien-Fleming alpha spending function
+    over the planned maximum number of trials. Using the increments keeps the overall type I error at or below alpha,
+    no matter how often the harness looks. Metrics that are not decided yet get a power analysis on the observed
+    effect size, estimating how many trials per group are needed to detect it.
+    """
+    metrics = ["CPU_Total_Energy (J)", "CPU_Peak_Power (W)"]
+
+    DIFFERENT = "different"
+    NO_DIFFERENCE = "no_difference"
+    CONTINUE = "continue"
+
+    group_name0: str
+    group_name1: str
+    max_trials: int
+    min_trials: int
+    alpha: float
+    power: float
+    futility: bool
+
+    # Number of trials per group available in the last run
+    trials_available: int
+
+    def __init__(self, group_name0: str, group_name1: str, max_trials: int = 30, min_trials: int = 3,
+                 alpha: float = 0.05, power: float = 0.8, futility: bool = True) -> None:
+        """
+        :param group_name0: Name of the first group (folder in the input folder)
+        :param group_name1: Name of the second group (folder in the input folder)
+        :param max_trials: Planned maximum number of trials per group
+        :param min_trials: Number of trials per group before the first look
+        :param alpha: Overall significance level
+        :param power: Power used to estimate the number of trials needed
+        :param futility: Stop with "no difference" when the budget is too small to detect the observed effect
+        """
+        if min_trials < 2:
+            raise ValueError("Sequential test requires at least 2 trials per group before the first look.")
+        if max_trials < min_trials:
+            raise ValueError("Maximum number of trials must be at least the minimum number of trials.")
+        self.group_name0 = group_name0
+        self.group_name1 = group_name1
+        self.max_trials = max_trials
+        self.min_trials = min_trials
+        self.alpha = alpha
+        self.power = power
+        self.futility = futility
+        self.trials_available = 0
+
+    @staticmethod
+    def load_trial_summaries(group_name: str) -> pd.DataFrame:
+        """
+        Preprocess and summarize all trials of a group in the order in which they arrived (file modification time).
+
+        :param group_name: Name of the group (folder in the input folder)
+        :return: DataFrame with one summary row per trial, in arrival order
+        """
+        folder_path = os.path.join(Group.input_folder, group_name)
+        if not os.path.exists(folder_path):
+            raise FileNotFoundError(f'Group folder {folder_path} does not exist.')
+        os.makedirs(os.path.join(Group.output_folder, group_name), exist_ok=True)
+
+        paths = sorted(Group.trial_paths(group_name), key=lambda p: (os.path.getmtime(p[0]), p[0]))
+        return pd.DataFrame([Group.summarize_trial(Trial(input_path, output_path)) for input_path, output_path in paths])
+
+    def spent_alpha(self, information: float) -> float:
+        """
+        O'Brien-Fleming type alpha spending function (Lan-DeMets).
+
+        :param information: Information fraction, the number of trials relative to the maximum number of trials
+        :return: Cumulative alpha that may be spent at this information fraction
+        """
+        if information <= 0:
+            return 0.0
+        information = min(information, 1.0)
+        return float(2 - 2 * norm.cdf(norm.ppf(1 - self.alpha / 2) / math.sqrt(information)))
+
+    def required_trials(self, sample0: pd.Series, sample1: pd.Series) -> float:
+        """
+        Estimate the number of trials per group needed to detect the observed difference with a two-sided test.
+
+        :param sample0: Observed values of the first group
+        :param sample1: Observed values of the second group
+        :return: Number of trials per group, infinite if there is no observed difference
+        """
+        difference = abs(sample1.mean() - sample0.mean())
+        pooled_std = math.sqrt((sample0.var() + sample1.var()) / 2)
+        if difference == 0 or np.isnan(difference):
+            return math.inf
+        if pooled_std == 0 or np.isnan(pooled_std):
+            return float(max(len(sample0), len(sample1)))
+        effect_size = difference / pooled_std
+        z_sum = norm.ppf(1 - self.alpha / 2) + norm.ppf(self.power)
+        return float(math.ceil(2 * (z_sum / effect_size) ** 2))
+
+    def run(self, summaries0: Optional[pd.DataFrame] = None,
+            summaries1: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        Replay all looks on the trials that have arrived so far and save the result to output_path().
+
+        :param summaries0: Trial summaries of the first group in arrival order, loaded from disk if omitted
+        :param summaries1: Trial summaries of the second group in arrival order, loaded from disk if omitted
+        :return: DataFrame with one row per look and metric
+        """
+        if summaries0 is None:
+            summaries0 = self.load_trial_summaries(self.group_name0)
+        if summaries1 is None:
+            summaries1 = self.load_trial_summaries(self.group_name1)
+
+        looks = min(len(summaries0), len(summaries1), self.max_trials)
+        self.trials_available = looks
+        decisions = {metric: self.CONTINUE for metric in self.metrics}
+        previous_spent = 0.0
+        rows = []
+
+        for n in range(self.min_trials, looks + 1):
+            information = n / self.max_trials
+            spent = self.spent_alpha(information)
+            nominal_alpha = spent - previous_spent
+            previous_spent = spent
+
+            for metric in self.metrics:
+                sample0 = summaries0[metric].iloc[:n].dropna()
+                sample1 = summaries1[metric].iloc[:n].dropna()
+                _, pval = ttest_ind(sample0, sample1, equal_var=False, alternative='two-sided')
+                required = self.required_trials(sample0, sample1)
+
+                # A decision is final, later looks only report it
+                if decisions[metric] == self.CONTINUE:
+                    if pval <= nominal_alpha:
+                        decisions[metric] = self.DIFFERENT
+                    elif n >= self.max_trials:
+                        decisions[metric] = self.NO_DIFFERENCE
+                    elif self.futility and information >= 0.5 and required > self.max_trials:
+                        decisions[metric] = self.NO_DIFFERENCE
+
+                additional = 0
+                if decisions[metric] == self.CONTINUE:
+                    additional = int(min(max(required - n, 1), self.max_trials - n))
+
+                rows.append({
+                    "Trials": n,
+                    "Metric": metric,
+                    f"Mean_{self.group_name0}": sample0.mean(),
+                    f"Mean_{self.group_name1}": sample1.mean(),
+                    "Rel_Diff": abs(sample1.mean() - sample0.mean()) / abs(sample0.mean())
+                    if sample0.mean() != 0 else float("inf"),
+                    "P_Value": pval,
+                    "Nominal_Alpha": nominal_alpha,
+                    "Spent_Alpha": spent,
+                    "Required_Trials": required,
+                    "Additional_Trials": additional,
+                    "Decision": decisions[metric]
+                })
+
+        results = pd.DataFrame(rows)
+
+        output_path = self.output_path()
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        results.to_csv(output_path, index=False)
+        artifacts.publish(output_path)
+        return results
+
+    def output_path(self) -> str:
+        """
+        :return: Path of the results, in the comparison folder <group0>_vs_<group1> of the output folder
+        """
+        return os.path.join(Group.output_folder, f"{self.group_name0}_vs_{self.group_name1}", "sequential_test.csv")
+
+    def latest(self, results: pd.DataFrame) -> List[Dict[str, Any]]:
+        """
+        Get the outcome of the most recent look for every metric.
+
+        :param results: Result of run()
+        :return: List with a dictionary per metric
+        """
+        if results.empty:
+            return [{"Trials": self.trials_available, "Metric": metric, "Decision": self.CONTINUE,
+                     "Additional_Trials": self.min_trials - self.trials_available} for metric in self.metrics]
+        last = results[results["Trials"] == results["Trials"].max()]
+        return last.to_dict(orient="records")
+
+    def is_decided(self, results: pd.DataFrame) -> bool:
+        """
+        Check whether every metric has been decided, meaning the benchmark harness can stop running trials.
+
+        :param results: Result of run()
+        :return: True if no metric needs more trials
+        """
+        return all(row["Decision"] != self.CONTINUE for row in self.latest(results))
@@ -0,0 +1,131 @@
+"""
+Power spectral densities of the power columns of a group, to find periodic behaviour of a workload such as timer or
+garbage collection storms.
+
+The spectra are estimated by Welch's method: every trial is cut into overlapping segments of SPECTRUM_SEGMENT
+samples, each segment is detrended (its mean removed) and multiplied by a Hann window, and the squared magnitudes of
+their Fourier transforms are averaged. The segments of all trials and columns are transformed in one batched rFFT
+over the aligned (trials x columns x time) block, and the spectra of the trials are aggregated per frequency into the
+median and quartiles of the group.
+
+Welch's method assumes evenly spaced samples, so the sample rate is taken from the median Delta of the trials.
+"""
+import os
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from analysis.alignment import shifted_slices
+from models.trial import Trial
+
+# Number of samples per Welch segment, the frequency resolution is the sample rate divided by this number
+SPECTRUM_SEGMENT = int(os.environ.get('SPECTRUM_SEGMENT', '64'))
+# Overlap of consecutive segments, as a fraction of the segment
+SPECTRUM_OVERLAP = float(os.environ.get('SPECTRUM_OVERLAP', '0.5'))
+
+SPECTRUM_FILE = 'spectrum_data.csv'
+FREQUENCY_COLUMN = 'Frequency (Hz)'
+
+# Statistics of the spectra of the trials per frequency, named like in aggregate_data.csv
+STATISTICS = {'median': 0.5, 'LQ': 0.25, 'UQ': 0.75}
+
+
+def spectrum_columns(trial: Trial) -> List[str]:
+    """
+    :param trial: A trial of the group
+    :return: The columns the spectra are computed of: CPU_POWER (W) and the power of every core
+    """
+    return trial.measured_columns('power')
+
+
+def sample_rate(trials: List[Trial]) -> float:
+    """
+    :param trials: Trials of a group
+    :return: Samples per second, from the median Delta (ms) of all samples of the trials
+    """
+    deltas = np.concatenate([trial.column('Delta').to_numpy(dtype=np.float64) for trial in trials])
+    deltas = deltas[np.isfinite(deltas) & (deltas > 0)]
+    return 1000 / float(np.median(deltas)) if len(deltas) else 1.0
+
+
+def _block(trials: List[Trial], columns: List[str], lags: Dict[str, int]) -> np.ndarray:
+    """
+    :return: (trials x columns x time) block of the columns, trials shifted by their lag and padded with NaN
+    """
+    lengths = [len(trial.preprocessed_data) for trial in trials]
+    block = np.full((len(trials), len(columns), max(lengths)), np.nan)
+    for index, trial in enumerate(trials):
+        source, destination = shifted_slices(lengths[index], lags.get(trial.filename, 0), block.shape[2])
+        for column_index, column in enumerate(columns):
+            block[index, column_index, destination] = trial.column(column).to_numpy(dtype=np.float64)[source]
+    return block
+
+
+def welch(block: np.ndarray, rate: float, segment: int = SPECTRUM_SEGMENT,
+          overlap: float = SPECTRUM_OVERLAP) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Welch power spectral densities of all series of a block in one batched rFFT. Segments with a missing (NaN or
+    infinite) value, e.g. the padding of a shorter trial, are left out of the average of their series.
+
+    :param block: Series along the last axis, e.g. (trials x columns x time)
+    :param rate: Samples per second
+    :param segment: Number of samples per segment, at most the length of the series
+    :param overlap: Overlap of consecutive segments, as a fraction of the segment
+    :return: (frequencies in Hz, one-sided densities in unit^2/Hz with the shape of the block and the frequencies
+             along the last axis, NaN for series without a complete segment)
+    """
+    segment = max(1, min(segment, block.shape[-1]))
+    step = max(1, int(round(segment * (1 - overlap))))
+    # View of all segments (... x segments x samples), copied only once by the masking below
+    windows = np.lib.stride_tricks.sliding_window_view(block, segment, axis=-1)[..., ::step, :]
+    complete = np.isfinite(windows).all(axis=-1)
+    segments = np.where(complete[..., None], windows, 0.0)
+    segments -= segments.mean(axis=-1, keepdims=True)
+
+    # Periodic Hann window, the spectra are scaled to a density so they do not depend on the segment length
+    window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(segment) / segment)
+    power = np.abs(np.fft.rfft(segments * window, axis=-1)) ** 2 / (rate * (window ** 2).sum())
+    # One-sided: the negative frequencies are folded onto the positive ones, except for 0 and the Nyquist frequency
+    power[..., 1:] *= 2
+    if segment % 2 == 0:
+        power[..., -1] /= 2
+
+    counts = complete.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        densities = (power * complete[..., None]).sum(axis=-2) / counts[..., None]
+    return np.fft.rfftfreq(segment, d=1 / rate), densities
+
+
+def aggregate(frequencies: np.ndarray, densities: np.ndarray, columns: List[str]) -> pd.DataFrame:
+    """
+    :param frequencies: Frequencies of the densities
+    :param densities: (trials x columns x frequencies) densities
+    :param columns: Names of the columns
+    :return: DataFrame with the frequency and the median and quartiles over the trials of every column per frequency
+    """
+    with warnings.catch_warnings():
+        # Frequencies without a density in any trial (too short trials) are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        quantiles = np.nanquantile(densities, list(STATISTICS.values()), axis=0)
+    dictionary = {FREQUENCY_COLUMN: frequencies}
+    for column_index, column in enumerate(columns):
+        for statistic_index, statistic in enumerate(STATISTICS):
+            dictionary[f'{column}_{statistic}'] = quantiles[statistic_index, column_index]
+    return pd.DataFrame(dictionary)
+
+
+def spectrum(trials: List[Trial], lags: Optional[Dict[str, int]] = None,
+             segment: int = SPECTRUM_SEGMENT) -> pd.DataFrame:
+    """
+    Spectra of the power columns of a group.
+
+    :param trials: Trials of the group to include
+    :param lags: Lag in samples per trial name, None if the trials are not aligned
+    :param segment: Number of samples per Welch segment
+    :return: DataFrame with the frequency and the median and quartiles of the density of every power column
+    """
+    columns = spectrum_columns(trials[0])
+    frequencies, densities = welch(_block(trials, columns, lags or {}), sample_rate(trials), segment)
+    return aggregate(frequencies, densities, columns)
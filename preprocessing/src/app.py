@@ -5,24 +5,66 @@ Provides API endpoints for managing experiments and generating visualizations.
 import json
 import logging
 import os
+import time
 
-from flask import Flask, jsonify, request, render_template, redirect, Response
+from flask import Flask, jsonify, request, render_template, redirect, Response, g
+
+import metrics
+import tracing
 
 from models.types.experiment_type import ExperimentType
 from models.types.measurement_type import MeasurementType
 from group_service import GroupService
 from experiment_service import ExperimentService
 from grafana_service import GrafanaService
+from data_service import DataService
+from database_service import DatabaseService
+from experiment_store import ExperimentStore
+from query_service import QueryService
+from upload_service import UploadService
+from analysis import derived
+from analysis.outliers import OutlierPolicy
 
 # Path where Grafana dashboard config will be saved
 DASHBOARD_CONFIG_SAVE_PATH = 'grafana/dashboards/energibridge-dashboard.json'
 GRAFANA_URL = 'http://localhost:3000'
 
+# Database the groups are loaded into (PostgreSQL DSN or sqlite:///<path>), not used when empty
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+# SQLite file persisting the experiments and their generated panels, shared by all server processes.
+# Experiments are only kept in memory when empty
+EXPERIMENT_STORE = os.environ.get('EXPERIMENT_STORE', 'csv-data/experiments.db')
+
 # Initialize Flask application and services
 app = Flask(__name__)
-group_service = GroupService()
-experiment_service = ExperimentService(group_service)
+database_service = DatabaseService(DATABASE_URL) if DATABASE_URL else None
+group_service = GroupService(database_service)
+experiment_service = ExperimentService(group_service, ExperimentStore(EXPERIMENT_STORE) if EXPERIMENT_STORE else None)
 grafana_service = GrafanaService(DASHBOARD_CONFIG_SAVE_PATH)
+data_service = DataService()
+query_service = QueryService()
+upload_service = UploadService(group_service)
+# Memory of the groups is only computed when the metrics are scraped
+metrics.GROUP_MEMORY.set_function(
+    lambda: {(group.name,): group.memory_usage() for group in group_service.get_groups()})
+metrics.GROUP_MEMORY_SAVED.set_function(
+    lambda: {(group.name,): group.memory_report()['saved_bytes'] for group in group_service.get_groups()})
+
+
+@app.before_request
+def start_request_timer() -> None:
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request_duration(response: Response) -> Response:
+    if 'request_start' in g:
+        # Route pattern instead of the path, so the number of label values stays bounded
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.REQUEST_DURATION.labels(endpoint=endpoint, method=request.method,
+                                        status=str(response.status_code)).observe(time.perf_counter() - g.request_start)
+    return response
 
 
 @app.route('/')
@@ -42,6 +84,133 @@ def get_groups() -> Response:
     """
     return jsonify({'status': 'success', 'groups': [group.to_dict() for group in group_service.get_groups()]})
 
+@app.route('/groups/<group_name>/memory')
+def get_group_memory(group_name: str) -> Response:
+    """
+    Endpoint reporting the memory used by the data of a group and the memory saved by the precision policy.
+
+    :return: JSON response with the memory report of the group
+    """
+    group = group_service.find_group(group_name)
+    if group is None:
+        return jsonify({'status': 'error', 'message': f'Group {group_name} not found'}), 404
+    return jsonify({'status': 'success', 'memory': group.memory_report()})
+
+
+@app.route('/groups/<group_name>/outliers')
+def get_group_outliers(group_name: str) -> Response:
+    """
+    Endpoint returning the outlier policy of a group and the outlier scores and decisions of its trials.
+
+    :return: JSON response with the policy and one entry per trial
+    """
+    group = group_service.find_group(group_name)
+    if group is None:
+        return jsonify({'status': 'error', 'message': f'Group {group_name} not found'}), 404
+    decisions = group.outlier_decisions.astype(object).where(group.outlier_decisions.notna(), None)
+    return jsonify({'status': 'success', 'policy': group.outlier_policy.to_dict(),
+                    'trials': decisions.rename_axis('Trial').reset_index().to_dict(orient='records')})
+
+
+@app.route('/groups/<group_name>/outliers', methods=['PUT'])
+def set_group_outliers(group_name: str) -> Response:
+    """
+    Endpoint changing the outlier policy of a group, e.g. {"mode": "exclude", "threshold": 3.5}. The mode is "off",
+    "flag" (outliers are marked in trial_summary.csv) or "exclude" (outliers are also left out of the aggregate data
+    and the group summary). The group is aggregated and summarized again, without rescanning its trials.
+
+    :return: JSON response with the updated group
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'Expected a JSON object with "mode" and/or "threshold"'}), 400
+    try:
+        policy = OutlierPolicy.from_dict(data)
+        group = group_service.set_outlier_policy(group_name, policy)
+    except FileNotFoundError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'group': group.to_dict(), 'policy': policy.to_dict()})
+
+
+@app.route('/derived-metrics')
+def get_derived_metrics() -> Response:
+    """
+    Endpoint returning the derived metrics with their expression and level ("sample" or "trial").
+
+    :return: JSON response with one entry per metric
+    """
+    try:
+        metrics_list = derived.load_metrics()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'metrics': [
+        {'name': metric.name, 'expression': metric.expression, 'level': metric.level} for metric in metrics_list]})
+
+
+@app.route('/derived-metrics', methods=['PUT'])
+def set_derived_metrics() -> Response:
+    """
+    Endpoint replacing the derived metrics, e.g. {"UNCORE_POWER (W)": "[CPU_POWER (W)] - sum_of([CORE*_POWER (W)])"}.
+    The metrics are checked before they are saved and are evaluated when the groups are ingested again. A metric
+    cannot be named after a column of the trials of the groups, other than the derived columns.
+
+    :return: JSON response with the saved metrics
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error',
+                        'message': 'Expected a JSON object mapping metric names to expressions'}), 400
+    columns = {column for group in group_service.get_groups() for column in group.trials[0].columns
+               if column not in group.derived_columns}
+    try:
+        metrics_list = derived.save_metrics(data, columns=columns)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'metrics': [
+        {'name': metric.name, 'expression': metric.expression, 'level': metric.level} for metric in metrics_list]})
+
+
+@app.route('/groups/<group_name>/trials', methods=['POST'])
+def upload_trials(group_name: str) -> Response:
+    """
+    Endpoint uploading trial files to a group (created if it does not exist) as multipart/form-data, e.g.
+    curl -F file=@trial_1.csv -F file=@trial_2.csv.gz http://localhost:5000/groups/my_group/trials
+    Files may be gzip (.gz) or zstd (.zst) compressed. Every trial is preprocessed while the rest of the upload is
+    still being received, the group is aggregated and summarized once the upload is complete.
+    With ?profile=1, the upload is sampled by the profiler.
+
+    :return: JSON response with the updated group
+    """
+    if request.mimetype != 'multipart/form-data' or 'boundary' not in request.mimetype_params:
+        return jsonify({'status': 'error', 'message': 'Expected a multipart/form-data upload'}), 400
+    try:
+        group = upload_service.upload_multipart(group_name, request.stream, request.mimetype_params['boundary'],
+                                                profile=request.args.get('profile') == '1' or None)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'group': group.to_dict()})
+
+
+@app.route('/groups/<group_name>/trials/<filename>', methods=['PUT'])
+def upload_trial(group_name: str, filename: str) -> Response:
+    """
+    Endpoint uploading a single trial file as request body, which may be sent with chunked transfer encoding, e.g.
+    curl -T trial_1.csv.gz http://localhost:5000/groups/my_group/trials/trial_1.csv.gz
+    The compression is taken from the Content-Encoding header (gzip or zstd) or the file extension.
+
+    :return: JSON response with the updated group
+    """
+    try:
+        group = upload_service.upload_file(group_name, filename, request.stream,
+                                           encoding=request.headers.get('Content-Encoding'),
+                                           profile=request.args.get('profile') == '1' or None)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'group': group.to_dict()})
+
+
 @app.route('/experiments')
 def get_experiments() -> Response:
     """
@@ -132,18 +301,107 @@ def generate_visualizations() -> Response:
     """
     Generate a Grafana dashboard with visualizations for all experiments.
     Creates panels for each experiment and measurement type and saves the dashboard config.
+    With ?mode=templated, creates compact dashboards with group/core variables and repeating panels.
+    With ?profile=1, the generation is sampled by the profiler and the path of the profile is returned.
 
     :return: JSON response with success message.
     """
     experiments = experiment_service.get_experiments()
+    templated = request.args.get('mode') == 'templated'
+    profile = request.args.get('profile') == '1' or None
     app.logger.info(f'Generating visualizations for experiments: {experiments}')
 
     # Create dashboard using the GrafanaService
     try:
-        grafana_service.create_dashboard_from_experiments(experiments)
+        with tracing.job('generate', profile, templated=templated) as job:
+            grafana_service.create_dashboard_from_experiments(experiments, templated,
+                                                              experiment_service.create_visualization_panels)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
-    return jsonify({'status': 'success', 'message': 'Visualizations generated successfully!'})
+    response = {'status': 'success', 'message': 'Visualizations generated successfully!'}
+    if 'profile' in job.attributes:
+        response['profile'] = job.attributes['profile']
+    return jsonify(response)
+
+
+@app.route('/api/data')
+def get_data() -> Response:
+    """
+    Endpoint serving a projected, time-sliced and downsampled part of an aggregate file as CSV, for Grafana panels.
+
+    Query parameters:
+    - group: name of the group or comparison folder (e.g. "a_vs_b")
+    - columns: comma-separated column names (may be repeated), Time is always included
+    - from, to: optional time range in ms
+    - max_points: optional maximum number of rows
+    - file: aggregate_data (default) or aggregate_summary
+    - v: optional content hash of the file, makes the response cacheable forever
+
+    :return: CSV response with the requested data
+    """
+    try:
+        columns = [column for value in request.args.getlist('columns') for column in value.split(',') if column]
+        df = data_service.query(
+            request.args.get('group', ''),
+            columns,
+            start=request.args.get('from', type=float),
+            end=request.args.get('to', type=float),
+            max_points=request.args.get('max_points', type=int),
+            file_name=request.args.get('file', 'aggregate_data')
+        )
+    except FileNotFoundError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    except (KeyError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    response = Response(df.to_csv(index=False), mimetype='text/csv')
+    # Versioned URLs (v = content hash of the file) never change, others must be revalidated with the ETag
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if 'v' in request.args else 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@app.route('/query', methods=['POST'])
+def run_query() -> Response:
+    """
+    Endpoint running a read-only SQL query on the output artifacts, for ad-hoc analysis across groups.
+    The views trials, samples, aggregates, summaries and comparisons can be queried, e.g.
+    SELECT group_name, "Trial", "CPU_Total_Energy (J)" FROM trials WHERE "CPU_Peak_Power (W)" > 40
+
+    JSON body:
+    - sql: SELECT query
+    - max_rows: optional maximum number of rows, a positive integer (capped by the server)
+    - timeout: optional timeout in seconds, a positive number (capped by the server)
+
+    :return: JSON response with the columns and rows of the result
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('sql'), str):
+        return jsonify({'status': 'error', 'message': 'Missing "sql" in request body'}), 400
+    try:
+        df, truncated = query_service.query(data['sql'], max_rows=data.get('max_rows'), timeout=data.get('timeout'))
+    except TimeoutError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 408
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({
+        'status': 'success',
+        'columns': list(df.columns),
+        # Serialized by pandas, so NumPy values and NaN are converted to JSON
+        'rows': json.loads(df.to_json(orient='values')),
+        'truncated': truncated
+    })
+
+
+@app.route('/metrics')
+def get_metrics() -> Response:
+    """
+    Endpoint exposing the metrics of the server in the Prometheus text format: durations of the pipeline stages
+    by group and experiment type, rows and bytes processed, cache hits and misses and memory used per group.
+    With several server workers, the counters and histograms are summed over the workers.
+
+    :return: Metrics text
+    """
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 @app.route('/csv-data/input/')
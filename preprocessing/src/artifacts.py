@@ -0,0 +1,121 @@
+"""
+Publishing of generated artifacts (CSV files and images) for cache-friendly serving by nginx.
+
+Every published artifact gets precompressed variants next to it (<file>.gz, and <file>.br when the brotli package is
+installed), which nginx serves with gzip_static/brotli_static, and a <file>.sha256 sidecar with its content hash.
+Panel URLs carry the hash as a version parameter, so a changed artifact gets a new URL while an unchanged one keeps
+its URL and can be cached forever. When an artifact is rewritten with identical content, its modification time is
+restored, so the ETag nginx derives from it does not change either.
+
+Files that are not served (such as the preprocessed trial CSVs) are not published: digest() only hashes them, so
+change detection works without paying for compressed copies nobody downloads.
+"""
+import gzip
+import hashlib
+import os
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, only gzip variants are written without it
+    brotli = None
+
+HASH_LENGTH = 16
+
+
+def _sidecar_path(path: str) -> str:
+    return f"{path}.sha256"
+
+
+def _read_sidecar(path: str) -> Optional[tuple]:
+    try:
+        with open(_sidecar_path(path), 'r') as file:
+            digest, modified = file.read().split()
+        return digest, int(modified)
+    except (OSError, ValueError):
+        return None
+
+
+def publish(path: str) -> str:
+    """
+    Publish a freshly written artifact: hash it and write its precompressed variants.
+
+    :param path: Path of the artifact
+    :return: Content hash of the artifact
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+    previous = _read_sidecar(path)
+    if previous is not None and previous[0] == digest and os.path.exists(f"{path}.gz"):
+        # Unchanged content: keep the old modification time, so validators (ETag, Last-Modified) stay the same
+        os.utime(path, ns=(previous[1], previous[1]))
+        return digest
+
+    modified = os.stat(path).st_mtime_ns
+    _write_variant(f"{path}.gz", gzip.compress(data, mtime=0), modified)
+    if brotli is not None:
+        _write_variant(f"{path}.br", brotli.compress(data), modified)
+    with open(_sidecar_path(path), 'w') as file:
+        file.write(f"{digest} {modified}")
+    return digest
+
+
+def _write_variant(path: str, data: bytes, modified: int) -> None:
+    """
+    Write a compressed variant with the modification time of the original, as nginx expects for *_static serving.
+    """
+    with open(path, 'wb') as file:
+        file.write(data)
+    os.utime(path, ns=(modified, modified))
+
+
+def version(path: str) -> Optional[str]:
+    """
+    Get the content hash of an artifact, for use as a cache-busting URL parameter.
+
+    :param path: Path of the artifact
+    :return: Content hash, or None if the artifact does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    sidecar = _read_sidecar(path)
+    if sidecar is not None and sidecar[1] == os.stat(path).st_mtime_ns:
+        return sidecar[0]
+    return publish(path)
+
+
+def digest(path: str) -> Optional[str]:
+    """
+    Get the content hash of a file that is not served, without writing compressed variants.
+    The hash is cached in the sidecar like for published artifacts, so an unchanged file is not hashed again.
+
+    :param path: Path of the file
+    :return: Content hash, or None if the file does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    modified = os.stat(path).st_mtime_ns
+    sidecar = _read_sidecar(path)
+    if sidecar is not None and sidecar[1] == modified:
+        return sidecar[0]
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            hasher.update(block)
+    content_hash = hasher.hexdigest()[:HASH_LENGTH]
+    with open(_sidecar_path(path), 'w') as file:
+        file.write(f"{content_hash} {modified}")
+    return content_hash
+
+
+def remove(path: str) -> None:
+    """
+    Remove an artifact together with its compressed variants and hash.
+
+    :param path: Path of the artifact
+    """
+    for variant in (path, f"{path}.gz", f"{path}.br", _sidecar_path(path)):
+        if os.path.exists(variant):
+            os.remove(variant)
@@ -0,0 +1,287 @@
+"""
+Benchmarks of the pipeline stages on synthetic workloads.
+
+Every benchmark runs in a temporary workspace with its own csv-data folder, so the real input and output folders are
+not touched. Durations are measured over several repeats, peak memory in one extra run traced by tracemalloc (which
+slows the code down, so its duration is not used).
+"""
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import kernels
+import preprocessing as pp
+from analysis import phases
+from benchmarks.synthetic import WorkloadSpec, generate_trial, write_group
+from grafana_service import GrafanaService
+from models.experiment import Experiment
+from models.group import Group
+from models.types.experiment_type import ExperimentType
+from models.types.measurement_type import MeasurementType
+from visualization.significance import SignificanceTest
+
+BENCHMARKS = ('preprocess', 'ingest', 'aggregate', 'summarize_trials', 'group_summary', 'generate_comparison_file',
+              'dashboard')
+
+GROUP_NAMES = ('bench_a', 'bench_b')
+
+# Benchmarks of the kernel backends: preprocessing of all trials and the order statistics of all aggregate columns
+KERNEL_BENCHMARKS = ('preprocess', 'aggregate', 'segment')
+
+
+@contextmanager
+def workspace(templates_folder: str = 'csv-data/grafana-templates') -> Iterator[str]:
+    """
+    Run the with block in a temporary folder with an empty csv-data folder and a copy of the Grafana templates.
+
+    :param templates_folder: Folder with the Grafana templates, relative to the current folder
+    :return: Context manager yielding the path of the workspace
+    """
+    templates_folder = os.path.abspath(templates_folder)
+    previous = os.getcwd()
+    folder = tempfile.mkdtemp(prefix='energibridge-benchmark-')
+    try:
+        if os.path.isdir(templates_folder):
+            shutil.copytree(templates_folder, os.path.join(folder, 'csv-data', 'grafana-templates'))
+        os.makedirs(os.path.join(folder, Group.input_folder), exist_ok=True)
+        os.makedirs(os.path.join(folder, Group.output_folder), exist_ok=True)
+        os.chdir(folder)
+        yield folder
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """
+    Measure the duration and peak memory of a function.
+
+    :param function: Function to run
+    :param repeat: Number of timed runs
+    :return: Dictionary with the durations in seconds (min, median, mean) and the peak memory in bytes
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'min_s': min(durations),
+        'median_s': statistics.median(durations),
+        'mean_s': statistics.mean(durations),
+        'peak_memory_bytes': peak
+    }
+
+
+def run_benchmarks(spec: WorkloadSpec, repeat: int = 5, benchmarks: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Generate two synthetic groups and benchmark the pipeline stages on them.
+
+    :param spec: Workload of each group, the second group uses 10% more power
+    :param repeat: Number of timed runs per benchmark
+    :param benchmarks: Names of the benchmarks to run (see BENCHMARKS), all if None
+    :return: Results with the environment, the workload and the measurements per benchmark
+    """
+    benchmarks = list(benchmarks or BENCHMARKS)
+    unknown = [name for name in benchmarks if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f'Unknown benchmarks {unknown}, valid benchmarks are: {list(BENCHMARKS)}')
+
+    results: Dict[str, Any] = {}
+    with workspace():
+        for index, name in enumerate(GROUP_NAMES):
+            write_group(os.path.join(Group.input_folder, name), spec, power_scale=1 + 0.1 * index,
+                        seed=spec.seed + index)
+        raw = [pd.read_csv(path) for path, _ in Group.trial_paths(GROUP_NAMES[0])]
+        groups = [Group(name) for name in GROUP_NAMES]
+        group = groups[0]
+
+        cases: Dict[str, Callable[[], Any]] = {
+            'preprocess': lambda: [pp.preprocess(data) for data in raw],
+            'ingest': lambda: Group(GROUP_NAMES[0]),
+            'aggregate': group.aggregate,
+            'summarize_trials': group.summarize_trials,
+            'group_summary': group.group_summary,
+            'generate_comparison_file': lambda: SignificanceTest.generate_comparison_file(*GROUP_NAMES),
+            'dashboard': lambda: GrafanaService('grafana/dashboards/benchmark.json').create_dashboard_from_experiments(
+                benchmark_experiments(groups))
+        }
+        for name in benchmarks:
+            print(f'Running benchmark {name}')
+            results[name] = measure(cases[name], repeat)
+
+    return {
+        'commit': _commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'workload': spec.to_dict(),
+        'benchmarks': results
+    }
+
+
+def benchmark_experiments(groups: List[Group]) -> List[Experiment]:
+    """
+    Experiments of every type on the benchmark groups, with all their measurement types.
+
+    :param groups: The two benchmark groups
+    :return: List of experiments
+    """
+    return [
+        Experiment(f'benchmark {experiment_type.name.lower()}', groups, experiment_type,
+                   [measurement_type for measurement_type in MeasurementType.get_compatible_types(experiment_type)
+                    if measurement_type != MeasurementType.ALL])
+        for experiment_type in ExperimentType
+    ]
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _relative_difference(values: np.ndarray, reference: np.ndarray) -> float:
+    values = np.asarray(values, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    # NaN (e.g. the standard deviation of a single trial) must be NaN in both
+    if not np.array_equal(np.isnan(values), np.isnan(reference)):
+        return float('inf')
+    difference = np.abs(values - reference) / np.maximum(np.abs(reference), 1e-12)
+    return float(np.nanmax(difference, initial=0.0))
+
+
+def benchmark_kernels(spec: WorkloadSpec, repeat: int = 3, backends: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Check that the kernel backends agree with the NumPy reference backend and benchmark them on one synthetic group,
+    generated in memory.
+
+    Each backend is called once before it is timed, so the compilation of the JIT backend is not measured. Peak
+    memory only includes allocations by NumPy and Python, the JIT backend allocates its arrays outside of tracemalloc.
+
+    :param spec: Workload of the group, e.g. 1000 trials
+    :param repeat: Number of timed runs per benchmark
+    :param backends: Names of the backends, all available backends if None
+    :return: Results with the environment, the workload, the largest relative difference to the reference per
+             backend and kernel, and the measurements per backend and benchmark
+    """
+    backends = list(backends or kernels.BACKENDS)
+    rng = np.random.default_rng(spec.seed)
+    raw = [generate_trial(spec, rng, rng.normal(1, 0.02)) for _ in range(spec.trials)]
+
+    with kernels.using('numpy'):
+        reference = [pp.preprocess(data) for data in raw]
+    columns = [column for column in reference[0].columns if column not in ('Time', 'Delta')]
+    matrices = [np.column_stack([data[column].to_numpy(dtype=np.float64) for data in reference]) for column in columns]
+    with kernels.using('numpy'):
+        reference_statistics = [kernels.order_statistics(matrix) for matrix in matrices]
+    # Change points of the power of every trial, with the penalty the phase segmentation uses for the trial
+    series = [data['CPU_POWER (W)'].to_numpy(dtype=np.float64) for data in reference]
+    penalties = [phases.change_point_penalty(values) for values in series]
+    with kernels.using('numpy'):
+        reference_change_points = [kernels.change_points(values, penalty, phases.PHASE_MIN_SAMPLES)
+                                   for values, penalty in zip(series, penalties)]
+
+    cases: Dict[str, Callable[[], Any]] = {
+        'preprocess': lambda: [pp.preprocess(data) for data in raw],
+        'aggregate': lambda: [kernels.order_statistics(matrix) for matrix in matrices],
+        'segment': lambda: [kernels.change_points(values, penalty, phases.PHASE_MIN_SAMPLES)
+                            for values, penalty in zip(series, penalties)]
+    }
+    parity: Dict[str, Dict[str, float]] = {}
+    results: Dict[str, Dict[str, Any]] = {}
+    for backend in backends:
+        with kernels.using(backend):
+            print(f'Checking kernel backend {backend}')
+            start = time.perf_counter()
+            preprocessed = cases['preprocess']()
+            statistics = cases['aggregate']()
+            change_points = cases['segment']()
+            compile_s = time.perf_counter() - start
+            parity[backend] = {
+                'preprocess': max(_relative_difference(data[column], expected[column])
+                                  for data, expected in zip(preprocessed, reference) for column in expected.columns),
+                'aggregate': max(_relative_difference(result[name], expected[name])
+                                 for result, expected in zip(statistics, reference_statistics) for name in expected),
+                # Change points are indices, a different number of change points is an infinite difference
+                'segment': max(_relative_difference(result, expected) if len(result) == len(expected) else float('inf')
+                               for result, expected in zip(change_points, reference_change_points))
+            }
+            results[backend] = {'first_call_s': compile_s}
+            for name in KERNEL_BENCHMARKS:
+                print(f'Running benchmark {name} with kernel backend {backend}')
+                results[backend][name] = measure(cases[name], repeat)
+
+    return {
+        'commit': _commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'numba': kernels.numba.__version__ if kernels.numba is not None else None,
+        'machine': platform.machine(),
+        'workload': spec.to_dict(),
+        'parity': parity,
+        'backends': results
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.1) -> List[Dict[str, Any]]:
+    """
+    Compare results with the results of an earlier run.
+
+    :param results: Current results
+    :param baseline: Results of an earlier run, e.g. of the previous commit
+    :param threshold: Relative increase of the median duration or the peak memory that counts as a regression
+    :return: One row per benchmark present in both runs with the relative changes and whether it regressed
+    """
+    rows = []
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        duration_change = current['median_s'] / previous['median_s'] - 1 if previous['median_s'] else 0.0
+        memory_change = (current['peak_memory_bytes'] / previous['peak_memory_bytes'] - 1
+                         if previous['peak_memory_bytes'] else 0.0)
+        rows.append({
+            'benchmark': name,
+            'duration_change': duration_change,
+            'memory_change': memory_change,
+            'regression': duration_change > threshold or memory_change > threshold
+        })
+    return rows
+
+
+def save(results: Dict[str, Any], path: str) -> None:
+    """
+    Save results as JSON.
+
+    :param results: Results of run_benchmarks
+    :param path: Path of the JSON file
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
@@ -0,0 +1,137 @@
+"""
+Generator of synthetic EnergiBridge measurements, for benchmarks on workloads of any size.
+"""
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Column layouts EnergiBridge writes on different platforms:
+# - linux_amd: cumulative energy per core and of the package (CORE<i>_ENERGY (J), CPU_ENERGY (J)), core frequency,
+#   P-state and voltage
+# - windows: cumulative RAPL energy of the package and its planes (PACKAGE_ENERGY (J), PP0_ENERGY (J), ...)
+# - linux_power: instantaneous power instead of energy (CPU_POWER (Watts), CORE<i>_POWER (Watts))
+PLATFORMS = ('linux_amd', 'windows', 'linux_power')
+
+
+class WorkloadSpec:
+    """
+    Parameters of a synthetic workload.
+    """
+
+    def __init__(self, cores: int = 8, logical: int = 16, delta: int = 200, duration: float = 30.0, trials: int = 30,
+                 jitter: float = 0.02, platform: str = 'linux_amd', power: float = 10.0, seed: int = 0):
+        """
+        :param cores: Number of physical cores
+        :param logical: Number of logical processors
+        :param delta: Sampling interval in milliseconds
+        :param duration: Duration of a trial in seconds
+        :param trials: Number of trials per group
+        :param jitter: Relative standard deviation of the sampling interval
+        :param platform: Column layout, one of PLATFORMS
+        :param power: Mean power of a core in watts
+        :param seed: Seed of the random generator, the same seed gives the same files
+        """
+        if platform not in PLATFORMS:
+            raise ValueError(f'Unknown platform "{platform}", valid platforms are: {list(PLATFORMS)}')
+        if cores < 1 or logical < 1 or delta < 1 or duration <= 0 or trials < 1:
+            raise ValueError('cores, logical, delta, duration and trials must be positive')
+        self.cores = cores
+        self.logical = logical
+        self.delta = delta
+        self.duration = duration
+        self.trials = trials
+        self.jitter = jitter
+        self.platform = platform
+        self.power = power
+        self.seed = seed
+
+    @property
+    def rows(self) -> int:
+        return max(2, int(self.duration * 1000 / self.delta))
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def generate_trial(spec: WorkloadSpec, rng: np.random.Generator, power_scale: float = 1.0) -> pd.DataFrame:
+    """
+    Generate the measurements of a single trial.
+
+    :param spec: Workload parameters
+    :param rng: Random generator
+    :param power_scale: Factor applied to the power of all cores, e.g. to make one group use more energy than another
+    :return: DataFrame with the columns EnergiBridge writes on the platform of the workload
+    """
+    rows = spec.rows
+    deltas = np.maximum(1, np.round(spec.delta * (1 + rng.normal(0, spec.jitter, rows)))).astype(np.int64)
+    deltas[0] = 0
+    seconds = deltas / 1000
+
+    # Power of every core follows a noisy load level, which changes a few times during the trial
+    phases = rng.uniform(0.3, 1.0, size=(max(1, rows // 50) + 1, spec.cores))
+    load = np.repeat(phases, 50, axis=0)[:rows]
+    core_power = spec.power * power_scale * load * (1 + rng.normal(0, 0.05, (rows, spec.cores)))
+    core_power = np.clip(core_power, 0, None)
+    package_power = core_power.sum(axis=1) + spec.power * 0.5
+
+    columns: Dict[str, np.ndarray] = {
+        'Delta': deltas,
+        'Time': 1740524847503 + np.cumsum(deltas),
+    }
+    if spec.platform == 'linux_amd':
+        core_energy = np.cumsum(core_power * seconds[:, None], axis=0) + rng.uniform(1000, 20000, spec.cores)
+        for core in range(spec.cores):
+            columns[f'CORE{core}_ENERGY (J)'] = core_energy[:, core]
+            columns[f'CORE{core}_FREQ (MHZ)'] = np.round(3000 + 2000 * load[:, core])
+            columns[f'CORE{core}_PSTATE'] = (load[:, core] < 0.6).astype(np.int64)
+            columns[f'CORE{core}_VOLT (V)'] = 0.05 + 0.05 * load[:, core]
+        columns['CPU_ENERGY (J)'] = np.cumsum(package_power * seconds) + rng.uniform(100000, 200000)
+    elif spec.platform == 'windows':
+        package_energy = np.cumsum(package_power * seconds) + rng.uniform(100000, 200000)
+        columns['PACKAGE_ENERGY (J)'] = package_energy
+        columns['PP0_ENERGY (J)'] = np.cumsum(core_power.sum(axis=1) * seconds)
+        columns['PP1_ENERGY (J)'] = np.cumsum(np.full(rows, 0.1) * seconds)
+        columns['DRAM_ENERGY (J)'] = np.cumsum(np.full(rows, spec.power * 0.2) * seconds)
+    else:
+        for core in range(spec.cores):
+            columns[f'CORE{core}_POWER (Watts)'] = core_power[:, core]
+        columns['CPU_POWER (Watts)'] = package_power
+
+    usage = np.clip(100 * np.repeat(load, -(-spec.logical // spec.cores), axis=1)[:, :spec.logical]
+                    + rng.normal(0, 5, (rows, spec.logical)), 0, 100)
+    for logical in range(spec.logical):
+        columns[f'CPU_FREQUENCY_{logical}'] = np.round(3000 + 2000 * usage[:, logical] / 100)
+    for logical in range(spec.logical):
+        columns[f'CPU_USAGE_{logical}'] = usage[:, logical]
+
+    total_memory = 16 * 1024 ** 3
+    columns['TOTAL_MEMORY'] = np.full(rows, total_memory, dtype=np.int64)
+    columns['TOTAL_SWAP'] = np.full(rows, 4 * 1024 ** 3, dtype=np.int64)
+    columns['USED_MEMORY'] = np.clip(total_memory * 0.4 + np.cumsum(rng.normal(0, 2 ** 20, rows)), 0,
+                                     total_memory).astype(np.int64)
+    columns['USED_SWAP'] = np.full(rows, 2 ** 28, dtype=np.int64)
+    return pd.DataFrame(columns)
+
+
+def write_group(folder: str, spec: WorkloadSpec, power_scale: float = 1.0, seed: Optional[int] = None) -> List[str]:
+    """
+    Write the trials of a synthetic group as EnergiBridge CSV files.
+
+    :param folder: Group folder, e.g. csv-data/input/<group name>
+    :param spec: Workload parameters
+    :param power_scale: Factor applied to the power of all cores
+    :param seed: Seed of the random generator, spec.seed if None
+    :return: Paths of the written files
+    """
+    rng = np.random.default_rng(spec.seed if seed is None else seed)
+    os.makedirs(folder, exist_ok=True)
+    name = os.path.basename(os.path.normpath(folder))
+    paths = []
+    for trial in range(spec.trials):
+        path = os.path.join(folder, f'{name}_{trial}.csv')
+        # Trials vary a little in power, like repeated runs of the same workload
+        generate_trial(spec, rng, power_scale * rng.normal(1, 0.02)).to_csv(path, index=False)
+        paths.append(path)
+    return paths
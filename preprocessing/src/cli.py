@@ -0,0 +1,227 @@
+"""
+Command-line entry point for running analyses without the Flask web interface.
+Must be run from the folder containing csv-data/, like the Flask app.
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional
+
+from analysis.sequential import SequentialTest
+from benchmarks import runner
+from benchmarks.synthetic import PLATFORMS, WorkloadSpec, write_group
+import pipeline
+
+EXIT_SUCCESS = 0
+EXIT_ERROR = 1
+
+# Exit codes of the sequential subcommand, so a benchmark harness can decide whether to run more trials
+EXIT_DECIDED = EXIT_SUCCESS
+EXIT_CONTINUE = 2
+
+
+def sequential(args: argparse.Namespace) -> int:
+    """
+    Run the sequential test on two groups and report whether the harness can stop running trials.
+
+    :param args: Parsed command-line arguments
+    :return: Exit code, EXIT_DECIDED when all metrics are decided, EXIT_CONTINUE when more trials are needed
+    """
+    test = SequentialTest(args.group0, args.group1, max_trials=args.max_trials, min_trials=args.min_trials,
+                          alpha=args.alpha, power=args.power, futility=not args.no_futility)
+    results = test.run()
+    latest = test.latest(results)
+    decided = test.is_decided(results)
+
+    if args.json:
+        print(json.dumps({'decided': decided, 'metrics': latest}, default=str))
+    else:
+        for row in latest:
+            line = f"[{row['Trials']} trials] {row['Metric']}: {row['Decision']}"
+            if row['Decision'] == SequentialTest.CONTINUE:
+                line += f" (about {row['Additional_Trials']} more trials per group needed)"
+            print(line)
+        print(f'Results saved to {test.output_path()}')
+        print('STOP: all metrics decided' if decided else 'CONTINUE: run more trials')
+
+    return EXIT_DECIDED if decided else EXIT_CONTINUE
+
+
+def run(args: argparse.Namespace) -> int:
+    """
+    Run the batch pipeline for a spec file.
+
+    :param args: Parsed command-line arguments
+    :return: Exit code, EXIT_ERROR when a group or experiment failed
+    """
+    spec = pipeline.load_spec(args.spec)
+    if args.templated:
+        spec.templated = True
+    failures = pipeline.run_pipeline(spec, workers=args.workers, cache_dir=args.cache_dir,
+                                     stages=args.stages or pipeline.STAGES)
+    for failure in failures:
+        print(f'Error: {failure}', file=sys.stderr)
+    print(f'Processed {len(spec.group_names)} groups and {len(spec.experiments)} experiments, '
+          f'{len(failures)} failures')
+    return EXIT_ERROR if failures else EXIT_SUCCESS
+
+
+def _workload_spec(args: argparse.Namespace) -> WorkloadSpec:
+    return WorkloadSpec(cores=args.cores, logical=args.logical, delta=args.delta, duration=args.duration,
+                        trials=args.trials, jitter=args.jitter, platform=args.platform, power=args.power_level,
+                        seed=args.seed)
+
+
+def synthetic(args: argparse.Namespace) -> int:
+    """
+    Write a synthetic group to the input folder.
+
+    :param args: Parsed command-line arguments
+    :return: Exit code
+    """
+    paths = write_group(os.path.join('csv-data/input', args.group), _workload_spec(args), power_scale=args.power_scale)
+    print(f'Wrote {len(paths)} trials to csv-data/input/{args.group}')
+    return EXIT_SUCCESS
+
+
+def benchmark(args: argparse.Namespace) -> int:
+    """
+    Run the benchmarks on a synthetic workload, save the results and compare them with a baseline.
+
+    :param args: Parsed command-line arguments
+    :return: Exit code, EXIT_ERROR when a benchmark regressed compared to the baseline
+    """
+    results = runner.run_benchmarks(_workload_spec(args), repeat=args.repeat, benchmarks=args.only)
+    runner.save(results, args.output)
+
+    for name, result in results['benchmarks'].items():
+        print(f"{name}: median {result['median_s'] * 1000:.1f} ms, min {result['min_s'] * 1000:.1f} ms, "
+              f"peak memory {result['peak_memory_bytes'] / 2 ** 20:.1f} MiB")
+    print(f'Results saved to {args.output}')
+
+    if args.baseline is None:
+        return EXIT_SUCCESS
+    with open(args.baseline, 'r') as file:
+        baseline = json.load(file)
+    rows = runner.compare(results, baseline, args.threshold)
+    for row in rows:
+        print(f"{row['benchmark']}: duration {row['duration_change']:+.1%}, memory {row['memory_change']:+.1%}"
+              f"{' REGRESSION' if row['regression'] else ''}")
+    return EXIT_ERROR if any(row['regression'] for row in rows) else EXIT_SUCCESS
+
+
+def benchmark_kernels(args: argparse.Namespace) -> int:
+    """
+    Check the parity of the kernel backends and benchmark them on a synthetic group.
+
+    :param args: Parsed command-line arguments
+    :return: Exit code, EXIT_ERROR when a backend differs from the NumPy reference by more than the tolerance
+    """
+    results = runner.benchmark_kernels(_workload_spec(args), repeat=args.repeat, backends=args.backends)
+    runner.save(results, args.output)
+
+    failed = False
+    for backend, result in results['backends'].items():
+        for name in runner.KERNEL_BENCHMARKS:
+            difference = results['parity'][backend][name]
+            failed = failed or difference > args.tolerance
+            print(f"{backend} {name}: median {result[name]['median_s'] * 1000:.1f} ms, "
+                  f"min {result[name]['min_s'] * 1000:.1f} ms, max relative difference {difference:.2e}"
+                  f"{' PARITY FAILURE' if difference > args.tolerance else ''}")
+    print(f'Results saved to {args.output}')
+    return EXIT_ERROR if failed else EXIT_SUCCESS
+
+
+def _add_workload_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--cores', type=int, default=8, help='Number of physical cores')
+    parser.add_argument('--logical', type=int, default=16, help='Number of logical processors')
+    parser.add_argument('--delta', type=int, default=200, help='Sampling interval in milliseconds')
+    parser.add_argument('--duration', type=float, default=30.0, help='Duration of a trial in seconds')
+    parser.add_argument('--trials', type=int, default=30, help='Number of trials per group')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Relative standard deviation of the interval')
+    parser.add_argument('--platform', choices=PLATFORMS, default='linux_amd', help='Column layout of the files')
+    parser.add_argument('--power-level', type=float, default=10.0, help='Mean power of a core in watts')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser with a subcommand per analysis.
+
+    :return: Argument parser
+    """
+    parser = argparse.ArgumentParser(description='Energibridge Analytics command-line interface.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    seq = subparsers.add_parser('sequential',
+                                help='Sequential A/B test on total energy and peak power, for early stopping.')
+    seq.add_argument('group0', help='Name of the first group (folder in csv-data/input)')
+    seq.add_argument('group1', help='Name of the second group (folder in csv-data/input)')
+    seq.add_argument('--max-trials', type=int, default=30, help='Planned maximum number of trials per group')
+    seq.add_argument('--min-trials', type=int, default=3, help='Number of trials per group before the first look')
+    seq.add_argument('--alpha', type=float, default=0.05, help='Overall significance level')
+    seq.add_argument('--power', type=float, default=0.8, help='Power for the estimate of the trials needed')
+    seq.add_argument('--no-futility', action='store_true',
+                     help='Never stop early because the observed effect is too small to detect')
+    seq.add_argument('--json', action='store_true', help='Print the result as JSON')
+    seq.set_defaults(func=sequential)
+
+    batch = subparsers.add_parser('run', help='Ingest groups and generate the artifacts and dashboards of the '
+                                              'experiments in a spec file, without the web server.')
+    batch.add_argument('spec', help='YAML or JSON file with the groups and experiments')
+    batch.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                       help='Number of processes ingesting groups in parallel')
+    batch.add_argument('--cache-dir', help='Folder caching ingested groups and generated panels between runs')
+    batch.add_argument('--stages', nargs='+', choices=pipeline.STAGES,
+                       help='Stages to run, all by default. Groups that are not ingested are loaded from their output')
+    batch.add_argument('--templated', action='store_true',
+                       help='Compact dashboards with group/core variables and repeating panels')
+    batch.set_defaults(func=run)
+
+    syn = subparsers.add_parser('synthetic', help='Write a synthetic group of EnergiBridge measurements.')
+    syn.add_argument('group', help='Name of the group (folder created in csv-data/input)')
+    _add_workload_arguments(syn)
+    syn.add_argument('--power-scale', type=float, default=1.0, help='Factor applied to the power of all cores')
+    syn.set_defaults(func=synthetic)
+
+    bench = subparsers.add_parser('benchmark', help='Benchmark the pipeline stages on a synthetic workload.')
+    _add_workload_arguments(bench)
+    bench.add_argument('--repeat', type=int, default=5, help='Number of timed runs per benchmark')
+    bench.add_argument('--only', nargs='+', choices=runner.BENCHMARKS, help='Benchmarks to run, all by default')
+    bench.add_argument('--output', default='benchmark-results.json', help='Path of the JSON results')
+    bench.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    bench.add_argument('--threshold', type=float, default=0.1,
+                       help='Relative increase of duration or peak memory that counts as a regression')
+    bench.set_defaults(func=benchmark)
+
+    kernel = subparsers.add_parser('kernels', help='Check and benchmark the kernel backends on a synthetic group.')
+    _add_workload_arguments(kernel)
+    kernel.add_argument('--repeat', type=int, default=3, help='Number of timed runs per benchmark')
+    kernel.add_argument('--backends', nargs='+', choices=['numpy', 'numba'],
+                        help='Backends to benchmark, all installed backends by default')
+    kernel.add_argument('--tolerance', type=float, default=1e-9,
+                        help='Largest relative difference to the NumPy reference backend')
+    kernel.add_argument('--output', default='kernel-results.json', help='Path of the JSON results')
+    kernel.set_defaults(func=benchmark_kernels, trials=1000)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Main function, entrypoint of the command-line interface.
+
+    :param argv: Command-line arguments, defaults to sys.argv
+    :return: Exit code
+    """
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except Exception as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return EXIT_ERROR
+
+
+if __name__ == '__main__':
+    sys.exit(main())
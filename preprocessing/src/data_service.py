@@ -0,0 +1,137 @@
+"""
+Module containing a service that answers data queries on the aggregate files of groups.
+"""
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from downsampling import downsample, read_levels, select_factor, level_path
+import metrics
+from models.group import Group
+
+
+class DataService:
+    """
+    Service answering projected, time-sliced and downsampled queries on aggregate files, so Grafana panels only
+    transfer the columns and points they draw. Each file is parsed once and kept in memory as one NumPy array per
+    column until it changes on disk. Downsampled queries are answered from the coarsest pyramid level of the file
+    that still has enough rows in the requested range.
+    """
+    # Files that can be queried, by name used in the API
+    files = {
+        'aggregate_data': 'aggregate_data.csv',
+        'aggregate_summary': 'aggregate_summary.csv'
+    }
+
+    # File path -> (modification time, columns)
+    _cache: Dict[str, Tuple[float, Dict[str, np.ndarray]]]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _file_path(self, group_name: str, file_name: str) -> str:
+        """
+        Resolve the path of a queryable file of a group or comparison (e.g. "a_vs_b").
+
+        :param group_name: Name of the group or comparison folder in the output folder
+        :param file_name: Name of the file, key of DataService.files
+        :return: Path of the file
+        """
+        if file_name not in self.files:
+            raise ValueError(f'Unknown file "{file_name}", valid files are: {list(self.files.keys())}')
+        if group_name in ('', '.', '..') or os.path.basename(group_name) != group_name:
+            raise ValueError(f'Invalid group name "{group_name}"')
+        path = os.path.join(Group.output_folder, group_name, self.files[file_name])
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No {file_name} found for group "{group_name}"')
+        return path
+
+    def _load(self, path: str) -> Dict[str, np.ndarray]:
+        """
+        Get the columns of a file from the cache, (re)loading the file if it is new or changed on disk.
+
+        :param path: Path of the CSV file
+        :return: Dictionary mapping column name to values
+        """
+        modified = os.path.getmtime(path)
+        with self._lock:
+            cached = self._cache.get(path)
+        if cached is not None and cached[0] == modified:
+            metrics.cache_lookup('data', True)
+            return cached[1]
+
+        metrics.cache_lookup('data', False)
+        df = pd.read_csv(path)
+        columns = {column: df[column].to_numpy() for column in df.columns}
+        with self._lock:
+            self._cache[path] = (modified, columns)
+        return columns
+
+    def preload(self, group_names: List[str]) -> None:
+        """
+        Load the queryable files of groups and their pyramid levels into the cache. Called in the server process
+        before it forks its workers, so the workers share the arrays instead of each loading their own copy.
+
+        :param group_names: Names of the groups (or comparison folders) to load
+        """
+        for group_name in group_names:
+            for file_name in self.files:
+                try:
+                    path = self._file_path(group_name, file_name)
+                except (FileNotFoundError, ValueError):
+                    continue
+                _, factors = read_levels(path)
+                for factor in [1] + factors:
+                    self._load(level_path(path, factor))
+
+    def query(self, group_name: str, columns: List[str], start: Optional[float] = None, end: Optional[float] = None,
+              max_points: Optional[int] = None, file_name: str = 'aggregate_data') -> pd.DataFrame:
+        """
+        Query a time slice of some columns of an aggregate file, downsampled to a maximum number of points.
+
+        :param group_name: Name of the group or comparison folder in the output folder
+        :param columns: Columns to return, Time is always included
+        :param start: Start of the time range in ms (inclusive), None for the start of the data
+        :param end: End of the time range in ms (inclusive), None for the end of the data
+        :param max_points: Maximum number of rows to return, None to return all rows in the range
+        :param file_name: Name of the file, key of DataService.files
+        :return: DataFrame with the Time column and the requested columns
+        """
+        path = self._file_path(group_name, file_name)
+        factor = 1
+        _, factors = read_levels(path)
+        if max_points and factors:
+            # Estimate the number of full-resolution rows in the range from the coarsest level
+            coarsest = max(factors)
+            lower, upper = self._time_range(self._load(level_path(path, coarsest))['Time'], start, end)
+            factor = select_factor((upper - lower) * coarsest, max_points, factors)
+        data = self._load(level_path(path, factor))
+
+        missing = [column for column in columns if column not in data]
+        if missing:
+            raise ValueError(f'Columns not found for group "{group_name}": {missing}')
+
+        lower, upper = self._time_range(data['Time'], start, end)
+
+        selected = ['Time'] + [column for column in columns if column != 'Time']
+        df = pd.DataFrame({column: data[column][lower:upper] for column in selected}, columns=selected)
+        return downsample(df, max_points)
+
+    @staticmethod
+    def _time_range(time: np.ndarray, start: Optional[float], end: Optional[float]) -> Tuple[int, int]:
+        """
+        Find the rows within a time range. Time is sorted, so the range is found with a binary search.
+
+        :param time: Time column
+        :param start: Start of the time range in ms (inclusive), None for the start of the data
+        :param end: End of the time range in ms (inclusive), None for the end of the data
+        :return: Index of the first row in the range and index after the last row in the range
+        """
+        lower = 0 if start is None else int(np.searchsorted(time, start, side='left'))
+        upper = len(time) if end is None else int(np.searchsorted(time, end, side='right'))
+        return lower, upper
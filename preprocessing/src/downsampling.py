@@ -0,0 +1,180 @@
+"""
+Vectorized downsampling of aggregate time series for visualization.
+
+Rows are reduced in buckets of consecutive samples. To keep peaks and bands visible, upper statistics (max, UQ) take
+the bucket maximum and lower statistics (min, LQ) the bucket minimum. Time is the start of the bucket, Delta the
+bucket duration and all other columns the bucket mean.
+
+Long aggregate files also get a pyramid of downsampled levels, stored next to the full-resolution file as
+<name>_<factor>x.csv together with a <name>_levels.json manifest, so overview panels can load a coarse level.
+"""
+import glob
+import json
+import math
+import os
+import re
+from typing import Optional, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import artifacts
+
+_UPPER_PATTERN = re.compile(r'_(max|UQ)(_|$)')
+_LOWER_PATTERN = re.compile(r'_(min|LQ)(_|$)')
+
+# Reduction factors of the pyramid levels, each level is 4x coarser than the previous one
+PYRAMID_FACTORS = [2, 8, 32, 128, 512]
+
+# Levels with fewer rows than this are not worth storing
+MIN_LEVEL_ROWS = 500
+
+
+def reduce_buckets(df: pd.DataFrame, factor: int) -> pd.DataFrame:
+    """
+    Reduce a DataFrame by combining every `factor` consecutive rows into one row.
+
+    :param df: DataFrame ordered by time, with numeric columns only
+    :param factor: Number of rows per bucket
+    :return: Reduced DataFrame with ceil(len(df) / factor) rows
+    """
+    if factor <= 1 or len(df) == 0:
+        return df.reset_index(drop=True)
+
+    starts = np.arange(0, len(df), factor)
+    counts = np.diff(np.append(starts, len(df)))
+    reduced = {}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if column == 'Time':
+            reduced[column] = values[starts]
+        elif column.startswith('Delta'):
+            reduced[column] = np.add.reduceat(values, starts)
+        elif _UPPER_PATTERN.search(column):
+            reduced[column] = np.maximum.reduceat(values, starts)
+        elif _LOWER_PATTERN.search(column):
+            reduced[column] = np.minimum.reduceat(values, starts)
+        else:
+            reduced[column] = np.add.reduceat(values.astype(np.float64), starts) / counts
+    return pd.DataFrame(reduced, columns=df.columns)
+
+
+def downsample(df: pd.DataFrame, max_points: Optional[int]) -> pd.DataFrame:
+    """
+    Downsample a DataFrame to at most max_points rows.
+
+    :param df: DataFrame ordered by time, with numeric columns only
+    :param max_points: Maximum number of rows, None or 0 to keep all rows
+    :return: Downsampled DataFrame
+    """
+    if not max_points or len(df) <= max_points:
+        return df.reset_index(drop=True)
+    return reduce_buckets(df, math.ceil(len(df) / max_points))
+
+
+def build_pyramid(df: pd.DataFrame) -> Dict[int, pd.DataFrame]:
+    """
+    Build the downsampled levels of a DataFrame. Every level is reduced from the previous one, so the full-resolution
+    data is only scanned once.
+
+    :param df: DataFrame ordered by time, with numeric columns only
+    :return: Dictionary mapping reduction factor to downsampled DataFrame
+    """
+    levels = {}
+    previous, previous_factor = df, 1
+    for factor in PYRAMID_FACTORS:
+        if math.ceil(len(df) / factor) < MIN_LEVEL_ROWS:
+            break
+        previous = reduce_buckets(previous, factor // previous_factor)
+        previous_factor = factor
+        levels[factor] = previous
+    return levels
+
+
+def level_path(path: str, factor: int) -> str:
+    """
+    Path of a pyramid level of a file.
+
+    :param path: Path of the full-resolution CSV file
+    :param factor: Reduction factor, 1 for the full-resolution file
+    :return: Path of the level
+    """
+    if factor == 1:
+        return path
+    base, extension = os.path.splitext(path)
+    return f"{base}_{factor}x{extension}"
+
+
+def _manifest_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}_levels.json"
+
+
+def write_pyramid(df: pd.DataFrame, path: str) -> List[int]:
+    """
+    Build the pyramid of a DataFrame and save the levels and manifest next to its full-resolution file.
+    Levels of a previous, longer version of the file are removed.
+
+    :param df: DataFrame that was saved to path
+    :param path: Path of the full-resolution CSV file
+    :return: Reduction factors of the stored levels
+    """
+    levels = build_pyramid(df)
+    for stale in glob.glob(f"{glob.escape(os.path.splitext(path)[0])}_*x.csv"):
+        artifacts.remove(stale)
+    for factor, level in levels.items():
+        level.to_csv(level_path(path, factor), index=False)
+        artifacts.publish(level_path(path, factor))
+    with open(_manifest_path(path), 'w') as file:
+        json.dump({'rows': len(df), 'factors': list(levels.keys())}, file)
+    return list(levels.keys())
+
+
+def read_levels(path: str) -> Tuple[int, List[int]]:
+    """
+    Read the manifest of the pyramid of a file.
+
+    :param path: Path of the full-resolution CSV file
+    :return: Number of full-resolution rows (-1 if unknown) and available reduction factors
+    """
+    try:
+        with open(_manifest_path(path), 'r') as file:
+            manifest = json.load(file)
+        return manifest['rows'], manifest['factors']
+    except (OSError, ValueError, KeyError):
+        return -1, []
+
+
+def select_factor(rows: int, max_points: Optional[int], factors: List[int]) -> int:
+    """
+    Select the coarsest level that still has at least max_points rows, so that downsampling the level to max_points
+    gives the same buckets as downsampling the full-resolution data.
+
+    :param rows: Number of full-resolution rows that are requested
+    :param max_points: Maximum number of points to draw, None for full resolution
+    :param factors: Available reduction factors
+    :return: Reduction factor to use, 1 for the full-resolution file
+    """
+    if not max_points or rows <= max_points:
+        return 1
+    selected = 1
+    for factor in sorted(factors):
+        if rows / factor >= max_points:
+            selected = factor
+    return selected
+
+
+def select_static_factor(rows: int, max_points: Optional[int], factors: List[int]) -> int:
+    """
+    Select the finest level that has at most max_points rows, for clients that load a level file as is.
+
+    :param rows: Number of full-resolution rows
+    :param max_points: Maximum number of points to draw, None for full resolution
+    :param factors: Available reduction factors
+    :return: Reduction factor to use, 1 for the full-resolution file
+    """
+    if not max_points or rows <= max_points or not factors:
+        return 1
+    for factor in sorted(factors):
+        if math.ceil(rows / factor) <= max_points:
+            return factor
+    return max(factors)
@@ -1,8 +1,14 @@
 """
 Module containing service with functionality for experiments.
 """
-from typing import List, Optional
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 
+from experiment_store import ExperimentStore, StoredExperiment
+import metrics
 from models.experiment import Experiment
 from models.types.experiment_type import ExperimentType
 from models.types.measurement_type import MeasurementType
@@ -12,21 +18,73 @@ from group_service import GroupService
 class ExperimentService:
     """
     Class containing functionality for experiments.
+
+    Readers get an immutable snapshot of the experiments, changes are serialized by a lock and replace the snapshot.
+    Panels of experiments with overlapping groups are generated one at a time, as they write the same comparison
+    files, while other requests continue.
     """
     _group_service: GroupService
-    _experiments: List[Experiment]
+    _experiments: Tuple[Experiment, ...]
+    _store: Optional[ExperimentStore]
+    _panel_store: Optional[ExperimentStore]
+    _loaded: Dict[StoredExperiment, Optional[Experiment]]
+    _lock: threading.RLock
+    _group_locks: Dict[str, threading.Lock]
 
-    def __init__(self, group_service: GroupService):
+    def __init__(self, group_service: GroupService, store: Optional[ExperimentStore] = None,
+                 panel_store: Optional[ExperimentStore] = None):
+        """
+        :param group_service: Service to find the groups of experiments
+        :param store: Store persisting the experiments and their panels, None to keep the experiments in memory only
+        :param panel_store: Store of the generated panels only, e.g. to reuse panels of experiments kept in memory.
+                            Defaults to store
+        """
         self._group_service = group_service
-        self._experiments = []
+        self._experiments = ()
+        self._store = store
+        self._panel_store = panel_store or store
+        self._loaded = {}
+        self._lock = threading.RLock()
+        self._group_locks = {}
 
-    def get_experiments(self) -> List[Experiment]:
+    def get_experiments(self) -> Tuple[Experiment, ...]:
         """
         Get list of all experiments.
 
-        :return: List of experiments.
+        :return: Snapshot of the experiments.
         """
-        return self._experiments
+        if self._store is None:
+            return self._experiments
+
+        stored = self._store.load()
+        with self._lock:
+            # Other processes may have changed the experiments, only new or changed ones are created again, as well
+            # as experiments whose groups were added or replaced since
+            loaded = {}
+            for row in stored:
+                experiment = self._loaded.get(row)
+                if experiment is None or not self._has_current_groups(experiment):
+                    experiment = self._create_experiment(*row, warn=row not in self._loaded)
+                loaded[row] = experiment
+            self._loaded = loaded
+            self._experiments = tuple(experiment for experiment in loaded.values() if experiment is not None)
+            return self._experiments
+
+    def _has_current_groups(self, experiment: Experiment) -> bool:
+        return all(self._group_service.find_group(group.name) is group for group in experiment.groups)
+
+    def _create_experiment(self, name: str, group_names: tuple, experiment_type: int,
+                           measurement_types: tuple, warn: bool = True) -> Optional[Experiment]:
+        groups = [self._group_service.find_group(group_name) for group_name in group_names]
+        if None in groups:
+            # Stored experiments can refer to groups that were removed from the input folder since
+            if warn:
+                print(f'Skipping experiment {name}, not all of its groups {list(group_names)} exist')
+            return None
+        # MeasurementType members have tuple definitions, so they are looked up by value explicitly
+        by_value = {member.value: member for member in MeasurementType}
+        return Experiment(name, groups, ExperimentType(experiment_type),
+                          [by_value[measurement_type] for measurement_type in measurement_types])
 
     def find_experiment(self, experiment_name: str) -> Optional[Experiment]:
         """
@@ -35,13 +93,13 @@ class ExperimentService:
         :param experiment_name: experiment name
         :return: Experiment or None if not found
         """
-        for experiment in self._experiments:
+        for experiment in self.get_experiments():
             if experiment.name.lower() == experiment_name.lower():
                 return experiment
         return None
 
     def add_experiment(self, experiment_name: str, group_names: List[str],
-                  measurement_types: List[MeasurementType], experiment_type: ExperimentType):
+                       measurement_types: List[MeasurementType], experiment_type: ExperimentType):
         """
         Add an experiment configuration.
 
@@ -50,25 +108,91 @@ class ExperimentService:
         :param measurement_types: The measurement types to analyze.
         :param experiment_type: The experiment type.
         :return: New list of experiments
+        :raises ValueError: If a group does not exist or an experiment with the same name exists
         """
         groups = [self._group_service.find_group(name) for name in group_names]
+        missing = [name for name, group in zip(group_names, groups) if group is None]
+        if missing:
+            raise ValueError(f'Groups {missing} of experiment "{experiment_name}" do not exist')
 
-        if self.find_experiment(experiment_name) is not None:
-            raise ValueError(f'Experiment with name "{experiment_name}" already exists')
+        with self._lock:
+            if self.find_experiment(experiment_name) is not None:
+                raise ValueError(f'Experiment with name "{experiment_name}" already exists')
 
-        new_experiment = Experiment(experiment_name, groups, experiment_type, measurement_types)
-        self._experiments = self._experiments + [new_experiment]
-        return self._experiments
+            if self._store is not None:
+                # The store also rejects names of stored experiments whose groups were removed since
+                self._store.add(experiment_name, group_names, experiment_type.value,
+                                [measurement_type.value for measurement_type in measurement_types])
+                return self.get_experiments()
 
-    def delete_experiment(self, experiment_name: str) -> List[Experiment]:
+            new_experiment = Experiment(experiment_name, groups, experiment_type, measurement_types)
+            self._experiments = self._experiments + (new_experiment,)
+            return self._experiments
+
+    def delete_experiment(self, experiment_name: str) -> Tuple[Experiment, ...]:
         """
         Delete an experiment configuration.
 
         :param experiment_name: The name of the experiment.
         :return: The new list of experiment configurations.
         """
-        if self.find_experiment(experiment_name) is None:
-            raise ValueError(f'Experiment with name "{experiment_name}" does not exist')
+        if self._store is not None:
+            self._store.delete(experiment_name)
+            return self.get_experiments()
+
+        with self._lock:
+            if self.find_experiment(experiment_name) is None:
+                raise ValueError(f'Experiment with name "{experiment_name}" does not exist')
+
+            self._experiments = tuple(exp for exp in self._experiments if exp.name.lower() != experiment_name.lower())
+            return self._experiments
+
+    def create_visualization_panels(self, experiment: Experiment, templated: bool = False) -> List[Dict[str, Any]]:
+        """
+        Get the panels of an experiment. Panels stored for the same fingerprint (unchanged definition, groups and
+        templates) are reused as long as the artifacts they refer to exist, otherwise the panels and their artifacts
+        are generated again and stored.
 
-        self._experiments = [exp for exp in self._experiments if exp.name.lower() != experiment_name.lower()]
-        return self._experiments
+        :param experiment: Experiment to visualize
+        :param templated: Generate panels that repeat over the group/core dashboard variables
+        :return: List of panel configurations for Grafana dashboard.
+        """
+        with self._generation_lock(experiment):
+            if self._panel_store is None:
+                return experiment.create_visualization_panels(templated)
+
+            fingerprint = experiment.fingerprint(templated)
+            panels = self._panel_store.load_panels(experiment.name, templated, fingerprint)
+            if panels is not None and self._artifacts_exist(panels):
+                metrics.cache_lookup('panels', True)
+                print(f'Reusing stored panels of experiment {experiment.name}')
+                return panels
+
+            metrics.cache_lookup('panels', False)
+            panels = experiment.create_visualization_panels(templated)
+            self._panel_store.save_panels(experiment.name, templated, fingerprint, panels)
+            return panels
+
+    def _generation_lock(self, experiment: Experiment) -> threading.Lock:
+        """
+        Lock for generating panels of the groups of an experiment. Comparison files are written per pair of groups,
+        so experiments are locked by the combination of their groups.
+
+        :param experiment: Experiment to generate panels for
+        :return: Lock shared by all experiments with the same groups
+        """
+        key = '/'.join(sorted(group.name for group in experiment.groups))
+        with self._lock:
+            return self._group_locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _artifacts_exist(panels: List[Dict[str, Any]]) -> bool:
+        """
+        Check that the files served by nginx that panels refer to (e.g. comparison files and plots) exist.
+
+        :param panels: Panel configurations
+        :return: True if all files exist
+        """
+        paths = set(re.findall(r'csv-data/[^?"\\\s]+', json.dumps(panels)))
+        # Paths with dashboard variables (templated panels) are resolved by Grafana
+        return all(os.path.exists(path) for path in paths if '${' not in path)
@@ -0,0 +1,149 @@
+"""
+Module containing a store that persists experiment configurations and their generated panels.
+"""
+import json
+import os
+import sqlite3
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Tuple
+
+# Stored experiment: name, group names, experiment type value, measurement type values
+StoredExperiment = Tuple[str, Tuple[str, ...], int, Tuple[int, ...]]
+
+# Migrations of the store, MIGRATIONS[i] upgrades a store of schema version i to version i + 1
+MIGRATIONS = [
+    # 1: experiment definitions
+    ["""CREATE TABLE IF NOT EXISTS experiments (
+        name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+        group_names TEXT NOT NULL,
+        experiment_type INTEGER NOT NULL,
+        measurement_types TEXT NOT NULL
+    )"""],
+    # 2: generated panels with the fingerprint of the inputs they were generated from
+    ["""CREATE TABLE IF NOT EXISTS panels (
+        experiment TEXT NOT NULL COLLATE NOCASE,
+        templated INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        panels TEXT NOT NULL,
+        PRIMARY KEY (experiment, templated)
+    )"""]
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+class ExperimentStore:
+    """
+    Store of experiment configurations in a SQLite file, so experiments survive restarts and all worker processes of
+    a server see the same experiments. The panels generated for an experiment are stored with the fingerprint of
+    their inputs, so they can be reused as long as the fingerprint does not change.
+
+    The schema version is kept in the user_version of the file, older files are migrated when the store is opened.
+    Every operation uses its own short-lived connection, which makes the store safe to use after fork.
+    """
+    path: str
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the SQLite file, created if it does not exist
+        """
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._migrate()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _migrate(self) -> None:
+        """
+        Upgrade the schema of the file to SCHEMA_VERSION.
+        """
+        with closing(sqlite3.connect(self.path, timeout=10, isolation_level=None)) as conn:
+            # WAL lets workers read while another worker writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Take the write lock before reading the version, so concurrent processes migrate one after another
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version > SCHEMA_VERSION:
+                    raise RuntimeError(f'Experiment store {self.path} has schema version {version}, '
+                                       f'only versions up to {SCHEMA_VERSION} are supported')
+                for migration in MIGRATIONS[version:]:
+                    for statement in migration:
+                        conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            if version < SCHEMA_VERSION:
+                print(f'Migrated experiment store {self.path} from schema version {version} to {SCHEMA_VERSION}')
+
+    def load(self) -> List[StoredExperiment]:
+        """
+        Load all experiments in the order they were added.
+
+        :return: List of stored experiments
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT name, group_names, experiment_type, measurement_types '
+                                'FROM experiments ORDER BY rowid').fetchall()
+        return [(name, tuple(json.loads(group_names)), experiment_type, tuple(json.loads(measurement_types)))
+                for name, group_names, experiment_type, measurement_types in rows]
+
+    def add(self, name: str, group_names: List[str], experiment_type: int, measurement_types: List[int]) -> None:
+        """
+        Add an experiment.
+
+        :param name: Name of the experiment, unique regardless of case
+        :param group_names: Names of the groups in the experiment
+        :param experiment_type: Value of the experiment type
+        :param measurement_types: Values of the measurement types
+        """
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute('INSERT INTO experiments (name, group_names, experiment_type, measurement_types) '
+                             'VALUES (?, ?, ?, ?)',
+                             (name, json.dumps(group_names), experiment_type, json.dumps(measurement_types)))
+        except sqlite3.IntegrityError:
+            raise ValueError(f'Experiment with name "{name}" already exists')
+
+    def delete(self, name: str) -> None:
+        """
+        Delete an experiment and its stored panels.
+
+        :param name: Name of the experiment, regardless of case
+        """
+        with closing(self._connect()) as conn, conn:
+            deleted = conn.execute('DELETE FROM experiments WHERE name = ?', (name,)).rowcount
+            conn.execute('DELETE FROM panels WHERE experiment = ?', (name,))
+        if deleted == 0:
+            raise ValueError(f'Experiment with name "{name}" does not exist')
+
+    def load_panels(self, name: str, templated: bool, fingerprint: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Load the stored panels of an experiment if they were generated from the given fingerprint.
+
+        :param name: Name of the experiment
+        :param templated: Whether the panels are templated
+        :param fingerprint: Fingerprint of the current inputs of the panels
+        :return: Panels, or None if no panels are stored for this fingerprint
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT panels FROM panels WHERE experiment = ? AND templated = ? AND fingerprint = ?',
+                               (name, int(templated), fingerprint)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def save_panels(self, name: str, templated: bool, fingerprint: str, panels: List[Dict[str, Any]]) -> None:
+        """
+        Store the panels generated for an experiment, replacing panels generated from other inputs.
+
+        :param name: Name of the experiment
+        :param templated: Whether the panels are templated
+        :param fingerprint: Fingerprint of the inputs the panels were generated from
+        :param panels: Generated panels
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO panels (experiment, templated, fingerprint, panels) '
+                         'VALUES (?, ?, ?, ?)', (name, int(templated), fingerprint, json.dumps(panels)))
@@ -3,9 +3,12 @@ Service for generating and managing Grafana dashboard configurations.
 """
 import json
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 
+import tracing
 from models.experiment import Experiment
+from visualization.data_source import dashboard_time_range
+from visualization.templating import dashboard_variables
 
 class GrafanaService:
     """
@@ -22,41 +25,58 @@ class GrafanaService:
         # Ensure the dashboards directory exists
         os.makedirs(os.path.dirname(dashboard_config_path), exist_ok=True)
 
-    def create_dashboard_from_experiments(self, experiments: List[Experiment]) -> None:
+    def create_dashboard_from_experiments(
+            self, experiments: List[Experiment], templated: bool = False,
+            create_panels: Optional[Callable[[Experiment, bool], List[Dict[str, Any]]]] = None) -> None:
         """
         Create a separate dashboard for each experiment.
         
         :param experiments: List of experiments to visualize
+        :param templated: Create compact dashboards with group/core variables and repeating panels
+        :param create_panels: Function returning the panels of an experiment (e.g. reusing stored panels),
+                              Experiment.create_visualization_panels by default
         """
         for experiment in experiments:
-            self._create_single_experiment_dashboard(experiment)
+            self._create_single_experiment_dashboard(experiment, templated, create_panels)
 
-    def _create_single_experiment_dashboard(self, experiment: Experiment) -> None:
+    def _create_single_experiment_dashboard(
+            self, experiment: Experiment, templated: bool = False,
+            create_panels: Optional[Callable[[Experiment, bool], List[Dict[str, Any]]]] = None) -> None:
         """
         Create a dashboard for a single experiment.
         
         :param experiment: Experiment to visualize
+        :param templated: Create a compact dashboard with group/core variables and repeating panels
+        :param create_panels: Function returning the panels of an experiment
         """
+        group_names = ','.join(group.name for group in experiment.groups)
+        experiment_type = experiment.experiment_type.name
         # Get panels for this experiment
-        panels = experiment.create_visualization_panels()
+        with tracing.stage('panels', group_names, experiment_type):
+            panels = (create_panels or Experiment.create_visualization_panels)(experiment, templated)
         
-        # Load dashboard template
-        with open("/app/csv-data/grafana-templates/dashboard_template.json", 'r') as file:
-            dashboard_template = json.load(file)
+        with tracing.stage('dashboard_write', group_names, experiment_type):
+            # Load dashboard template
+            with open("csv-data/grafana-templates/dashboard_template.json", 'r') as file:
+                dashboard_template = json.load(file)
         
-        # Insert panels and update dashboard title
-        dashboard_template["panels"] = panels
-        dashboard_template["title"] = f"Energibridge - {experiment.name}"
+            # Insert panels and update dashboard title
+            dashboard_template["panels"] = panels
+            dashboard_template["title"] = f"Energibridge - {experiment.name}"
+            # Panels load the time range of the dashboard, which starts showing all samples
+            dashboard_template["time"] = dashboard_time_range(experiment.groups)
+            if templated:
+                dashboard_template["templating"]["list"] = dashboard_variables(experiment.groups)
         
-        # Generate a unique UID for the dashboard based on experiment name
-        sanitized_name = experiment.name.lower().replace(' ', '_').replace('-', '_')
-        dashboard_template["uid"] = f"eb_{sanitized_name}"
+            # Generate a unique UID for the dashboard based on experiment name
+            sanitized_name = experiment.name.lower().replace(' ', '_').replace('-', '_')
+            dashboard_template["uid"] = f"eb_{sanitized_name}"
         
-        # Save dashboard configuration
-        sanitized_filename = sanitized_name.replace(' ', '_').replace('/', '_')
-        save_path = os.path.join(os.path.dirname(self.dashboard_path), f"{sanitized_filename}.json")
+            # Save dashboard configuration
+            sanitized_filename = sanitized_name.replace(' ', '_').replace('/', '_')
+            save_path = os.path.join(os.path.dirname(self.dashboard_path), f"{sanitized_filename}.json")
         
-        with open(save_path, 'w') as file:
-            json.dump(dashboard_template, file, indent=2)
+            with open(save_path, 'w') as file:
+                json.dump(dashboard_template, file, indent=2)
         
         print(f"Dashboard for experiment '{experiment.name}' saved to {save_path}")
@@ -1,19 +1,55 @@
 """
 Module containing a service with functionality for experiment groups.
 """
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 import os
+import threading
+import uuid
 
+from analysis.outliers import OutlierPolicy
+from database_service import DatabaseService
 from models.group import Group
+from models.trial import Trial
+import tracing
+
+# File in the output folder of a group that changes whenever the group is ingested, see GroupService
+VERSION_FILE = 'group.version'
 
 
 class GroupService:
     """
     Service with functionality for experiment groups.
+
+    The registry is an immutable tuple that is replaced as a whole when a group is added, so readers work on a
+    consistent snapshot without locking while writes are serialized.
+
+    Every ingest writes a new version token to the VERSION_FILE of the group. Server workers each have their own
+    registry, so before answering, the registry checks the version files of the groups in the input folder and loads
+    the groups another process ingested (new groups, uploads, changed outlier policies) from their output folder.
     """
-    _groups: List[Group]
+    _groups: Tuple[Group, ...]
+    _write_lock: threading.Lock
+    # Name of every group in lower case -> version file state (inode, modification time) and token it was loaded at
+    _versions: Dict[str, Tuple[Tuple[int, int], str]]
+    database_service: Optional[DatabaseService]
+
+    def __init__(self, database_service: Optional[DatabaseService] = None, groups: Optional[Iterable[Group]] = None):
+        """
+        :param database_service: Service to load the groups into the database, None to only write CSV files
+        :param groups: Already ingested groups (e.g. by the batch pipeline), None to ingest all groups in the input
+                       folder
+        """
+        self.database_service = database_service
+        self._write_lock = threading.Lock()
+        self._versions = {}
+        if groups is not None:
+            self._groups = tuple(groups)
+            for group in self._groups:
+                version = self._read_version(group.name)
+                if version is not None:
+                    self._versions[group.name.lower()] = version
+            return
 
-    def __init__(self):
         print('Looking for existing groups in:', Group.output_folder)
         if not os.path.exists(Group.output_folder):
             os.makedirs(Group.output_folder)
@@ -22,16 +58,101 @@ class GroupService:
         #                 if os.path.isdir(os.path.join(Group.output_folder, f))]
 
 
-        self._groups = []
-
         # Auto import all groups from the input folder
-        for folder in os.listdir(Group.input_folder):
-            self._groups.append(Group(folder))
+        self._groups = tuple(self._ingest(folder) for folder in os.listdir(Group.input_folder))
+
+        for group in self._groups:
+            if self.database_service is not None:
+                self.database_service.load_group(group)
+            self._write_version(group.name)
 
 
         print('Found the following groups:', [group.name for group in self._groups])
         #print(f'No. cores found in first group: {str(self._groups[0].no_cores)}')
 
+    @staticmethod
+    def _ingest(group_name: str, profile: Optional[bool] = None, trials: Optional[List[Trial]] = None) -> Group:
+        """
+        Ingest a group from the input folder as a traced job.
+
+        :param group_name: Name of the group folder in the input folder
+        :param profile: Whether to profile the ingest, tracing.PROFILE_JOBS if None
+        :param trials: Already preprocessed trials of the group, None to preprocess all trial files
+        :return: The ingested group
+        """
+        with tracing.job('ingest', profile, group=group_name):
+            return Group(group_name, trials)
+
+    @staticmethod
+    def _version_path(group_name: str) -> str:
+        return os.path.join(Group.output_folder, group_name, VERSION_FILE)
+
+    def _read_version(self, group_name: str) -> Optional[Tuple[Tuple[int, int], str]]:
+        """
+        Read the version file of a group. The file is only read again when it was replaced since the last read.
+
+        :param group_name: Name of the group
+        :return: State of the version file and version token, None if the group has no version file
+        """
+        try:
+            stat = os.stat(self._version_path(group_name))
+        except OSError:
+            return None
+        state = (stat.st_ino, stat.st_mtime_ns)
+        known = self._versions.get(group_name.lower())
+        if known is not None and known[0] == state:
+            return known
+        try:
+            with open(self._version_path(group_name), 'r') as file:
+                return state, file.read().strip()
+        except OSError:
+            return None
+
+    def _write_version(self, group_name: str) -> None:
+        """
+        Write a new version token for a freshly ingested group, which tells the other processes to reload it.
+        The file is replaced atomically, so readers never see a partial token.
+
+        :param group_name: Name of the group
+        """
+        path = self._version_path(group_name)
+        partial_path = f'{path}.{uuid.uuid4().hex}.part'
+        with open(partial_path, 'w') as file:
+            file.write(uuid.uuid4().hex)
+        os.replace(partial_path, path)
+        self._versions[group_name.lower()] = self._read_version(group_name)
+
+    def _refresh(self) -> None:
+        """
+        Load the groups that were ingested by another process since this registry loaded them.
+        """
+        stale = []
+        for folder in os.listdir(Group.input_folder):
+            if not os.path.isdir(os.path.join(Group.input_folder, folder)):
+                continue
+            version = self._read_version(folder)
+            known = self._versions.get(folder.lower())
+            if version is not None and (known is None or known[1] != version[1]):
+                stale.append(folder)
+        if not stale:
+            return
+
+        with self._write_lock:
+            for folder in stale:
+                version = self._read_version(folder)
+                known = self._versions.get(folder.lower())
+                if version is None or (known is not None and known[1] == version[1]):
+                    continue  # Reloaded by another thread meanwhile
+                try:
+                    group = Group.load(folder)
+                except (OSError, ValueError) as e:
+                    print(f'Reloading group {folder} failed: {e}')
+                    continue
+                self._groups = tuple(existing for existing in self._groups
+                                     if existing.name.lower() != folder.lower()) + (group,)
+                self._versions[folder.lower()] = version
+                print(f'Reloaded group {group.name}, it was ingested by another process')
+
     def find_group(self, group_name: str) -> Optional[Group]:
         """
         Find group by name.
@@ -39,15 +160,52 @@ class GroupService:
         :param group_name: Name of group
         :return: Group if found else None
         """
+        self._refresh()
         for group in self._groups:
             if group.name.lower() == group_name.lower():
                 return group
         return None
 
-    def get_groups(self) -> List[Group]:
+    def get_groups(self) -> Tuple[Group, ...]:
         """
         Get list of all group parseable by frontend.
 
-        :return: List of Groups
+        :return: Snapshot of the groups
+        """
+        self._refresh()
+        return self._groups
+
+    def add_group(self, group_name: str, profile: Optional[bool] = None, trials: Optional[List[Trial]] = None) -> Group:
+        """
+        Ingest a group from the input folder, replacing the group with the same name if it exists. Requests keep
+        seeing the previous groups until the new group is completely ingested.
+
+        :param group_name: Name of the group folder in the input folder
+        :param profile: Whether to profile the ingest with the sampling profiler, tracing.PROFILE_JOBS if None
+        :param trials: Already preprocessed trials of the group, None to preprocess all trial files
+        :return: The ingested group
+        """
+        with self._write_lock:
+            group = self._ingest(group_name, profile, trials)
+            if self.database_service is not None:
+                self.database_service.load_group(group)
+            self._groups = tuple(existing for existing in self._groups
+                                 if existing.name.lower() != group_name.lower()) + (group,)
+            self._write_version(group.name)
+        print(f'Added group {group.name}')
+        return group
+
+    def set_outlier_policy(self, group_name: str, policy: OutlierPolicy) -> Group:
+        """
+        Change the outlier policy of a group and aggregate and summarize it again. Its trials are not preprocessed
+        again and their outlier scores are cached, so only the group level steps are repeated.
+
+        :param group_name: Name of the group
+        :param policy: New outlier policy
+        :return: The updated group
         """
-        return self._groups
\ No newline at end of file
+        group = self.find_group(group_name)
+        if group is None:
+            raise FileNotFoundError(f'Group {group_name} not found')
+        policy.save(os.path.join(Group.input_folder, group.name))
+        return self.add_group(group.name, profile=False, trials=group.trials)
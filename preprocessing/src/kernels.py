@@ -0,0 +1,367 @@
+"""
+Numeric kernels of the preprocessing and aggregation hot loops.
+
+Every kernel has a NumPy reference implementation and, when Numba is installed, a JIT compiled implementation that
+fuses the steps into a single pass over the data. The backend is chosen with the KERNEL_BACKEND environment variable:
+"numpy", "numba", or "auto" (default) for Numba when it is installed.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # Numba is optional, the NumPy kernels are used without it
+    numba = None
+
+KERNEL_BACKEND = os.environ.get('KERNEL_BACKEND', 'auto')
+
+# Statistics computed by order_statistics, in the order of the aggregate columns
+STATISTICS = ('mean', 'std', 'median', 'min', 'max', 'LQ', 'UQ')
+
+
+class Backend:
+    """
+    Implementation of the kernels.
+    """
+    name: str
+    quantise: Callable[[np.ndarray, np.ndarray, float], Tuple[np.ndarray, np.ndarray]]
+    energy_power: Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]
+    power_energy: Callable[[np.ndarray, np.ndarray], np.ndarray]
+    order_statistics: Callable[[np.ndarray], Tuple[np.ndarray, ...]]
+    change_points: Callable[[np.ndarray, float, int], np.ndarray]
+
+    def __init__(self, name: str, quantise, energy_power, power_energy, order_statistics, change_points):
+        self.name = name
+        self.quantise = quantise
+        self.energy_power = energy_power
+        self.power_energy = power_energy
+        self.order_statistics = order_statistics
+        self.change_points = change_points
+
+
+# ------------------------------------------------------------------------------------------------------
+
+# NumPy reference implementation
+
+
+def _quantise_numpy(time: np.ndarray, deltas: np.ndarray, delta: float) -> Tuple[np.ndarray, np.ndarray]:
+    time = time - time.min()
+    return np.rint(time / delta) * delta, np.rint(deltas / delta) * delta
+
+
+def _energy_power_numpy(energy: np.ndarray, deltas: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    diff = np.zeros_like(energy)
+    diff[1:] = energy[1:] - energy[:-1]
+    diff[np.isnan(diff)] = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power = diff / (deltas / 1000)[:, None]
+    power[~np.isfinite(power)] = 0
+    return diff, power
+
+
+def _power_energy_numpy(power: np.ndarray, deltas: np.ndarray) -> np.ndarray:
+    energy = power * (deltas / 1000)[:, None]
+    energy[np.isnan(energy)] = 0
+    return energy
+
+
+def _order_statistics_numpy(values: np.ndarray) -> Tuple[np.ndarray, ...]:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = values.std(axis=1, ddof=1) if values.shape[1] > 1 else np.full(len(values), np.nan)
+    lower, upper = np.quantile(values, [0.25, 0.75], axis=1)
+    return (values.mean(axis=1), std, np.median(values, axis=1), values.min(axis=1), values.max(axis=1),
+            lower, upper)
+
+
+def _backtrack(last: np.ndarray) -> np.ndarray:
+    change_points = []
+    end = len(last) - 1
+    while end > 0:
+        end = last[end]
+        change_points.append(end)
+    return np.array(sorted(change_points)[1:], dtype=np.int64)
+
+
+def _change_points_numpy(values: np.ndarray, penalty: float, min_size: int) -> np.ndarray:
+    n = len(values)
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    squares = np.concatenate(([0.0], np.cumsum(values ** 2)))
+    # Optimal cost of the values before every index, inf where no segmentation into segments of min_size exists
+    optimal = np.full(n + 1, np.inf)
+    optimal[0] = -penalty
+    last = np.zeros(n + 1, dtype=np.int64)
+    candidates = np.array([0], dtype=np.int64)
+    for end in range(min_size, n + 1):
+        lengths = end - candidates
+        admissible = lengths >= min_size
+        with np.errstate(invalid='ignore'):
+            costs = np.where(admissible, optimal[candidates] + squares[end] - squares[candidates]
+                             - (sums[end] - sums[candidates]) ** 2 / np.maximum(lengths, 1), np.inf)
+        best = int(np.argmin(costs))
+        optimal[end] = costs[best] + penalty
+        last[end] = candidates[best]
+        # Pruning: a start that is worse than the optimum now can never be the optimal last change point later
+        candidates = np.append(candidates[~admissible | (costs <= optimal[end])], end)
+    return _backtrack(last)
+
+
+NUMPY = Backend('numpy', _quantise_numpy, _energy_power_numpy, _power_energy_numpy, _order_statistics_numpy,
+                _change_points_numpy)
+
+# ------------------------------------------------------------------------------------------------------
+
+# Numba implementation, compiled on first use. The kernels use the NumPy error model, so a division by a delta of 0
+# gives inf or NaN like in the NumPy implementation instead of raising ZeroDivisionError
+
+NUMBA = None
+if numba is not None:
+    @numba.njit(cache=True, error_model='numpy')
+    def _quantise_numba(time, deltas, delta):
+        time_min = time.min()
+        quantised_time = np.empty(len(time))
+        quantised_deltas = np.empty(len(deltas))
+        for i in range(len(time)):
+            quantised_time[i] = np.rint((time[i] - time_min) / delta) * delta
+            quantised_deltas[i] = np.rint(deltas[i] / delta) * delta
+        return quantised_time, quantised_deltas
+
+    # The energy and power kernels work on the columns of a single trial, which are too small to parallelise
+    @numba.njit(cache=True, error_model='numpy')
+    def _energy_power_numba(energy, deltas):
+        rows, columns = energy.shape
+        diff = np.zeros((rows, columns))
+        power = np.zeros((rows, columns))
+        for column in range(columns):
+            for i in range(1, rows):
+                value = energy[i, column] - energy[i - 1, column]
+                if np.isnan(value):
+                    continue
+                diff[i, column] = value
+                value = value / (deltas[i] / 1000)
+                if np.isfinite(value):
+                    power[i, column] = value
+        return diff, power
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _power_energy_numba(power, deltas):
+        rows, columns = power.shape
+        energy = np.zeros((rows, columns))
+        for column in range(columns):
+            for i in range(rows):
+                value = power[i, column] * (deltas[i] / 1000)
+                if not np.isnan(value):
+                    energy[i, column] = value
+        return energy
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _lerp(a, b, t):
+        # Linear interpolation as done by numpy.quantile, so both backends return the same quantiles
+        if t >= 0.5:
+            return b - (b - a) * (1 - t)
+        return a + (b - a) * t
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _quantile_sorted(values, q):
+        index = q * (len(values) - 1)
+        lower = int(np.floor(index))
+        upper = min(lower + 1, len(values) - 1)
+        return _lerp(values[lower], values[upper], index - lower)
+
+    @numba.njit(parallel=True, cache=True, error_model='numpy')
+    def _sorted_statistics(rows_sorted):
+        rows, n = rows_sorted.shape
+        mean = np.empty(rows)
+        std = np.empty(rows)
+        median = np.empty(rows)
+        minimum = np.empty(rows)
+        maximum = np.empty(rows)
+        lower = np.empty(rows)
+        upper = np.empty(rows)
+        for i in numba.prange(rows):
+            row = rows_sorted[i]
+            total = 0.0
+            for value in row:
+                total += value
+            mean[i] = total / n
+            squares = 0.0
+            for value in row:
+                squares += (value - mean[i]) ** 2
+            std[i] = np.sqrt(squares / (n - 1)) if n > 1 else np.nan
+            if np.isnan(row[n - 1]):
+                # NaN is sorted last, like NumPy all statistics of a row with a NaN are NaN
+                median[i] = minimum[i] = maximum[i] = lower[i] = upper[i] = np.nan
+                continue
+            middle = n // 2
+            median[i] = row[middle] if n % 2 == 1 else (row[middle - 1] + row[middle]) / 2
+            minimum[i] = row[0]
+            maximum[i] = row[n - 1]
+            lower[i] = _quantile_sorted(row, 0.25)
+            upper[i] = _quantile_sorted(row, 0.75)
+        return mean, std, median, minimum, maximum, lower, upper
+
+    def _order_statistics_numba(values):
+        # NumPy sorts faster than compiled code, after one sort all statistics are computed in a single pass
+        return _sorted_statistics(np.sort(values, axis=1))
+
+    # Releases the GIL, so the trials of a group are segmented in parallel by threads
+    @numba.njit(cache=True, nogil=True, error_model='numpy')
+    def _optimal_partition_numba(values, penalty, min_size):
+        n = len(values)
+        sums = np.zeros(n + 1)
+        squares = np.zeros(n + 1)
+        for i in range(n):
+            sums[i + 1] = sums[i] + values[i]
+            squares[i + 1] = squares[i] + values[i] ** 2
+        optimal = np.full(n + 1, np.inf)
+        optimal[0] = -penalty
+        last = np.zeros(n + 1, dtype=np.int64)
+        candidates = np.zeros(n + 1, dtype=np.int64)
+        costs = np.empty(n + 1)
+        count = 1
+        for end in range(min_size, n + 1):
+            best = np.inf
+            for i in range(count):
+                start = candidates[i]
+                if end - start < min_size:
+                    continue
+                costs[i] = (optimal[start] + squares[end] - squares[start]
+                            - (sums[end] - sums[start]) ** 2 / (end - start))
+                if costs[i] < best:
+                    best = costs[i]
+                    last[end] = start
+            optimal[end] = best + penalty
+            kept = 0
+            for i in range(count):
+                start = candidates[i]
+                if end - start < min_size or costs[i] <= optimal[end]:
+                    candidates[kept] = start
+                    kept += 1
+            candidates[kept] = end
+            count = kept + 1
+        return last
+
+    def _change_points_numba(values, penalty, min_size):
+        return _backtrack(_optimal_partition_numba(values, penalty, min_size))
+
+    NUMBA = Backend('numba', _quantise_numba, _energy_power_numba, _power_energy_numba, _order_statistics_numba,
+                    _change_points_numba)
+
+BACKENDS: Dict[str, Backend] = {backend.name: backend for backend in (NUMPY, NUMBA) if backend is not None}
+
+# ------------------------------------------------------------------------------------------------------
+
+# Backend selection
+
+_local = threading.local()
+
+
+def get_backend(name: Optional[str] = None) -> Backend:
+    """
+    :param name: "numpy", "numba" or "auto", the backend selected by using() or KERNEL_BACKEND if None
+    :return: The backend
+    """
+    name = name or getattr(_local, 'name', None) or KERNEL_BACKEND
+    if name == 'auto':
+        return NUMBA or NUMPY
+    if name == 'numba' and NUMBA is None:
+        raise ValueError('The numba kernel backend needs the numba package')
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown kernel backend "{name}", valid backends are: auto, numpy, numba')
+    return BACKENDS[name]
+
+
+@contextmanager
+def using(name: str) -> Iterator[Backend]:
+    """
+    Use a backend in the current thread within the with block.
+
+    :param name: Name of the backend
+    :return: Context manager yielding the backend
+    """
+    backend = get_backend(name)
+    previous = getattr(_local, 'name', None)
+    _local.name = backend.name
+    try:
+        yield backend
+    finally:
+        _local.name = previous
+
+
+# ------------------------------------------------------------------------------------------------------
+
+# Kernels
+
+
+def quantise(time: np.ndarray, deltas: np.ndarray, delta: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Normalise the time to start at 0 and round time and deltas to multiples of delta (half to even).
+
+    :param time: Time of the samples in ms
+    :param deltas: Deltas of the samples in ms
+    :param delta: Delta to quantise to
+    :return: Quantised time and deltas, integers when all inputs are integers
+    """
+    quantised_time, quantised_deltas = get_backend().quantise(np.ascontiguousarray(time), np.ascontiguousarray(deltas),
+                                                              delta)
+    if time.dtype.kind in 'iu' and deltas.dtype.kind in 'iu' and float(delta).is_integer():
+        return quantised_time.astype(np.int64), quantised_deltas.astype(np.int64)
+    return quantised_time, quantised_deltas
+
+
+def energy_power(energy: np.ndarray, deltas: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Differences of cumulative energy columns and the power derived from them. Missing differences are 0, as is the
+    power of samples with a delta of 0.
+
+    :param energy: Cumulative energy in J, one column per energy column of the trial
+    :param deltas: Deltas of the samples in ms
+    :return: Energy differences in J and power in W, with the shape of energy
+    """
+    return get_backend().energy_power(np.ascontiguousarray(energy, dtype=np.float64),
+                                      np.ascontiguousarray(deltas, dtype=np.float64))
+
+
+def power_energy(power: np.ndarray, deltas: np.ndarray) -> np.ndarray:
+    """
+    Energy used in every sample from power columns. Missing values are 0.
+
+    :param power: Power in W, one column per power column of the trial
+    :param deltas: Deltas of the samples in ms
+    :return: Energy in J, with the shape of power
+    """
+    return get_backend().power_energy(np.ascontiguousarray(power, dtype=np.float64),
+                                      np.ascontiguousarray(deltas, dtype=np.float64))
+
+
+def order_statistics(values: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Statistics over the trials of every sample: mean, sample standard deviation, median, minimum, maximum and the
+    lower and upper quartiles (linear interpolation).
+
+    :param values: Values of one column, one row per sample and one column per trial
+    :return: Dictionary with an array per statistic, see STATISTICS
+    """
+    results = get_backend().order_statistics(np.ascontiguousarray(values, dtype=np.float64))
+    return dict(zip(STATISTICS, results))
+
+
+def change_points(values: np.ndarray, penalty: float, min_size: int = 1) -> np.ndarray:
+    """
+    Change points of the mean of a series by PELT (Pruned Exact Linear Time, Killick et al. 2012): the segmentation
+    minimising the sum of squared deviations from the segment means plus a penalty per segment. Pruning keeps the
+    number of candidate segment starts small, so the run time is linear in the length of the series for series with
+    regular changes.
+
+    :param values: Series to segment, without missing values
+    :param penalty: Penalty per change point, in squared units of the series
+    :param min_size: Smallest number of samples of a segment
+    :return: Indices where a new segment starts, in increasing order, without 0
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    if len(values) < 2 * min_size:
+        return np.array([], dtype=np.int64)
+    return get_backend().change_points(values, float(penalty), int(min_size))
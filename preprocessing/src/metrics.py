@@ -0,0 +1,128 @@
+"""
+Metrics of the pipeline and the API, exposed in the Prometheus text format on /metrics with prometheus_client.
+
+Values that are expensive to collect (such as the memory used by each group) are only computed when the metrics are
+scraped, by the process answering the scrape.
+
+With several server workers, PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py): every process then writes its
+counters and histograms to files in that folder, and a scrape sums the files of all workers, so the counters do not
+jump depending on the worker that answers.
+"""
+import os
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, ProcessCollector, \
+    generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+Labels = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Folder the processes write their values to, read by prometheus_client when it is imported
+MULTIPROCESS_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR', '')
+
+
+class ScrapeGauge:
+    """
+    Gauge whose values are computed by a function when the metrics are scraped instead of being kept up to date.
+    """
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._function: Optional[Callable[[], Dict[Labels, float]]] = None
+
+    def set_function(self, function: Callable[[], Dict[Labels, float]]) -> None:
+        """
+        :param function: Function returning the value for every label combination
+        """
+        self._function = function
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        family = GaugeMetricFamily(self.name, self.description, labels=self.label_names)
+        for labels, value in (self._function() if self._function is not None else {}).items():
+            family.add_metric(list(labels), value)
+        yield family
+
+
+# Metrics of this process. In multiprocess mode the values are also written to MULTIPROCESS_DIR
+REGISTRY = CollectorRegistry()
+
+STAGE_DURATION = Histogram('energibridge_stage_duration_seconds',
+                           'Duration of pipeline stages (trial_parse, preprocess, alignment, outliers, attribution, '
+                           'derived, aggregate, spectrum, phases, summarize, correlation, group_summary, plot_render, '
+                           'comparison, panels, dashboard_write)',
+                           ('stage', 'group', 'experiment_type'), buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+ROWS_PROCESSED = Counter('energibridge_rows_processed', 'Rows processed by pipeline stages', ('stage', 'group'),
+                         registry=REGISTRY)
+BYTES_PROCESSED = Counter('energibridge_bytes_processed', 'Bytes read or written by pipeline stages',
+                          ('stage', 'group'), registry=REGISTRY)
+CACHE_REQUESTS = Counter('energibridge_cache_requests', 'Cache lookups by cache and result (hit or miss)',
+                         ('cache', 'result'), registry=REGISTRY)
+REQUEST_DURATION = Histogram('energibridge_http_request_duration_seconds', 'Duration of API requests',
+                             ('endpoint', 'method', 'status'), buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+
+# Computed by the process answering the scrape, every worker has the same groups
+GROUP_MEMORY = ScrapeGauge('energibridge_group_memory_bytes', 'Memory used by the data of a group', ('group',))
+GROUP_MEMORY_SAVED = ScrapeGauge('energibridge_group_memory_saved_bytes',
+                                 'Memory saved by the precision policy on the data of a group', ('group',))
+SCRAPE_GAUGES = (GROUP_MEMORY, GROUP_MEMORY_SAVED)
+
+if not MULTIPROCESS_DIR:
+    for _gauge in SCRAPE_GAUGES:
+        REGISTRY.register(_gauge)
+    # process_resident_memory_bytes and the other process metrics
+    ProcessCollector(registry=REGISTRY)
+
+
+def stage_timer(stage: str, group: str = '', experiment_type: str = ''):
+    """
+    Time a pipeline stage.
+
+    :param stage: Name of the stage
+    :param group: Name of the group (or groups) the stage works on
+    :param experiment_type: Experiment type the stage works for
+    :return: Context manager observing the duration of the stage
+    """
+    return STAGE_DURATION.labels(stage=stage, group=group, experiment_type=experiment_type).time()
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    """
+    Count a cache hit or miss.
+
+    :param cache: Name of the cache
+    :param hit: Whether the lookup was a hit
+    """
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def render() -> bytes:
+    """
+    Render all metrics in the Prometheus text exposition format. In multiprocess mode, the counters and histograms are
+    summed over all processes, the process metrics and computed gauges are the ones of this process.
+
+    :return: Metrics text
+    """
+    if not MULTIPROCESS_DIR:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for gauge in SCRAPE_GAUGES:
+        registry.register(gauge)
+    ProcessCollector(registry=registry)
+    return generate_latest(registry)
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Remove the live values of a process that exited, called by the server for every worker that exits.
+
+    :param pid: Process id of the worker
+    """
+    if MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(pid)
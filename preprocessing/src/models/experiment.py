@@ -1,3 +1,5 @@
+import glob
+import hashlib
 import pandas as pd
 import json
 import re
@@ -5,8 +7,10 @@ from typing import List, Dict, Any
 from models.group import Group
 from models.types.experiment_type import ExperimentType
 from models.types.measurement_type import MeasurementType
+from visualization import data_source
 from visualization.plotovertime import PlotOverTime
 from visualization.significance import SignificanceTest
+from visualization.spectrum import Spectrum
 from visualization.statistics import Statistics
 
 
@@ -66,11 +70,13 @@ class Experiment:
                 template = template.replace("PLACEHOLDER_" + key, value)
             return json.loads(template)
 
-    def create_visualization_panels(self) -> List[Dict[str, Any]]:
+    def create_visualization_panels(self, templated: bool = False) -> List[Dict[str, Any]]:
         """
         Generate visualization panels for this experiment based on the experiment type.
         Routes to appropriate visualization plugin based on experiment type.
         
+        :param templated: Generate panels that repeat over the group/core dashboard variables instead of panels per
+                          group and core.
         :return: List of panel configurations for Grafana dashboard.
         """
         # Ensure data is analyzed
@@ -78,21 +84,57 @@ class Experiment:
         
         # Use different visualization strategies based on experiment type
         if self.experiment_type == ExperimentType.PLOT_OVER_TIME:
+            if templated:
+                return PlotOverTime.generate_templated_panels(
+                    self.name, self.groups, self.measurement_types)
             return PlotOverTime.generate_panels(
                 self.name, self.groups, self.measurement_types)
         
         elif self.experiment_type == ExperimentType.SIGNIFICANCE_TEST:
+            # Always exactly two groups, so the panels do not multiply with the number of groups or cores
             return SignificanceTest.generate_panels(
                 self.name, self.groups, self.measurement_types)
 
         elif self.experiment_type == ExperimentType.STATISTICS:
+            if templated:
+                return Statistics.generate_templated_panels(
+                    self.name, self.groups, self.measurement_types)
             return Statistics.generate_panels(
                 self.name, self.groups, self.measurement_types)
+
+        elif self.experiment_type == ExperimentType.SPECTRUM:
+            if templated:
+                return Spectrum.generate_templated_panels(
+                    self.name, self.groups, self.measurement_types)
+            return Spectrum.generate_panels(
+                self.name, self.groups, self.measurement_types)
         
         else:
             # Throw error if experiment type is not recognized
             raise ValueError(f'Unknown experiment type: {self.experiment_type}')
 
+    def fingerprint(self, templated: bool = False) -> str:
+        """
+        Fingerprint of everything the panels of this experiment are generated from: the experiment definition, the
+        groups, the panel templates and the panel data source settings. Panels generated from the same fingerprint
+        are identical.
+
+        :param templated: Whether the panels are templated
+        :return: Hash of the panel inputs
+        """
+        digest = hashlib.sha256(json.dumps({
+            'name': self.name,
+            'experiment_type': self.experiment_type.value,
+            'measurement_types': [measurement_type.value for measurement_type in self.measurement_types],
+            'groups': [[group.name, group.fingerprint()] for group in self.groups],
+            'templated': templated,
+            'data_source': [data_source.PANEL_DATA_SOURCE, data_source.DATA_API_URL]
+        }).encode())
+        for path in sorted(glob.glob("csv-data/grafana-templates/*.json")):
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+        return digest.hexdigest()
+
     def to_dict(self) -> dict:
         """
         Convert experiment to a dictionary for frontend representation.
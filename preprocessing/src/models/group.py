@@ -1,15 +1,26 @@
+import glob
+import hashlib
 import re
 import shutil
 from re import match
 from scipy.stats import shapiro
 import pandas as pd
 import numpy as np
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import seaborn as sns
-from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
 from numpy.ma.core import outer, argmax
 
+from analysis import alignment, attribution, correlation, derived, outliers, phases, spectrum
+from analysis.phases import TrialPhases
+from analysis.outliers import OutlierPolicy
+from downsampling import write_pyramid, read_levels
+import artifacts
+import kernels
+import metrics
+import precision
+import tracing
 from models.trial import Trial
 from models.types.measurement_type import MeasurementType
 import os
@@ -29,12 +40,47 @@ class Group:
     # Aggregated data from all trails (e.g. mean, median, std over time)
     aggregate_data_path: str
     aggregate_data: pd.DataFrame
+    # Memory the aggregate data would use without the precision policy
+    aggregate_full_memory: int
+
+    # Reduction factors of the downsampled levels stored next to the aggregate data
+    pyramid_factors: List[int]
+
+    # Lag of every trial in samples (trial name -> lag), empty when the trials are not aligned
+    lags: Dict[str, int]
+
+    # Names of the energy and power columns of the logical processors added to the trials, see analysis.attribution
+    attributed_columns: List[str]
+
+    # Names of the derived per-sample metrics added to the trials, and the derived per-trial metrics (indexed by trial
+    # name), see analysis.derived
+    derived_columns: List[str]
+    derived_summary: pd.DataFrame
+
+    # Median and quartiles of the power spectral densities of the power columns over the trials, per frequency
+    spectrum_data_path: str
+    spectrum_data: pd.DataFrame
+
+    # Phases of every trial (trial name -> phases)
+    segmentation: Dict[str, TrialPhases]
+
+    # Correlation matrices of the columns over time and of the trial metrics over the trials, see analysis.correlation
+    correlations: pd.DataFrame
+
+    # Outlier policy of the group and its decisions per trial (indexed by trial name, see outliers.DECISION_COLUMNS)
+    outlier_policy: OutlierPolicy
+    outlier_decisions: pd.DataFrame
 
     # Summary statistics for the whole group (e.g. total energy, peak power)
     summary_path: str
     summary: pd.DataFrame
 
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: str, trials: Optional[List[Trial]] = None) -> None:
+        """
+        :param name: Name of the group folder in the input folder
+        :param trials: Already preprocessed trials of the group (e.g. uploaded ones), None to preprocess all trial
+                       files in the group folder
+        """
         self.name = name
 
         folder_path = os.path.join(self.input_folder, name)
@@ -48,106 +94,293 @@ class Group:
             os.makedirs(output_folder_path)
 
         # Process both CSV and TSV files in the input folder
-        self.trials = []
-        for file_name in os.listdir(folder_path):
-            if file_name.endswith(".csv") or file_name.endswith(".tsv"):
-                # For output, always use .csv extension regardless of input format
-                output_file_name = os.path.splitext(file_name)[0] + ".csv"
-                input_path = os.path.join(folder_path, file_name)
-                output_path = os.path.join(output_folder_path, output_file_name)
-                self.trials.append(Trial(input_path, output_path))
-                
+        if trials is not None:
+            # Trials of a previous version of the group are compacted, the statistics need their full precision
+            self.trials = [trial.with_full_precision() for trial in trials]
+        else:
+            with tracing.span('trials', group=name):
+                self.trials = [self._load_trial(input_path, output_path)
+                               for input_path, output_path in self.trial_paths(name)]
+
         if len(self.trials) == 0:
             raise FileNotFoundError(f'No CSV or TSV trials found in folder: "{folder_path}"')
             
-        # aggregate and summarize the group
-        self.aggregate()
-        self.summarize_trials()
-        self.generate_violin_plot()
-        self.group_summary()
+        # align, aggregate and summarize the group, without the trials excluded as outliers
+        with tracing.stage('alignment', name):
+            self.align_trials()
+        with tracing.stage('outliers', name):
+            self.detect_outliers()
+        with tracing.stage('attribution', name):
+            self.attribute_energy()
+        with tracing.stage('derived', name):
+            self.derive_metrics()
+        with tracing.stage('aggregate', name):
+            self.aggregate()
+        with tracing.stage('spectrum', name):
+            self.compute_spectrum()
+        with tracing.stage('phases', name):
+            self.segmentation = phases.segment_trials(self.trials)
+        with tracing.stage('summarize', name):
+            trial_summary = self.summarize_trials()
+        with tracing.stage('correlation', name):
+            self.correlate(trial_summary)
+        with tracing.stage('plot_render', name):
+            self.generate_violin_plot()
+        with tracing.stage('group_summary', name):
+            self.group_summary()
+        self.compact()
 
         self.no_cores = self.trials[0].no_cores()
         self.no_logical = self.trials[0].no_logical()
 
+        report = self.memory_report()
+        print(f'Group {name} uses {report["used_bytes"] / 2 ** 20:.1f} MiB instead of '
+              f'{report["full_bytes"] / 2 ** 20:.1f} MiB (precision policy {report["policy"]})')
+
+    @classmethod
+    def load(cls, name: str) -> 'Group':
+        """
+        Load an already ingested group from its output folder, without preprocessing, aggregating and summarizing
+        its trials again.
+
+        :param name: Name of the group
+        :return: The group
+        """
+        output_folder_path = os.path.join(cls.output_folder, name)
+        paths = sorted(glob.glob(os.path.join(glob.escape(output_folder_path), '*_preprocessed.csv')))
+        aggregate_data_path = os.path.join(output_folder_path, 'aggregate_data.csv')
+        if len(paths) == 0 or not os.path.exists(aggregate_data_path):
+            raise FileNotFoundError(f'Group {name} has not been ingested yet, no output found in "{output_folder_path}"')
+
+        group = cls.__new__(cls)
+        group.name = name
+        group.trials = [Trial(preprocessed_path=path) for path in paths]
+        group.aggregate_data_path = aggregate_data_path
+        group.align_trials()
+        group.detect_outliers()
+        group.attribute_energy()
+        group.derive_metrics()
+        group.aggregate_data = pd.read_csv(aggregate_data_path)
+        group.pyramid_factors = read_levels(aggregate_data_path)[1]
+        group.spectrum_data_path = os.path.join(output_folder_path, spectrum.SPECTRUM_FILE)
+        if os.path.exists(group.spectrum_data_path):
+            group.spectrum_data = pd.read_csv(group.spectrum_data_path)
+        else:
+            # Groups ingested before the spectra were computed
+            group.compute_spectrum()
+        correlations_path = os.path.join(output_folder_path, correlation.CORRELATION_FILE)
+        if os.path.exists(correlations_path):
+            group.correlations = pd.read_csv(correlations_path)
+        else:
+            group.correlate(pd.read_csv(os.path.join(output_folder_path, 'trial_summary.csv')))
+        group.compact()
+        group.no_cores = group.trials[0].no_cores()
+        group.no_logical = group.trials[0].no_logical()
+        return group
+
+    @classmethod
+    def trial_paths(cls, name: str) -> List[Tuple[str, str]]:
+        """
+        List the input trial files of a group together with the output path of their preprocessed file.
+
+        :param name: Name of the group (folder in the input folder)
+        :return: List of (input path, output path) tuples
+        """
+        folder_path = os.path.join(cls.input_folder, name)
+        output_folder_path = os.path.join(cls.output_folder, name)
+
+        paths = []
+        for file_name in os.listdir(folder_path):
+            if file_name.endswith(".csv") or file_name.endswith(".tsv"):
+                # For output, always use .csv extension regardless of input format
+                output_file_name = os.path.splitext(file_name)[0] + ".csv"
+                paths.append((os.path.join(folder_path, file_name), os.path.join(output_folder_path, output_file_name)))
+        return paths
+
+    def align_trials(self) -> None:
+        """
+        Estimate the lag of every trial against the medoid trial of the group when ALIGN_TRIALS is set, so the trials
+        are aggregated in phase. The lags are cached in the output folder, so only new or changed trials are scanned.
+        """
+        if alignment.ALIGN_TRIALS and len(self.trials) > 1:
+            self.lags = alignment.align(self.trials, os.path.join(self.output_folder, self.name))
+        else:
+            self.lags = {}
+
+    def attribute_energy(self) -> None:
+        """
+        Split the energy of every core over its logical processors by their usage when ATTRIBUTE_ENERGY is set (see
+        analysis.attribution), so the energy and power of the logical processors are aggregated like the measured
+        columns.
+        """
+        self.attributed_columns = attribution.attribute(self.trials) if attribution.ATTRIBUTE_ENERGY else []
+
+    def derive_metrics(self) -> None:
+        """
+        Evaluate the derived metrics (see analysis.derived) over all trials of the group. Per-sample metrics are added
+        to the trials before they are aggregated, per-trial metrics are added to the trial summary.
+        """
+        self.derived_columns, self.derived_summary = derived.derive(self.trials,
+                                                                    os.path.join(self.output_folder, self.name),
+                                                                    columns=self.attributed_columns)
+
+    def detect_outliers(self) -> None:
+        """
+        Decide which trials are outliers according to the outlier policy of the group. The scores of the trials are
+        cached in the output folder, so only new or changed trials are scanned.
+        """
+        self.outlier_policy = OutlierPolicy.load(os.path.join(self.input_folder, self.name))
+        self.outlier_decisions = outliers.decide(self.trials, os.path.join(self.output_folder, self.name),
+                                                 self.outlier_policy, self.lags)
+        flagged = self.outlier_decisions.index[self.outlier_decisions['Outlier'] == 1].tolist()
+        if flagged:
+            print(f'Group {self.name}: outlier trials {flagged}'
+                  f'{" excluded" if self.outlier_policy.mode == "exclude" else ""}')
+
+    def aggregated_trials(self) -> List[Trial]:
+        """
+        :return: The trials of the group that are not excluded as outliers
+        """
+        excluded = set(self.outlier_decisions.index[self.outlier_decisions['Excluded'] == 1])
+        return [trial for trial in self.trials if trial.filename not in excluded]
+
+    @staticmethod
+    def _load_trial(input_path: str, output_path: str) -> Trial:
+        with tracing.span('trial', file=os.path.basename(input_path)):
+            return Trial(input_path, output_path)
 
     def aggregate(self) -> None:
         """
                 Aggregate the data from all trails in the group for the specified columns
                 TODO: aggregation with interpolation for differing deltas
-                TODO: outlier detection? -> flag possible?
                 :return filepath to the aggregate dataframe
                 """
         # retrieve the wanted columns for the measurement types
-        columns = self.trials[0].preprocessed_data.columns
-
-        # concatenate all trials into one dataframe
-        ndf = pd.concat(
-            [trial.preprocessed_data for trial in self.trials],
-            axis=1,
-            join='outer',
-            keys=[trial.filename for trial in self.trials],
-            names=['Trial name', 'Column ID']
-        ).fillna(0).replace([np.inf, -np.inf], 0, inplace=False)
-
-        # flatten the multiindex to a dataframe by renaming columns to '{trial name}_{column id}'
-        ndf.columns = [f'{trial}:{column}' for trial, column in ndf.columns.to_flat_index()]
-        # print(ndf.columns)
-
-        max_length_index = argmax([len(trial.preprocessed_data) for trial in self.trials])
+        columns = self.trials[0].columns
+
+        trials = self.aggregated_trials()
+        lengths = [len(trial.preprocessed_data) for trial in trials]
+        max_length_index = argmax(lengths)
+        rows = lengths[max_length_index]
         dictionary = {
-            'Time': self.trials[max_length_index].preprocessed_data['Time'].astype(int),
-            'Delta': self.trials[max_length_index].preprocessed_data['Delta'].astype(int)
+            'Time': trials[max_length_index].preprocessed_data['Time'].astype(int),
+            'Delta': trials[max_length_index].preprocessed_data['Delta'].astype(int)
         }
+
+        # Values of one column of all trials, one column per trial. Shorter (or shifted) trials are padded with 0, and
+        # missing or infinite values are 0 as well
+        values = np.empty((rows, len(trials)))
         for c in columns:
             if c in ['Time', 'Delta']:
                 continue
-            dictionary[f'{c}_mean'] = ndf[[f'{trial.filename}:{c}' for trial in self.trials]].mean(axis=1)
-            dictionary[f'{c}_std'] = ndf[[f'{trial.filename}:{c}' for trial in self.trials]].std(axis=1)
-            dictionary[f'{c}_median'] = ndf[[f'{trial.filename}:{c}' for trial in self.trials]].median(axis=1)
-            dictionary[f'{c}_min'] = ndf[[f'{trial.filename}:{c}' for trial in self.trials]].min(axis=1)
-            dictionary[f'{c}_max'] = ndf[[f'{trial.filename}:{c}' for trial in self.trials]].max(axis=1)
-            dictionary[f'{c}_LQ'] = ndf[[f'{trial.filename}:{c}' for trial in self.trials]].quantile(q=0.25, axis=1)
-            dictionary[f'{c}_UQ'] = ndf[[f'{trial.filename}:{c}' for trial in self.trials]].quantile(q=0.75, axis=1)
+            values.fill(0)
+            for index, trial in enumerate(trials):
+                # Trials are shifted by their lag, so they are aggregated in phase
+                source, destination = alignment.shifted_slices(lengths[index], self.lags.get(trial.filename, 0), rows)
+                # The statistics are computed in float64, whatever the dtype the column is kept in
+                values[destination, index] = (trial.constants[c] if c in trial.constants
+                                              else trial.preprocessed_data[c].to_numpy(dtype=np.float64)[source])
+            values[~np.isfinite(values)] = 0
+            # All statistics of a column are computed by one fused kernel call
+            for statistic, result in kernels.order_statistics(values).items():
+                dictionary[f'{c}_{statistic}'] = result
 
         self.aggregate_data = pd.DataFrame(dictionary)
         self.aggregate_data_path = os.path.join(os.path.join(self.output_folder, self.name), 'aggregate_data.csv')
         self.aggregate_data.to_csv(self.aggregate_data_path, index=False)
+        artifacts.publish(self.aggregate_data_path)
+        metrics.ROWS_PROCESSED.labels(stage='aggregate', group=self.name).inc(rows)
+        metrics.BYTES_PROCESSED.labels(stage='aggregate', group=self.name).inc(
+            os.path.getsize(self.aggregate_data_path))
+        self.pyramid_factors = write_pyramid(self.aggregate_data, self.aggregate_data_path)
 
-    def summarize_trials(self) -> None:
+    def compact(self) -> None:
         """
-        Generate a summary CSV for each trial with:
-        - Total energy used (CPU and CORE0–CORE7)
-        - Peak power (CPU and CORE0–CORE7)
-        Saves a summary CSV file to the trial output folder.
+        Apply the precision policy to the trial and aggregate data kept in memory. Called once the group is aggregated
+        and summarized, so the files of the group are computed with full precision whatever the policy.
         """
-        summary_data = []
-
         for trial in self.trials:
-            data = trial.preprocessed_data
-            trial_summary = {"Trial": trial.filename}
-
-            # Total energy (sum of DIFF_*_ENERGY columns)
-            trial_summary["CPU_Total_Energy (J)"] = data["DIFF_CPU_ENERGY (J)"].sum()
-            trial_summary["CPU_Peak_Power (W)"] = data["CPU_POWER (W)"].max()
+            trial.compact()
+        self.aggregate_full_memory = precision.memory_usage(self.aggregate_data)
+        self.aggregate_data = precision.policy().compact_aggregate(self.aggregate_data, self.trials[0].schema)
 
-            for core in range(8):
-                energy_col = f"DIFF_CORE{core}_ENERGY (J)"
-                power_col = f"CORE{core}_POWER (W)"
+    def compute_spectrum(self) -> None:
+        """
+        Compute the power spectral densities of the power columns of the aggregated trials (see analysis.spectrum),
+        with the trials shifted by their lag like in the aggregate data, and save their median and quartiles per
+        frequency next to the aggregate data.
+        """
+        self.spectrum_data = spectrum.spectrum(self.aggregated_trials(), self.lags)
+        self.spectrum_data_path = os.path.join(self.output_folder, self.name, spectrum.SPECTRUM_FILE)
+        self.spectrum_data.to_csv(self.spectrum_data_path, index=False)
+        artifacts.publish(self.spectrum_data_path)
+        metrics.ROWS_PROCESSED.labels(stage='spectrum', group=self.name).inc(len(self.spectrum_data))
 
-                if energy_col in data.columns and power_col in data.columns:
-                    trial_summary[f"CORE{core}_Total_Energy (J)"] = data[energy_col].sum()
-                    trial_summary[f"CORE{core}_Peak_Power (W)"] = data[power_col].max()
-                else:
-                    trial_summary[f"CORE{core}_Total_Energy (J)"] = None
-                    trial_summary[f"CORE{core}_Peak_Power (W)"] = None
+    def summarize_trials(self) -> pd.DataFrame:
+        """
+        Generate a summary CSV for each trial with:
+        - Total energy used (CPU and every core)
+        - Peak power (CPU and every core)
+        - Energy, duration and mean power of every phase (see analysis.phases)
+        - Derived per-trial metrics (see analysis.derived)
+        - Outlier scores and decisions (see analysis.outliers)
+        Saves a summary CSV file to the trial output folder.
 
-            summary_data.append(trial_summary)
+        :return: DataFrame with one summary row per trial
+        """
+        summary_data = [self.summarize_trial(trial, self.segmentation.get(trial.filename)) for trial in self.trials]
 
+        # The outlier decisions are recorded next to the statistics of every trial
         summary_df = pd.DataFrame(summary_data)
+        summary_df = summary_df.join(self.derived_summary, on='Trial')
+        summary_df = summary_df.join(self.outlier_decisions, on='Trial')
 
         # Save to CSV
         summary_path = os.path.join(os.path.join(self.output_folder, self.name), 'trial_summary.csv')
         summary_df.to_csv(summary_path, index=False)
+        artifacts.publish(summary_path)
+        return summary_df
+
+    def correlate(self, trial_summary: pd.DataFrame) -> None:
+        """
+        Compute the Pearson and Spearman correlation matrices of the group (see analysis.correlation), of the columns
+        over time within the trials and of the trial metrics over the trials, and save them in the output folder.
+
+        :param trial_summary: Contents of trial_summary.csv of the group
+        """
+        self.correlations = correlation.correlations(self.trials, trial_summary)
+        correlations_path = os.path.join(self.output_folder, self.name, correlation.CORRELATION_FILE)
+        self.correlations.to_csv(correlations_path, index=False)
+        artifacts.publish(correlations_path)
+
+    @staticmethod
+    def summarize_trial(trial: Trial, trial_phases: Optional[TrialPhases] = None) -> dict:
+        """
+        Compute the summary statistics (total energy, peak power, energy per phase) of a single trial.
+
+        :param trial: Preprocessed trial to summarize
+        :param trial_phases: Phases of the trial, segmented if None
+        :return: Dictionary with the trial name and its summary statistics
+        """
+        trial_summary = {"Trial": trial.filename}
+
+        # Total energy (sum of DIFF_*_ENERGY columns)
+        trial_summary["CPU_Total_Energy (J)"] = trial.column("DIFF_CPU_ENERGY (J)").sum()
+        trial_summary["CPU_Peak_Power (W)"] = float(trial.column("CPU_POWER (W)").max())
+
+        for core in range(trial.no_cores()):
+            energy_col = f"DIFF_CORE{core}_ENERGY (J)"
+            power_col = f"CORE{core}_POWER (W)"
+
+            if energy_col in trial.columns and power_col in trial.columns:
+                trial_summary[f"CORE{core}_Total_Energy (J)"] = trial.column(energy_col).sum()
+                trial_summary[f"CORE{core}_Peak_Power (W)"] = float(trial.column(power_col).max())
+            else:
+                trial_summary[f"CORE{core}_Total_Energy (J)"] = None
+                trial_summary[f"CORE{core}_Peak_Power (W)"] = None
+
+        trial_summary.update(phases.summarize(trial, trial_phases))
+        return trial_summary
 
     def generate_violin_plot(self) -> None:
         """
@@ -165,15 +398,17 @@ class Group:
         os.makedirs(self.image_output_folder, exist_ok=True)
 
         # Remove non-numeric or identifier columns
-        plot_df = df.drop(columns=["Trial"], errors="ignore")
+        plot_df = df.drop(columns=["Trial"] + outliers.DECISION_COLUMNS, errors="ignore")
 
         # For each stat, create a violin plot across all trials
         for column in plot_df.columns:
-            plt.figure(figsize=(8, 6))
-            sns.violinplot(data=df, y=column)
-            plt.title(f"Violin Plot: {column}")
-            plt.ylabel(column)
-            plt.tight_layout()
+            # A figure per plot instead of the global pyplot state, so groups can be plotted from several threads
+            figure = Figure(figsize=(8, 6))
+            ax = figure.subplots()
+            sns.violinplot(data=df, y=column, ax=ax)
+            ax.set_title(f"Violin Plot: {column}")
+            ax.set_ylabel(column)
+            figure.tight_layout()
             folder_path = os.path.join(self.image_output_folder, self.name)
             os.makedirs(folder_path, exist_ok=True)  # Ensure the folder exists
 
@@ -182,17 +417,17 @@ class Group:
             output_path = os.path.join(folder_path, f"{column}_violin.png")
 
             # Save the plot
-            plt.savefig(output_path)
-            plt.close()
+            figure.savefig(output_path)
+            artifacts.publish(output_path)
 
     def group_summary(self) -> None:
         """
         Generate a group summary CSV file with statistics (mean, std, median, min, max, LQ, UQ)
-        computed across all trials for each metric in trial_summary.csv.
+        computed across all trials that are not excluded as outliers for each metric in trial_summary.csv.
         """
         # Load the trial_summary.csv
         summary_path = os.path.join(self.output_folder, self.name, 'trial_summary.csv')
-        trial_summary_df = pd.read_csv(summary_path)
+        trial_summary_df = outliers.included(pd.read_csv(summary_path))
 
         # Transpose trial data for easier multi-trial stat calculations
         trial_summary_df.set_index("Trial", inplace=True)
@@ -223,6 +458,7 @@ class Group:
         group_summary_df = pd.DataFrame(group_stats, index=[0])
         group_summary_path = os.path.join(self.output_folder, self.name, 'group_summary.csv')
         group_summary_df.to_csv(group_summary_path, index=False)
+        artifacts.publish(group_summary_path)
 
     def visualize(self, measurement_types: List[MeasurementType]) -> dict:
         """
@@ -244,6 +480,45 @@ class Group:
             print("Statistics Summary:")
             print(self.summary)
 
+    def fingerprint(self) -> str:
+        """
+        Fingerprint of the group, changes whenever one of its trials or its aggregate and summary files change.
+
+        :return: Hash of the trial fingerprints and the content hashes of the group files
+        """
+        digest = hashlib.sha256(self.name.encode())
+        for fingerprint in sorted(trial.fingerprint() for trial in self.trials):
+            digest.update(fingerprint.encode())
+        for file_name in ['aggregate_data.csv', spectrum.SPECTRUM_FILE, 'trial_summary.csv', 'group_summary.csv',
+                          correlation.CORRELATION_FILE]:
+            digest.update((artifacts.version(os.path.join(self.output_folder, self.name, file_name)) or '').encode())
+        return digest.hexdigest()[:artifacts.HASH_LENGTH]
+
+    def memory_usage(self) -> int:
+        """
+        Memory used by the data of the group kept in memory (preprocessed trial data and aggregate data).
+
+        :return: Size in bytes
+        """
+        return sum(trial.memory_usage() for trial in self.trials) + precision.memory_usage(self.aggregate_data)
+
+    def memory_report(self) -> dict:
+        """
+        Memory saved by the precision policy on the data of the group.
+
+        :return: Dictionary with the memory used with full precision and with the policy, in bytes
+        """
+        full_bytes = sum(trial.full_memory for trial in self.trials) + self.aggregate_full_memory
+        used_bytes = self.memory_usage()
+        return {
+            'group': self.name,
+            'policy': precision.policy().name,
+            'full_bytes': full_bytes,
+            'used_bytes': used_bytes,
+            'saved_bytes': full_bytes - used_bytes,
+            'constant_columns': sum(len(trial.constants) for trial in self.trials)
+        }
+
     def to_dict(self) -> dict:
         """
         Convert group to dictionary parseable by frontend.
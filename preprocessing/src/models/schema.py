@@ -0,0 +1,179 @@
+"""
+Schemas of trial files: the classification of their columns and the dtypes to read them with, built once per
+distinct header and shared by all trials with that header.
+"""
+import csv
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# Column kinds, by pattern of the column name. The first matching pattern decides the kind
+_PATTERNS = [
+    ('time', re.compile(r'^(Time|Delta)$')),
+    ('diff_energy', re.compile(r'^DIFF_.*_ENERGY \(J\)$')),
+    ('energy', re.compile(r'_ENERGY \(J\)$')),
+    ('power_watts', re.compile(r'_POWER \(Watts\)$')),
+    ('power', re.compile(r'_POWER \(W\)$')),
+    ('freq', re.compile(r'^(CORE\d+_FREQ \(MHZ\)|CPU_FREQUENCY_\d+)$')),
+    ('pstate', re.compile(r'^CORE\d+_PSTATE$')),
+    ('volt', re.compile(r'^CORE\d+_VOLT \(V\)$')),
+    ('usage', re.compile(r'^CPU_USAGE_\d+$')),
+    ('memory', re.compile(r'^(TOTAL|USED)_(MEMORY|SWAP)$')),
+]
+_FLOAT_KINDS = ('diff_energy', 'energy', 'power_watts', 'power', 'freq', 'volt', 'usage')
+# Columns of a core, also the energy differences the preprocessing adds
+_CORE = re.compile(r'^(?:DIFF_)?CORE(\d+)_')
+# Usage and frequency of a logical processor, and its energy and power attributed by analysis.attribution
+_LOGICAL = re.compile(r'^(?:CPU_(?:USAGE|FREQUENCY)_(?=\d+$)|(?:DIFF_)?LOGICAL(?=\d+_))(\d+)')
+
+# Columns of which at least one is needed to know the energy used by the CPU
+CPU_ENERGY_SOURCES = ('CPU_ENERGY (J)', 'PACKAGE_ENERGY (J)', 'CPU_POWER (Watts)', 'CPU_POWER (W)')
+
+
+class TrialSchema:
+    """
+    Classification of the columns of a trial header.
+    """
+    header: Tuple[str, ...]
+    delimiter: str
+    # Column name -> kind (time, energy, diff_energy, power_watts, power, freq, pstate, volt, usage, memory, other)
+    kinds: Dict[str, str]
+    # Column name -> core or logical processor number, for the columns of a single core or logical processor
+    cores: Dict[str, int]
+    logical: Dict[str, int]
+    # Dtypes to read the columns with, so the CSV reader does not infer them. Integer counters (pstates, memory) and
+    # unknown columns are left to inference, so they are written back unchanged
+    dtypes: Dict[str, str]
+
+    def __init__(self, header: Tuple[str, ...], delimiter: str = ','):
+        """
+        :param header: Column names
+        :param delimiter: Delimiter of the file
+        """
+        if len(set(header)) != len(header):
+            raise ValueError(f'Trial header contains duplicate columns: '
+                             f'{sorted({column for column in header if header.count(column) > 1})}')
+        for column in ('Time', 'Delta'):
+            if column not in header:
+                raise ValueError(f'Trial header is missing the "{column}" column')
+
+        self.header = header
+        self.delimiter = delimiter
+        self.kinds = {column: next((kind for kind, pattern in _PATTERNS if pattern.search(column)), 'other')
+                      for column in header}
+        self.cores = {column: int(match.group(1)) for column in header for match in [_CORE.match(column)] if match}
+        self.logical = {column: int(match.group(1)) for column in header for match in [_LOGICAL.match(column)]
+                        if match}
+        self.dtypes = {column: 'int64' if kind == 'time' else 'float64' for column, kind in self.kinds.items()
+                       if kind in _FLOAT_KINDS or kind == 'time'}
+
+    def columns(self, kind: str) -> List[str]:
+        """
+        :param kind: Column kind
+        :return: Columns of the kind, in header order
+        """
+        return [column for column, column_kind in self.kinds.items() if column_kind == kind]
+
+    @property
+    def has_cpu_energy(self) -> bool:
+        return any(column in self.kinds for column in CPU_ENERGY_SOURCES)
+
+    @property
+    def no_cores(self) -> int:
+        """
+        Number of cores with power data, i.e. with a CORE<i>_POWER (W) column after preprocessing.
+        """
+        return len({core for column, core in self.cores.items()
+                    if self.kinds[column] in ('energy', 'power_watts', 'power')})
+
+    @property
+    def no_logical(self) -> int:
+        """
+        Number of logical processors with usage data.
+        """
+        return len(self.columns('usage'))
+
+    def preprocess_columns(self) -> List[Tuple[str, str]]:
+        """
+        Columns the preprocessing derives other columns from, in the order it processes them: energy columns get a
+        difference and power column, power columns in watts an energy column. On Windows, the package energy is
+        copied to CPU_ENERGY (J) first, which is processed last.
+
+        :return: List of (column, kind) tuples
+        """
+        columns = [(column, kind) for column, kind in self.kinds.items() if kind in ('energy', 'power_watts')]
+        if self.windows_cpu_energy:
+            columns.append(('CPU_ENERGY (J)', 'energy'))
+        return columns
+
+    @property
+    def windows_cpu_energy(self) -> bool:
+        """
+        Whether the CPU energy has to be taken from the package energy (Windows).
+        """
+        return 'CPU_ENERGY (J)' not in self.kinds and 'PACKAGE_ENERGY (J)' in self.kinds
+
+
+_registry: Dict[Tuple[Tuple[str, ...], str], TrialSchema] = {}
+_registry_lock = threading.Lock()
+
+
+def schema_for(header: Tuple[str, ...], delimiter: str = ',') -> TrialSchema:
+    """
+    Get the schema of a header, built on first use.
+
+    :param header: Column names
+    :param delimiter: Delimiter of the file
+    :return: Schema shared by all trials with this header
+    """
+    key = (tuple(header), delimiter)
+    schema = _registry.get(key)
+    if schema is None:
+        schema = TrialSchema(key[0], delimiter)
+        with _registry_lock:
+            schema = _registry.setdefault(key, schema)
+    return schema
+
+
+def read_header(path: str) -> Tuple[Tuple[str, ...], str]:
+    """
+    Read only the first line of a trial file.
+
+    :param path: Path of a CSV or TSV file
+    :return: Column names and delimiter
+    """
+    with open(path, 'r', newline='', encoding='utf-8-sig') as file:
+        line = file.readline()
+    if not line.strip():
+        raise ValueError(f'Trial file {path} is empty')
+    delimiter = '\t' if '\t' in line and ',' not in line else ','
+    return tuple(next(csv.reader([line], delimiter=delimiter))), delimiter
+
+
+def read_trial(path: str, raw: bool = True) -> Tuple[pd.DataFrame, TrialSchema]:
+    """
+    Read a trial file with the dtypes of its schema. Files whose header is not a trial header are rejected before
+    the rest of the file is read.
+
+    :param path: Path of a CSV or TSV file
+    :param raw: Whether the file is an unprocessed EnergiBridge file, which needs a source of the CPU energy
+    :return: Trial data and its schema
+    """
+    header, delimiter = read_header(path)
+    try:
+        schema = schema_for(header, delimiter)
+        if raw and not schema.has_cpu_energy:
+            raise ValueError(f'Trial header has none of the columns {list(CPU_ENERGY_SOURCES)}')
+    except ValueError as e:
+        raise ValueError(f'{path} is not an EnergiBridge trial: {e}')
+    return pd.read_csv(path, sep=delimiter, dtype=schema.dtypes, encoding='utf-8-sig'), schema
+
+
+def schema_of(df: pd.DataFrame) -> TrialSchema:
+    """
+    :param df: Trial data
+    :return: Schema of the columns of the data
+    """
+    return schema_for(tuple(df.columns))
@@ -1,9 +1,15 @@
+import copy
+import numpy as np
 import pandas as pd
-from typing import List
-import re
+from typing import Any, Dict, List, Optional
 
+from models.schema import TrialSchema, read_trial, schema_for, schema_of
 from models.types.measurement_type import MeasurementType
 import preprocessing as pp
+import precision
+import artifacts
+import metrics
+import tracing
 import os
 
 
@@ -15,32 +21,158 @@ class Trial:
     # Preprocessed file path
     preprocessed_file_path: str
 
-    # Preprocessed data
+    # Preprocessed data, compacted by the precision policy once the group is aggregated (see compact): the constant
+    # columns are kept in constants
     preprocessed_data: pd.DataFrame
+    constants: Dict[str, Any]
+    compacted: bool
+
+    # Schema of the preprocessed data, with all its columns
+    schema: TrialSchema
+
+    # Columns added in memory with add_columns (e.g. attributed energy, derived metrics), not in the preprocessed file
+    added_columns: List[str]
+
+    # Memory the preprocessed data would use without the precision policy
+    full_memory: int
 
     def __init__(self, unprocessed_path: str = '', preprocessed_path: str = '') -> None:
+        self.added_columns = []
+        self.constants = {}
+        self.compacted = False
         if unprocessed_path != '' and not preprocessed_path.endswith("_preprocessed.csv"):
             if not os.path.exists(unprocessed_path):
                 raise FileNotFoundError(f"Import of file failed. File {unprocessed_path} not found.")
             # If unprocessed file is provided, preprocess it then save
             self.raw_file_path = unprocessed_path
             self.filename = os.path.splitext(os.path.split(unprocessed_path)[1])[0]
-            raw_data = pd.read_csv(unprocessed_path)
-            self.preprocessed_data = pp.preprocess(raw_data)  # preprocess upon creation
+            group_name = os.path.basename(os.path.dirname(unprocessed_path))
+            with tracing.stage('trial_parse', group_name):
+                raw_data, raw_schema = read_trial(unprocessed_path)
+            metrics.ROWS_PROCESSED.labels(stage='trial_parse', group=group_name).inc(len(raw_data))
+            metrics.BYTES_PROCESSED.labels(stage='trial_parse', group=group_name).inc(
+                os.path.getsize(unprocessed_path))
+            with tracing.stage('preprocess', group_name):
+                self.preprocessed_data = pp.preprocess(raw_data, raw_schema)  # preprocess upon creation
+            self.schema = schema_of(self.preprocessed_data)
+            metrics.ROWS_PROCESSED.labels(stage='preprocess', group=group_name).inc(len(self.preprocessed_data))
             self.preprocessed_file_path = preprocessed_path.replace(".csv", "_preprocessed.csv")
-            self.preprocessed_data.to_csv(self.preprocessed_file_path, index=False)
+            with tracing.span('trial_write', group=group_name, trial=self.filename):
+                self.preprocessed_data.to_csv(self.preprocessed_file_path, index=False)
+            self.full_memory = precision.memory_usage(self.preprocessed_data)
         else:
             # For loading already existing files
             if not os.path.exists(preprocessed_path):
                 raise FileNotFoundError(f"Import of file failed. File {preprocessed_path} not found.")
             self.raw_file_path = ''
-            self.filename = ''
+            self.filename = os.path.basename(preprocessed_path)[:-len('_preprocessed.csv')]
             self.preprocessed_file_path = preprocessed_path
-            self.preprocessed_data = pd.read_csv(preprocessed_path)
+            group_name = os.path.basename(os.path.dirname(preprocessed_path))
+            with tracing.stage('trial_parse', group_name):
+                self.preprocessed_data, self.schema = read_trial(preprocessed_path, raw=False)
+            metrics.ROWS_PROCESSED.labels(stage='trial_parse', group=group_name).inc(len(self.preprocessed_data))
+            metrics.BYTES_PROCESSED.labels(stage='trial_parse', group=group_name).inc(
+                os.path.getsize(preprocessed_path))
+            self.full_memory = precision.memory_usage(self.preprocessed_data)
+
+    def compact(self) -> None:
+        """
+        Apply the precision policy to the data kept in memory. Called once the group of the trial is aggregated and
+        summarized, so the statistics are computed with full precision. The preprocessed file keeps full precision.
+        """
+        if self.compacted:
+            return
+        self.full_memory = precision.memory_usage(self.preprocessed_data)
+        self.preprocessed_data, self.constants = precision.policy().compact(self.preprocessed_data, self.schema)
+        self.compacted = True
+
+    def with_full_precision(self) -> 'Trial':
+        """
+        Get the trial with its data in full precision, so it can be aggregated in a group once more. A compacted trial
+        is read from its preprocessed file into a copy, without the columns added with add_columns (the group adds
+        them again), so the group the trial is in keeps its data.
+
+        :return: The trial itself when its data has full precision, a copy otherwise
+        """
+        if not self.compacted or not precision.policy().lossy:
+            return self
+        trial = copy.copy(self)
+        trial.preprocessed_data, trial.schema = read_trial(self.preprocessed_file_path, raw=False)
+        trial.full_memory = precision.memory_usage(trial.preprocessed_data)
+        trial.constants = {}
+        trial.added_columns = []
+        trial.compacted = False
+        return trial
+
+    @property
+    def columns(self) -> List[str]:
+        """
+        All columns of the preprocessed data, including the constant ones.
+        """
+        return list(self.schema.header)
+
+    def measured_columns(self, kind: str) -> List[str]:
+        """
+        :param kind: Column kind (see models.schema)
+        :return: Columns of the kind in the preprocessed file, in header order, without the columns added with
+                 add_columns
+        """
+        return [column for column in self.schema.columns(kind) if column not in self.added_columns]
+
+    def column(self, name: str) -> pd.Series:
+        """
+        :param name: Name of a column of the preprocessed data
+        :return: The column, constant columns are expanded to the length of the data
+        """
+        if name in self.constants:
+            return pd.Series(self.constants[name], index=self.preprocessed_data.index, name=name)
+        return self.preprocessed_data[name]
+
+    def full_data(self, dtype: Optional[str] = None) -> pd.DataFrame:
+        """
+        :param dtype: Dtype to cast the floating point columns to (e.g. float64), None to keep the compact dtypes
+        :return: Preprocessed data with all columns, including the constant ones
+        """
+        return precision.expand(self.preprocessed_data, self.constants, self.columns, dtype)
+
+    def add_columns(self, columns: Dict[str, np.ndarray]) -> None:
+        """
+        Add derived columns to the preprocessed data in memory, the preprocessed file is not changed. Columns that
+        already exist are replaced.
+
+        :param columns: Column name -> values, one per row
+        """
+        new = [name for name in columns if name not in self.schema.header]
+        self.full_memory += sum(np.asarray(columns[name], dtype=np.float64).nbytes for name in new)
+        for name in columns:
+            self.constants.pop(name, None)
+        self.schema = schema_for(self.schema.header + tuple(new), self.schema.delimiter)
+        self.added_columns += new
+        added, constants = pd.DataFrame(columns, index=self.preprocessed_data.index), {}
+        if self.compacted:
+            # Only the added columns are compacted, the others already are
+            added, constants = precision.policy().compact(added, self.schema)
+        data = self.preprocessed_data.drop(columns=[name for name in columns if name in self.preprocessed_data])
+        self.preprocessed_data = pd.concat([data, added], axis=1)
+        self.constants.update(constants)
+
+    def memory_usage(self) -> int:
+        """
+        :return: Memory used by the preprocessed data in bytes
+        """
+        return precision.memory_usage(self.preprocessed_data)
+
+    def fingerprint(self) -> str:
+        """
+        Fingerprint of the preprocessed data of the trial, changes whenever the preprocessed file changes.
+
+        :return: Content hash of the preprocessed file
+        """
+        return artifacts.digest(self.preprocessed_file_path) or ''
 
     def no_cores(self) -> int:
-        return len(re.findall(r'CORE\d+_POWER \(W\)', ', '.join(self.preprocessed_data.columns)))
+        return self.schema.no_cores
 
     def no_logical(self) -> int:
-        return len(re.findall(r'CPU_USAGE_\d+', ', '.join(self.preprocessed_data.columns)))
+        return self.schema.no_logical
 
@@ -8,6 +8,7 @@ class ExperimentType(Enum):
     PLOT_OVER_TIME = 1
     SIGNIFICANCE_TEST = 2
     STATISTICS = 3
+    SPECTRUM = 4
 
 
     def __str__(self):
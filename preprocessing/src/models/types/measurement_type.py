@@ -14,7 +14,8 @@ class MeasurementType(Enum):
     
     The third parameter in each enum member defines the compatible experiment types.
     """
-    ALL = (0, "all", {ExperimentType.PLOT_OVER_TIME, ExperimentType.SIGNIFICANCE_TEST, ExperimentType.STATISTICS})
+    ALL = (0, "all", {ExperimentType.PLOT_OVER_TIME, ExperimentType.SIGNIFICANCE_TEST, ExperimentType.STATISTICS,
+                      ExperimentType.SPECTRUM})
     
     # Time-related measurements
     TIME = (1, "Time", {ExperimentType.PLOT_OVER_TIME})
@@ -31,14 +32,22 @@ class MeasurementType(Enum):
     
     # CPU usage and frequency per logical processor
     CPU_USAGE_LOGICAL = (51, "CPU_USAGE_{core_num}", "percent", {ExperimentType.PLOT_OVER_TIME})
+    # Power of the cores attributed to their logical processors by usage (see analysis.attribution)
+    LOGICAL_POWER = (52, "LOGICAL{core_num}_POWER (W)", "watt", {ExperimentType.PLOT_OVER_TIME})
     
     # Memory metrics
     USED_MEMORY = (61, "USED_MEMORY", "decbytes", {ExperimentType.PLOT_OVER_TIME})
     USED_SWAP = (63, "USED_SWAP", "decbytes", {ExperimentType.PLOT_OVER_TIME})
 
+    # Derived metrics (see analysis.derived), the per-sample metrics over time and the per-trial metrics compared
+    DERIVED = (65, "DERIVED", "", {ExperimentType.PLOT_OVER_TIME})
+
     # Special statistics types - only compatible with STATISTICS experiment type
     CPU_STATS = (70, "CPU STATS", "", {ExperimentType.STATISTICS})
     CORE_STATS = (71, "CORE_STATS", "", {ExperimentType.STATISTICS})
+    # Correlation heatmaps (see analysis.correlation) of the columns over time and of the trial metrics over the trials
+    CORRELATION_SAMPLES = (72, "CORRELATION_SAMPLES", "", {ExperimentType.STATISTICS})
+    CORRELATION_TRIALS = (73, "CORRELATION_TRIALS", "", {ExperimentType.STATISTICS})
 
     COMPARE_TOTAL_ENERGY = (80, "COMPARE_TOTAL_ENERGY", "", {ExperimentType.SIGNIFICANCE_TEST})
     COMPARE_PEAK_POWER = (81, "COMPARE_PEAK_POWER", "", {ExperimentType.SIGNIFICANCE_TEST})
@@ -47,6 +56,22 @@ class MeasurementType(Enum):
     COMPARE_SWAP_OVER_TIME = (85, "COMPARE_SWAP_OVER_TIME", "", {ExperimentType.SIGNIFICANCE_TEST})
     COMPARE_ENERGY_VIOLIN_PLOT = (86, "COMPARE_ENERGY_-_VIOLIN_PLOT", "", {ExperimentType.SIGNIFICANCE_TEST})
     COMPARE_POWER_VIOLIN_PLOT = (87, "COMPARE_POWER_-_VIOLIN_PLOT", "", {ExperimentType.SIGNIFICANCE_TEST})
+    COMPARE_DERIVED = (88, "COMPARE_DERIVED", "", {ExperimentType.SIGNIFICANCE_TEST})
+    COMPARE_CORRELATION = (89, "COMPARE_CORRELATION", "", {ExperimentType.SIGNIFICANCE_TEST})
+
+    # Comparisons of a single phase of the workload (see analysis.phases)
+    COMPARE_IDLE_ENERGY = (90, "COMPARE_IDLE_ENERGY", "", {ExperimentType.SIGNIFICANCE_TEST})
+    COMPARE_RAMP_ENERGY = (91, "COMPARE_RAMP_ENERGY", "", {ExperimentType.SIGNIFICANCE_TEST})
+    COMPARE_STEADY_ENERGY = (92, "COMPARE_STEADY_ENERGY", "", {ExperimentType.SIGNIFICANCE_TEST})
+    COMPARE_TAIL_ENERGY = (93, "COMPARE_TAIL_ENERGY", "", {ExperimentType.SIGNIFICANCE_TEST})
+    COMPARE_IDLE_MEAN_POWER = (94, "COMPARE_IDLE_MEAN_POWER", "", {ExperimentType.SIGNIFICANCE_TEST})
+    COMPARE_RAMP_MEAN_POWER = (95, "COMPARE_RAMP_MEAN_POWER", "", {ExperimentType.SIGNIFICANCE_TEST})
+    COMPARE_STEADY_MEAN_POWER = (96, "COMPARE_STEADY_MEAN_POWER", "", {ExperimentType.SIGNIFICANCE_TEST})
+    COMPARE_TAIL_MEAN_POWER = (97, "COMPARE_TAIL_MEAN_POWER", "", {ExperimentType.SIGNIFICANCE_TEST})
+
+    # Power spectral densities (see analysis.spectrum) - only compatible with SPECTRUM experiment type
+    SPECTRUM_CPU_POWER = (100, "CPU_POWER (W)", "suffix: W²/Hz", {ExperimentType.SPECTRUM})
+    SPECTRUM_CORE_POWER = (101, "CORE{core_num}_POWER (W)", "suffix: W²/Hz", {ExperimentType.SPECTRUM})
 
 
     def __init__(self, value, column_name, unit=None, compatible_experiment_types=None):
@@ -0,0 +1,301 @@
+"""
+Headless batch pipeline: ingests the groups and generates the artifacts and dashboards of the experiments described
+in a spec file, without the Flask application.
+
+Spec (YAML or JSON):
+
+    groups: [group_a, group_b, group_c]    # optional, defaults to the groups of the experiments
+    templated: false                       # optional, compact dashboards with group/core variables
+    experiments:
+      - name: A vs B
+        type: SIGNIFICANCE_TEST            # name or value of ExperimentType
+        groups: [group_a, group_b]
+        measurement_types: all             # or a list of names or values of MeasurementType
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from analysis import derived, outliers
+from database_service import DatabaseService
+from experiment_service import ExperimentService
+from experiment_store import ExperimentStore
+from grafana_service import GrafanaService
+from group_service import GroupService
+from models.group import Group
+from models.types.experiment_type import ExperimentType
+from models.types.measurement_type import MeasurementType
+import tracing
+
+try:
+    import yaml
+except ImportError:  # PyYAML is optional, specs can be written in JSON without it
+    yaml = None
+
+# Stages that can be run: ingest the groups, generate the panels of the experiments with their artifacts (comparison
+# files, plots), write the dashboards. Groups that are not ingested are loaded from their output folder.
+STAGES = ('ingest', 'panels', 'dashboards')
+
+
+class ExperimentSpec:
+    """
+    Definition of an experiment in a spec file.
+    """
+    name: str
+    group_names: List[str]
+    experiment_type: ExperimentType
+    measurement_types: List[MeasurementType]
+
+    def __init__(self, name: str, group_names: List[str], experiment_type: ExperimentType,
+                 measurement_types: List[MeasurementType]):
+        self.name = name
+        self.group_names = group_names
+        self.experiment_type = experiment_type
+        self.measurement_types = measurement_types
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ExperimentSpec':
+        for key in ('name', 'type', 'groups'):
+            if key not in data:
+                raise ValueError(f'Experiment {data.get("name", "")!r} is missing "{key}"')
+        experiment_type = parse_experiment_type(data['type'])
+        return cls(str(data['name']), [str(name) for name in data['groups']], experiment_type,
+                   parse_measurement_types(data.get('measurement_types', 'all'), experiment_type))
+
+
+class PipelineSpec:
+    """
+    Groups and experiments to process in a batch run.
+    """
+    group_names: List[str]
+    experiments: List[ExperimentSpec]
+    templated: bool
+
+    def __init__(self, group_names: List[str], experiments: List[ExperimentSpec], templated: bool = False):
+        self.group_names = group_names
+        self.experiments = experiments
+        self.templated = templated
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'PipelineSpec':
+        experiments = [ExperimentSpec.from_dict(experiment) for experiment in data.get('experiments') or []]
+        group_names = [str(name) for name in data.get('groups') or []]
+        # Groups of the experiments are ingested as well, in the order they are first mentioned
+        for experiment in experiments:
+            group_names += [name for name in experiment.group_names if name not in group_names]
+        if not group_names:
+            raise ValueError('The spec contains no groups or experiments')
+        return cls(group_names, experiments, bool(data.get('templated', False)))
+
+
+def load_spec(path: str) -> PipelineSpec:
+    """
+    Load a spec file, YAML (.yaml, .yml) or JSON.
+
+    :param path: Path of the spec file
+    :return: Parsed spec
+    """
+    with open(path, 'r') as file:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            if yaml is None:
+                raise RuntimeError('PyYAML is not installed, install it or write the spec in JSON')
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+    if not isinstance(data, dict):
+        raise ValueError(f'Spec {path} must contain a mapping with "groups" and/or "experiments"')
+    return PipelineSpec.from_dict(data)
+
+
+def parse_experiment_type(value: Any) -> ExperimentType:
+    """
+    :param value: Name (e.g. "SIGNIFICANCE_TEST") or value of an experiment type
+    :return: Experiment type
+    """
+    try:
+        return ExperimentType[value.upper()] if isinstance(value, str) else ExperimentType(int(value))
+    except (KeyError, ValueError):
+        raise ValueError(f'Unknown experiment type {value!r}, valid types are: {[t.name for t in ExperimentType]}')
+
+
+def parse_measurement_types(values: Any, experiment_type: ExperimentType) -> List[MeasurementType]:
+    """
+    :param values: "all", or a list of names (e.g. "CPU_POWER") or values of measurement types
+    :param experiment_type: Experiment type the measurement types must be compatible with
+    :return: Measurement types
+    """
+    compatible = [measurement_type for measurement_type in MeasurementType.get_compatible_types(experiment_type)
+                  if measurement_type != MeasurementType.ALL]
+    if values == 'all':
+        return compatible
+
+    # MeasurementType members have tuple definitions, so they are looked up by value explicitly
+    by_value = {member.value: member for member in MeasurementType}
+    measurement_types = []
+    for value in values:
+        measurement_type = (MeasurementType.__members__.get(value.upper()) if isinstance(value, str)
+                            else by_value.get(value))
+        if measurement_type is None:
+            raise ValueError(f'Unknown measurement type {value!r}')
+        if measurement_type not in compatible:
+            raise ValueError(f'Measurement type {measurement_type.name} is not compatible with {experiment_type.name}')
+        measurement_types.append(measurement_type)
+    return measurement_types
+
+
+class IngestCache:
+    """
+    Signatures of the input files of the groups at their last ingest, so groups whose input did not change are
+    loaded from their output folder instead of being ingested again.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.path = os.path.join(cache_dir, 'ingested.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(self.path, 'r') as file:
+                self._signatures = json.load(file)
+        except (OSError, ValueError):
+            self._signatures = {}
+
+    @staticmethod
+    def signature(group_name: str) -> str:
+        """
+        :param group_name: Name of the group
+        :return: Hash of the names, sizes and modification times of the input files, the outlier policy of the group
+                 and the derived metrics
+        """
+        digest = hashlib.sha256()
+        paths = [input_path for input_path, _ in Group.trial_paths(group_name)]
+        # The outlier policy of the group decides which trials are aggregated, so it is part of the input
+        policy_path = os.path.join(Group.input_folder, group_name, outliers.POLICY_FILE)
+        if os.path.exists(policy_path):
+            paths.append(policy_path)
+        # The derived metrics are columns of the aggregate data and the summaries
+        if os.path.exists(derived.DERIVED_METRICS_FILE):
+            paths.append(derived.DERIVED_METRICS_FILE)
+        for input_path in sorted(paths):
+            stat = os.stat(input_path)
+            digest.update(f'{os.path.basename(input_path)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+        return digest.hexdigest()
+
+    def is_current(self, group_name: str) -> bool:
+        try:
+            return self._signatures.get(group_name) == self.signature(group_name)
+        except OSError:
+            return False
+
+    def update(self, group_name: str) -> None:
+        self._signatures[group_name] = self.signature(group_name)
+        with open(self.path, 'w') as file:
+            json.dump(self._signatures, file, indent=2)
+
+
+def _ingest_group(group_name: str) -> Group:
+    # Module level function, so it can run in worker processes
+    with tracing.job('ingest', group=group_name):
+        return Group(group_name)
+
+
+def ingest_groups(group_names: Iterable[str], workers: int = 1,
+                  cache: Optional[IngestCache] = None) -> Tuple[List[Group], List[str]]:
+    """
+    Ingest groups, in parallel worker processes when workers > 1.
+
+    :param group_names: Names of the groups in the input folder
+    :param workers: Number of worker processes
+    :param cache: Cache of ingested groups, groups with unchanged input are loaded from their output instead
+    :return: Ingested groups and error messages of the groups that failed
+    """
+    groups, failures, pending = [], [], []
+    for group_name in group_names:
+        if cache is not None and cache.is_current(group_name):
+            try:
+                groups.append(Group.load(group_name))
+                print(f'Group {group_name} is unchanged, loaded from its output')
+                continue
+            except FileNotFoundError:
+                pass
+        pending.append(group_name)
+
+    def finish(group_name: str, result) -> None:
+        try:
+            group = result()
+        except Exception as e:
+            failures.append(f'Ingesting group {group_name} failed: {e}')
+            return
+        groups.append(group)
+        if cache is not None:
+            cache.update(group_name)
+        print(f'Ingested group {group_name}')
+
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(group_name, executor.submit(_ingest_group, group_name)) for group_name in pending]
+            for group_name, future in futures:
+                finish(group_name, future.result)
+    else:
+        for group_name in pending:
+            finish(group_name, lambda: _ingest_group(group_name))
+    return groups, failures
+
+
+def run_pipeline(spec: PipelineSpec, workers: int = 1, cache_dir: Optional[str] = None,
+                 stages: Iterable[str] = STAGES,
+                 dashboard_path: str = 'grafana/dashboards/energibridge-dashboard.json') -> List[str]:
+    """
+    Run the pipeline for a spec. Failing groups or experiments do not stop the others.
+
+    :param spec: Groups and experiments to process
+    :param workers: Number of processes ingesting groups in parallel
+    :param cache_dir: Folder caching ingested groups and generated panels between runs, None to not cache
+    :param stages: Stages to run, see STAGES
+    :param dashboard_path: Path in the folder the dashboards are written to
+    :return: Error messages, empty if everything succeeded
+    """
+    stages = set(stages)
+    unknown = stages - set(STAGES)
+    if unknown:
+        raise ValueError(f'Unknown stages {sorted(unknown)}, valid stages are: {list(STAGES)}')
+
+    if 'ingest' in stages:
+        groups, failures = ingest_groups(spec.group_names, workers,
+                                         IngestCache(cache_dir) if cache_dir is not None else None)
+        database_url = os.environ.get('DATABASE_URL', '')
+        if database_url:
+            database_service = DatabaseService(database_url)
+            for group in groups:
+                database_service.load_group(group)
+    else:
+        groups, failures = [], []
+        for group_name in spec.group_names:
+            try:
+                groups.append(Group.load(group_name))
+            except FileNotFoundError as e:
+                failures.append(str(e))
+
+    if not stages & {'panels', 'dashboards'}:
+        return failures
+
+    panel_store = ExperimentStore(os.path.join(cache_dir, 'panels.db')) if cache_dir is not None else None
+    experiment_service = ExperimentService(GroupService(groups=groups), panel_store=panel_store)
+    grafana_service = GrafanaService(dashboard_path)
+    for experiment_spec in spec.experiments:
+        try:
+            missing = [name for name in experiment_spec.group_names
+                       if all(group.name != name for group in groups)]
+            if missing:
+                raise ValueError(f'groups {missing} are not available')
+            experiment_service.add_experiment(experiment_spec.name, experiment_spec.group_names,
+                                              experiment_spec.measurement_types, experiment_spec.experiment_type)
+            experiment = experiment_service.find_experiment(experiment_spec.name)
+            if 'dashboards' in stages:
+                grafana_service.create_dashboard_from_experiments(
+                    [experiment], spec.templated, experiment_service.create_visualization_panels)
+            else:
+                experiment_service.create_visualization_panels(experiment, spec.templated)
+        except Exception as e:
+            failures.append(f'Experiment {experiment_spec.name} failed: {e}')
+    return failures
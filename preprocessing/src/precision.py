@@ -0,0 +1,159 @@
+"""
+Precision policy of the trial and aggregate data kept in memory.
+
+The preprocessed and aggregate CSV files are always written with full precision, the policy only decides how compact
+the in-memory copies are. The trials are compacted once their group is aggregated and summarized (see Group.compact),
+so the files a group writes are the same with every policy. With the default "compact" policy:
+
+- power, voltage and frequency columns are stored as float32,
+- Time and Delta as int64,
+- p-state and CPU usage columns as the narrowest integer type when all their values are integers (float32 otherwise),
+- columns that have the same value in every row of a trial are dropped from the trial data and kept as a scalar.
+
+The "full" policy keeps the dtypes the data is read with. The policy is chosen with the PRECISION_POLICY environment
+variable.
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from models.schema import TrialSchema
+
+PRECISION_POLICY = os.environ.get('PRECISION_POLICY', 'compact')
+
+# Columns that are never collapsed, every trial needs its own time axis
+_REQUIRED = ('Time', 'Delta')
+
+
+class PrecisionPolicy:
+    """
+    Dtypes of the column kinds of a TrialSchema and whether constant columns are collapsed.
+    """
+    name: str
+    # Column kind -> dtype, 'integer' for the narrowest integer type that holds the values
+    dtypes: Dict[str, str]
+    # Dtype of 'integer' columns that have non-integer values
+    fallback: str
+    collapse_constants: bool
+
+    def __init__(self, name: str, dtypes: Dict[str, str], fallback: str = 'float32',
+                 collapse_constants: bool = False):
+        self.name = name
+        self.dtypes = dtypes
+        self.fallback = fallback
+        self.collapse_constants = collapse_constants
+
+    @property
+    def lossy(self) -> bool:
+        """
+        Whether compacted data has fewer significant digits than the data it was compacted from. Integer types are
+        only used when they hold the values exactly, and collapsed constants keep their value.
+        """
+        return any(dtype not in ('integer', 'int64') for dtype in self.dtypes.values())
+
+    def _cast(self, series: pd.Series, kind: str) -> pd.Series:
+        dtype = self.dtypes.get(kind)
+        if dtype is None or series.hasnans:
+            return series
+        values = series.to_numpy()
+        if dtype == 'integer' or dtype == 'int64':
+            # Integer types are only used when they hold the values exactly
+            if not np.array_equal(values, np.round(values)):
+                return series.astype(self.fallback) if dtype == 'integer' else series
+            if dtype == 'int64':
+                return series.astype('int64')
+            return pd.Series(pd.to_numeric(values, downcast='integer'), index=series.index, name=series.name)
+        return series.astype(dtype)
+
+    def compact(self, data: pd.DataFrame, schema: TrialSchema) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+        """
+        Apply the policy to the data of a trial.
+
+        :param data: Preprocessed trial data
+        :param schema: Schema of the data
+        :return: Data with the columns cast by kind and without the constant columns, and the constant columns as
+                 {column: value}
+        """
+        constants = {}
+        columns = {}
+        for column in data.columns:
+            series = data[column]
+            if self.collapse_constants and column not in _REQUIRED and len(series) > 0 and not series.hasnans:
+                values = series.to_numpy()
+                if (values == values[0]).all():
+                    constants[column] = values[0]
+                    continue
+            columns[column] = self._cast(series, schema.kinds.get(column, 'other'))
+        return pd.DataFrame(columns, index=data.index), constants
+
+    def compact_aggregate(self, data: pd.DataFrame, schema: TrialSchema) -> pd.DataFrame:
+        """
+        Apply the dtypes of the policy to aggregate data, whose columns are named "<column>_<statistic>". Constant
+        columns are kept, as the Grafana panels are built from the aggregate columns.
+
+        :param data: Aggregate data of a group
+        :param schema: Schema of the trials of the group
+        :return: Data with the columns cast by the kind of their trial column
+        """
+        columns = {}
+        for column in data.columns:
+            kind = schema.kinds.get(column, schema.kinds.get(column.rsplit('_', 1)[0], 'other'))
+            # Order statistics of integer columns are not integers in general, so only float dtypes are applied
+            columns[column] = self._cast(data[column], kind) if self.dtypes.get(kind) != 'integer' else data[column]
+        return pd.DataFrame(columns, index=data.index)
+
+
+POLICIES = {
+    'full': PrecisionPolicy('full', {}),
+    'compact': PrecisionPolicy('compact', {
+        'time': 'int64',
+        'power': 'float32',
+        'volt': 'float32',
+        'freq': 'float32',
+        'pstate': 'integer',
+        'usage': 'integer'
+    }, collapse_constants=True)
+}
+
+
+def policy(name: Optional[str] = None) -> PrecisionPolicy:
+    """
+    :param name: Name of the policy, PRECISION_POLICY if None
+    :return: The policy
+    """
+    name = name or PRECISION_POLICY
+    if name not in POLICIES:
+        raise ValueError(f'Unknown precision policy "{name}", valid policies are: {list(POLICIES)}')
+    return POLICIES[name]
+
+
+def expand(data: pd.DataFrame, constants: Dict[str, Any], columns: List[str], dtype: Optional[str] = None) \
+        -> pd.DataFrame:
+    """
+    Restore the constant columns of compacted trial data.
+
+    :param data: Compacted trial data
+    :param constants: Constant columns of the trial
+    :param columns: All columns of the trial, in order
+    :param dtype: Dtype to cast the floating point columns to (e.g. float64), None to keep the compact dtypes
+    :return: Data with all columns
+    """
+    expanded = {}
+    for column in columns:
+        if column in constants:
+            expanded[column] = np.full(len(data), constants[column])
+        elif dtype is not None and data[column].dtype.kind == 'f':
+            expanded[column] = data[column].astype(dtype)
+        else:
+            expanded[column] = data[column]
+    return pd.DataFrame(expanded, index=data.index)
+
+
+def memory_usage(data: pd.DataFrame) -> int:
+    """
+    :param data: A DataFrame
+    :return: Memory used by the DataFrame and its index in bytes
+    """
+    return int(data.memory_usage(index=True, deep=True).sum())
@@ -3,6 +3,11 @@ import numpy as np
 import re
 import os
 from pprint import pprint
+from typing import Optional
+
+import kernels
+import tracing
+from models.schema import TrialSchema, schema_of
 
 
 # ------------------------------------------------------------------------------------------------------
@@ -10,7 +15,7 @@ from pprint import pprint
 # Preprocessing file/module
 
 
-def preprocess(raw_data: pd.DataFrame) -> pd.DataFrame:
+def preprocess(raw_data: pd.DataFrame, schema: Optional[TrialSchema] = None) -> pd.DataFrame:
     """
     Takes imported csv as DataFrame and do necessary preprocessing. This includes finding differences in energy and
     adding converted where necessary. Adds missing power or energy columns where necessary.
@@ -20,35 +25,55 @@ def preprocess(raw_data: pd.DataFrame) -> pd.DataFrame:
     little effect on power and energy calculations.
 
     :param raw_data: Loaded csv as a DataFrame
+    :param schema: Schema of the columns of raw_data, looked up in the schema registry if None
     :return: Preprocessed DataFrame
     """
-    # Go through all dataframe columns and preprocess where necessary
-    res = raw_data.copy()
-    # Normalise time to start at 0
-    res['Time'] = res['Time'] - res['Time'].min()
-
-    # Quantisation of delta and time to become multiples of delta
-    delta = res['Delta'].mode()
-    res['Delta'] = res['Delta'].apply(lambda x: round(x / delta) * delta)
-    res['Time'] = res['Time'].apply(lambda x: round(x / delta) * delta)
+    # The columns of the result, the derived columns are added in the order the preprocessing finds them
+    columns = {column: raw_data[column] for column in raw_data.columns}
 
-    # For windows, the package energy is the total energy used by the CPU
-    if 'CPU_ENERGY (J)' not in res.columns and 'PACKAGE_ENERGY (J)' in res.columns:
-        res['CPU_ENERGY (J)'] = res['PACKAGE_ENERGY (J)']
+    # Quantisation of delta and time to become multiples of delta, with the time normalised to start at 0
+    with tracing.span('quantise'):
+        # Several deltas can occur equally often, the smallest of them is used
+        delta = raw_data['Delta'].mode().iloc[0]
+        columns['Time'], columns['Delta'] = kernels.quantise(raw_data['Time'].to_numpy(),
+                                                             raw_data['Delta'].to_numpy(), delta)
 
-    # Loop through all columns in res
-    for column in res.columns:
-        # Check if the column name matches the regex pattern
-        if re.search(r'_ENERGY \(J\)$', column):
-            # Call the energy_preprocessing function on res and the column
-            res = energy_preprocessing(res, column)
-        elif re.search(r'_POWER \(Watts\)$', column):
-            # Call the power_preprocessing function on res and the column
-            res = power_preprocessing(res, column)
-        else:
-            continue
+    if schema is None:
+        schema = schema_of(raw_data)
 
-    return res
+    # For windows, the package energy is the total energy used by the CPU
+    if schema.windows_cpu_energy:
+        columns['CPU_ENERGY (J)'] = raw_data['PACKAGE_ENERGY (J)']
+
+    with tracing.span('derive_columns'):
+        # The columns to derive from are classified once per header by the schema, and all energy and all power
+        # columns are processed by one kernel call each
+        preprocess_columns = schema.preprocess_columns()
+        energy_columns = [column for column, kind in preprocess_columns if kind == 'energy']
+        power_columns = [column for column, kind in preprocess_columns if kind != 'energy']
+        if energy_columns:
+            diffs, powers = kernels.energy_power(np.column_stack([columns[column] for column in energy_columns]),
+                                                 columns['Delta'])
+        if power_columns:
+            energies = kernels.power_energy(np.column_stack([columns[column] for column in power_columns]),
+                                            columns['Delta'])
+
+        for column, kind in preprocess_columns:
+            if kind == 'energy':
+                index = energy_columns.index(column)
+                columns[f'DIFF_{column}'] = diffs[:, index]
+                # Add power column
+                columns[f'{column.split("_")[0]}_POWER (W)'] = powers[:, index]
+            else:
+                index = power_columns.index(column)
+                # Rename to have (W) instead of (Watts)
+                if column.endswith('(Watts)'):
+                    columns = {(key.replace('(Watts)', '(W)') if key == column else key): value
+                               for key, value in columns.items()}
+                # Add energy column
+                columns[f'DIFF_{column.split("_")[0]}_ENERGY (J)'] = energies[:, index]
+
+    return pd.DataFrame(columns, index=raw_data.index)
 
 
 def energy_preprocessing(df: pd.DataFrame, column: str) -> pd.DataFrame:
@@ -60,11 +85,12 @@ def energy_preprocessing(df: pd.DataFrame, column: str) -> pd.DataFrame:
     """
     ndf = df.copy()
 
-    ndf[f'DIFF_{column}'] = ndf[column].diff().fillna(0)
+    diff, power = kernels.energy_power(ndf[[column]].to_numpy(), ndf['Delta'].to_numpy())
+    ndf[f'DIFF_{column}'] = diff[:, 0]
 
     # Add power column
     cat = column.split('_')[0]
-    ndf[f'{cat}_POWER (W)'] = (ndf[f'DIFF_{column}'] / (ndf['Delta'] / 1000)).fillna(0).replace([np.inf, -np.inf], 0)
+    ndf[f'{cat}_POWER (W)'] = power[:, 0]
 
     return ndf
 
@@ -78,11 +104,12 @@ def power_preprocessing(df: pd.DataFrame, column: str) -> pd.DataFrame:
     """
     ndf = df.copy()
     # Rename to have (W) instead of (Watts)
-    if column.endswith('Watts'):
-        column = column.replace('Watts', 'W')
+    if column.endswith('(Watts)'):
+        ndf = ndf.rename(columns={column: column.replace('(Watts)', '(W)')})
+        column = column.replace('(Watts)', '(W)')
     # Add energy column
     cat = column.split('_')[0]
-    ndf[f'DIFF_{cat}_ENERGY (J)'] = (ndf[column] * (ndf['Delta']/1000)).fillna(0)
+    ndf[f'DIFF_{cat}_ENERGY (J)'] = kernels.power_energy(ndf[[column]].to_numpy(), ndf['Delta'].to_numpy())[:, 0]
     return ndf
 
 # ------------------------------------------------------------------------------------------------------
@@ -0,0 +1,346 @@
+"""
+Module containing a service that answers read-only SQL queries on the output artifacts of the pipeline.
+"""
+import glob
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from models.group import Group
+import metrics
+
+try:
+    import duckdb
+except ImportError:  # DuckDB is optional, queries run on SQLite without it
+    duckdb = None
+
+# Views that can be queried, by the output files they are built from (relative to a group or comparison folder)
+VIEW_FILES = {
+    'trials': 'trial_summary.csv',
+    'samples': '*_preprocessed.csv',
+    'aggregates': 'aggregate_data.csv',
+    'spectra': 'spectrum_data.csv',
+    'summaries': 'group_summary.csv',
+    'comparisons': 'group_comparison.csv',
+    'correlations': 'correlations.csv'
+}
+
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+
+
+class QueryService:
+    """
+    Service running read-only SQL on views over the output artifacts: trials (trial summaries), samples (preprocessed
+    trial data), aggregates (aggregate data), spectra (power spectra), summaries (group summaries), comparisons (group
+    comparisons, one row per metric) and correlations (correlation matrices, one row per pair of columns). Every view
+    has a group_name column, samples also a trial column.
+
+    Runs on DuckDB when it is installed: views scan the CSV files directly, so only the columns and rows a query
+    needs are read. DuckDB can only read files in the output folder, so table functions such as read_csv or glob
+    cannot reach other files. Without DuckDB, each view a query references is loaded into an in-memory SQLite
+    database, and reloaded when its files change, and an authorizer only allows reading while a query runs. Results
+    are limited to max_rows rows and queries are interrupted after timeout seconds.
+
+    Every query runs on its own cursor (DuckDB) or connection (SQLite) to the shared in-memory database, so queries
+    run concurrently. Views are only (re)created while no query runs.
+    """
+    _signatures: Dict[str, Tuple]
+    _pid: Optional[int]
+    _lock: '_ViewsLock'
+
+    def __init__(self, max_rows: int = 10000, timeout: float = 10.0, engine: Optional[str] = None):
+        """
+        :param max_rows: Default maximum number of rows returned by a query
+        :param timeout: Default maximum duration of a query in seconds
+        :param engine: "duckdb" or "sqlite", None to use DuckDB when it is installed
+        """
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self.engine = engine or ('duckdb' if duckdb is not None else 'sqlite')
+        if self.engine == 'duckdb' and duckdb is None:
+            raise RuntimeError('duckdb is not installed, use the sqlite engine or install duckdb')
+        self._connection = None
+        self._pid = None
+        self._signatures = {}
+        self._lock = _ViewsLock()
+
+    def _connect(self) -> None:
+        """
+        Open the in-memory database on first use in this process. Connections are not shared with forked worker
+        processes, each worker opens its own.
+        """
+        if self._pid == os.getpid():
+            return
+        if self.engine == 'duckdb':
+            self._connection = duckdb.connect(':memory:')
+            # Sandbox the connection: files can only be read from the output folder, which the views are created on
+            # later, and queries cannot change the configuration back
+            output_folder = os.path.join(os.path.abspath(Group.output_folder), '')
+            self._connection.execute("SET allowed_directories = [" + "'" + output_folder.replace("'", "''") + "']")
+            self._connection.execute('SET enable_external_access = false')
+            self._connection.execute('SET lock_configuration = true')
+        else:
+            # Named in-memory database with a shared cache, so queries can open their own connections to it. The
+            # connection is kept open, the database is removed when its last connection is closed
+            self._sqlite_uri = f'file:energibridge-query-{os.getpid()}-{id(self)}?mode=memory&cache=shared'
+            self._connection = sqlite3.connect(self._sqlite_uri, uri=True, check_same_thread=False)
+        self._pid = os.getpid()
+        self._signatures = {}
+
+    @staticmethod
+    def _files(view: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(glob.escape(Group.output_folder), '*', VIEW_FILES[view])))
+
+    @staticmethod
+    def _signature(files: List[str]) -> Tuple:
+        return tuple((path, os.stat(path).st_mtime_ns) for path in files)
+
+    @staticmethod
+    def check_read_only(sql: str) -> str:
+        """
+        Check that a query is a single SELECT (or WITH ... SELECT) statement. The database engines check again that
+        the statement only reads, see _run_duckdb and _read_only_authorizer.
+
+        :param sql: SQL query
+        :return: Query without trailing semicolons
+        """
+        query = _COMMENTS.sub(' ', sql).strip().rstrip(';').strip()
+        code = _LITERALS.sub("''", query)
+        if ';' in code:
+            raise ValueError('Only a single statement can be queried')
+        if not re.match(r'(SELECT|WITH)\b', code, re.IGNORECASE):
+            raise ValueError('Only SELECT queries are allowed')
+        return query
+
+    def query(self, sql: str, max_rows: Optional[int] = None,
+              timeout: Optional[float] = None) -> Tuple[pd.DataFrame, bool]:
+        """
+        Run a read-only query.
+
+        :param sql: SQL query on the views
+        :param max_rows: Maximum number of rows to return (a positive integer), at most the default maximum
+        :param timeout: Maximum duration in seconds (a positive number), at most the default timeout
+        :return: Result rows and whether the result was truncated to max_rows
+        :raises ValueError: If the query is not a single SELECT or max_rows or timeout is invalid
+        """
+        query = self.check_read_only(sql)
+        if max_rows is not None and (isinstance(max_rows, bool) or not isinstance(max_rows, int) or max_rows <= 0):
+            raise ValueError('max_rows must be a positive integer')
+        if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))
+                                    or not math.isfinite(timeout) or timeout <= 0):
+            raise ValueError('timeout must be a positive number of seconds')
+        max_rows = min(max_rows or self.max_rows, self.max_rows)
+        timeout = min(timeout or self.timeout, self.timeout)
+
+        views = [view for view in VIEW_FILES if re.search(rf'\b{view}\b', query, re.IGNORECASE)]
+        self._refresh_views(views)
+        with self._lock.read():
+            if self.engine == 'duckdb':
+                columns, rows = self._run_duckdb(query, max_rows, timeout)
+            else:
+                columns, rows = self._run_sqlite(query, max_rows, timeout)
+
+        truncated = len(rows) > max_rows
+        return pd.DataFrame(rows[:max_rows], columns=columns), truncated
+
+    def _refresh_views(self, views: List[str]) -> None:
+        """
+        Open the database of this process and (re)create the views whose files changed, waiting for running queries.
+
+        :param views: Names of the views a query references
+        """
+        signatures = {view: self._signature(self._files(view)) for view in views}
+        if self._pid == os.getpid() and all(self._signatures.get(view) == signature
+                                            for view, signature in signatures.items()):
+            for _ in views:
+                metrics.cache_lookup('query_views', True)
+            return
+
+        with self._lock.write():
+            self._connect()
+            for view in views:
+                self._refresh(view)
+
+    def _refresh(self, view: str) -> None:
+        """
+        (Re)create a view if its files were added, removed or changed since it was created.
+
+        :param view: Name of the view
+        """
+        files = self._files(view)
+        signature = self._signature(files)
+        if self._signatures.get(view) == signature:
+            metrics.cache_lookup('query_views', True)
+            return
+
+        metrics.cache_lookup('query_views', False)
+
+        if self.engine == 'duckdb':
+            self._create_duckdb_view(view, files)
+        else:
+            self._create_sqlite_table(view, files)
+        self._signatures[view] = signature
+
+    def _create_duckdb_view(self, view: str, files: List[str]) -> None:
+        self._connection.execute(f'DROP {"TABLE" if view == "comparisons" else "VIEW"} IF EXISTS {view}')
+        if not files:
+            return
+        if view == 'comparisons':
+            # Comparison files have the group names in their column names, they are converted to rows instead
+            self._connection.register('comparisons_frame', self.comparisons_frame(files))
+            self._connection.execute('CREATE TABLE comparisons AS SELECT * FROM comparisons_frame')
+            self._connection.unregister('comparisons_frame')
+            return
+
+        file_list = ', '.join("'" + path.replace("'", "''") + "'" for path in files)
+        names = "regexp_extract(filename, '([^/]+)/[^/]+$', 1) AS group_name"
+        if view == 'samples':
+            names += ", regexp_extract(filename, '([^/]+)_preprocessed\\.csv$', 1) AS trial"
+        self._connection.execute(
+            f'CREATE VIEW {view} AS SELECT {names}, * EXCLUDE (filename) '
+            f'FROM read_csv_auto([{file_list}], filename = true, union_by_name = true)')
+
+    def _create_sqlite_table(self, view: str, files: List[str]) -> None:
+        self._connection.execute(f'DROP TABLE IF EXISTS "{view}"')
+        if not files:
+            return
+        if view == 'comparisons':
+            df = self.comparisons_frame(files)
+        else:
+            frames = []
+            for path in files:
+                frame = pd.read_csv(path)
+                frame.insert(0, 'group_name', os.path.basename(os.path.dirname(path)))
+                if view == 'samples':
+                    frame.insert(1, 'trial', os.path.basename(path)[:-len('_preprocessed.csv')])
+                frames.append(frame)
+            df = pd.concat(frames, ignore_index=True)
+        df.to_sql(view, self._connection, index=False)
+
+    @staticmethod
+    def comparisons_frame(files: List[str]) -> pd.DataFrame:
+        """
+        Convert group comparison files (one column per metric and group) to one row per comparison and metric.
+
+        :param files: Paths of group_comparison.csv files in "<group0>_vs_<group1>" folders
+        :return: DataFrame with the comparison, both group names and the comparison statistics of every metric
+        """
+        rows = []
+        for path in files:
+            comparison = os.path.basename(os.path.dirname(path))
+            if '_vs_' not in comparison:
+                continue
+            group_name0, group_name1 = comparison.split('_vs_', 1)
+            data = pd.read_csv(path).iloc[0]
+            for column in data.index:
+                if not column.endswith('_abs_diff'):
+                    continue
+                metric = column[:-len('_abs_diff')]
+                rows.append({
+                    'comparison': comparison,
+                    'group_name0': group_name0,
+                    'group_name1': group_name1,
+                    'metric': metric,
+                    'value0': data.get(f'{metric}_{group_name0}'),
+                    'value1': data.get(f'{metric}_{group_name1}'),
+                    'abs_diff': data.get(f'{metric}_abs_diff'),
+                    'rel_diff': data.get(f'{metric}_rel_diff'),
+                    'normal': data.get(f'{metric}_normal'),
+                    'pvalue': data.get(f'{metric}_pvalue'),
+                    'significant': data.get(f'{metric}_significant')
+                })
+        return pd.DataFrame(rows, columns=['comparison', 'group_name0', 'group_name1', 'metric', 'value0', 'value1',
+                                           'abs_diff', 'rel_diff', 'normal', 'pvalue', 'significant'])
+
+    def _run_duckdb(self, query: str, max_rows: int, timeout: float) -> Tuple[List[str], List[tuple]]:
+        cursor = self._connection.cursor()
+        timer = threading.Timer(timeout, cursor.interrupt)
+        timer.start()
+        try:
+            # WITH can also start a statement that writes, the parser of DuckDB knows the type of the statement
+            statements = cursor.extract_statements(query)
+            if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+                raise ValueError('Only SELECT queries are allowed')
+            cursor.execute(query)
+            rows = cursor.fetchmany(max_rows + 1)
+            return [description[0] for description in cursor.description], rows
+        except duckdb.InterruptException:
+            raise TimeoutError(f'Query did not finish within {timeout} seconds')
+        except duckdb.Error as e:
+            raise ValueError(str(e))
+        finally:
+            timer.cancel()
+            cursor.close()
+
+    def _run_sqlite(self, query: str, max_rows: int, timeout: float) -> Tuple[List[str], List[tuple]]:
+        deadline = time.monotonic() + timeout
+        connection = sqlite3.connect(self._sqlite_uri, uri=True)
+        # Only reading is authorized while the query runs, and it is aborted once the deadline passes
+        connection.set_authorizer(_read_only_authorizer)
+        connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        try:
+            cursor = connection.execute(query)
+            rows = cursor.fetchmany(max_rows + 1)
+            return [description[0] for description in cursor.description], rows
+        except sqlite3.OperationalError as e:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Query did not finish within {timeout} seconds')
+            raise ValueError(str(e))
+        except sqlite3.Error as e:
+            raise ValueError(str(e))
+        finally:
+            connection.close()
+
+
+class _ViewsLock:
+    """
+    Lock letting any number of queries read the views together, while the views are changed by one thread at a time
+    when no query runs. Waiting changes go first, so views are not kept outdated by a steady stream of queries.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            self._condition.wait_for(lambda: not self._writing and not self._readers)
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+def _read_only_authorizer(action: int, *_) -> int:
+    if action in (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE):
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
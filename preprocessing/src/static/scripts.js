@@ -88,6 +88,7 @@ $(document).ready(function() {
         $.ajax({
             url: '/visualizations/generate',
             method: 'GET',
+            data: { mode: $('#templated-dashboards').is(':checked') ? 'templated' : 'expanded' },
             success: function(response) {
                 if (response.status === 'success') {
                     showError('Success', 'Visualizations generated successfully!', null, 'success');
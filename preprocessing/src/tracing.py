@@ -0,0 +1,295 @@
+"""
+Tracing of the pipeline stages and on-demand sampling profiles of ingest and generate jobs.
+
+When tracing is enabled (TRACING=1), spans are appended as JSON lines to <TRACE_DIR>/trace.jsonl. Every span has the
+id of its trace and of its parent span, so the stages of one job (e.g. ingesting a group: its trials, their parsing and
+preprocessing, aggregation, ...) can be put back together as a tree. The current span is kept in a context variable, so
+spans started in other threads or requests do not get mixed up.
+
+The spans are buffered and written to one open file when a job ends or the buffer is full, whole lines at once, so the
+spans of several server workers do not interleave. Once the file exceeds TRACE_MAX_BYTES it is moved to trace.jsonl.1,
+replacing the previous one, so traces take at most about twice that size.
+
+A job can additionally be sampled by a profiler, which writes the sampled stacks in the folded format
+(<TRACE_DIR>/<job>-<trace id>.folded) that flamegraph tools (flamegraph.pl, speedscope, inferno) read directly.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional
+
+import metrics
+
+# Folder of the trace file and the profiles, outside csv-data which is served publicly
+TRACE_DIR = os.environ.get('TRACE_DIR', 'traces')
+# Spans are only written when tracing is enabled
+TRACING = os.environ.get('TRACING', '0') not in ('', '0', 'false')
+# Size of the trace file after which it is rotated
+TRACE_MAX_BYTES = int(os.environ.get('TRACE_MAX_BYTES', 64 * 1024 * 1024))
+# Size of the buffered spans after which they are written before the end of the job
+TRACE_BUFFER_BYTES = 64 * 1024
+# Profile every ingest and generate job, instead of only the jobs that ask for it
+PROFILE_JOBS = os.environ.get('PROFILE_JOBS', '') not in ('', '0', 'false')
+# Seconds between two samples of the profiler
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.005'))
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    A timed operation within a trace.
+    """
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    attributes: Dict[str, Any]
+
+    def __init__(self, name: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+
+
+def trace_path() -> str:
+    return os.path.join(TRACE_DIR, 'trace.jsonl')
+
+
+class _TraceWriter:
+    """
+    Writer of the spans of this process, keeping the trace file open between writes.
+    """
+    _file: Optional[BinaryIO]
+    _pending: List[bytes]
+    _pending_size: int
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = []
+        self._pending_size = 0
+
+    def write(self, record: Dict[str, Any], flush: bool) -> None:
+        """
+        :param record: Span to write
+        :param flush: Whether to write the buffered spans now, e.g. at the end of a job
+        """
+        line = (json.dumps(record, default=str) + '\n').encode()
+        with self._lock:
+            self._pending.append(line)
+            self._pending_size += len(line)
+            if flush or self._pending_size >= TRACE_BUFFER_BYTES:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        data = b''.join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        try:
+            file = self._open()
+            if os.fstat(file.fileno()).st_size + len(data) > TRACE_MAX_BYTES > 0:
+                self._close()
+                os.replace(trace_path(), trace_path() + '.1')
+                file = self._open()
+            # Unbuffered append of whole lines, so the spans of other processes end up between lines
+            file.write(data)
+        except OSError as e:
+            self._close()
+            print(f'Could not write trace to {trace_path()}: {e}')
+
+    def _open(self) -> BinaryIO:
+        if self._file is not None:
+            try:
+                # Another process may have rotated or removed the file since
+                if os.stat(trace_path()).st_ino == os.fstat(self._file.fileno()).st_ino:
+                    return self._file
+            except FileNotFoundError:
+                pass
+            self._close()
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        self._file = open(trace_path(), 'ab', buffering=0)
+        return self._file
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def reset(self) -> None:
+        """
+        Forget the spans and the file of the parent process, in a forked process.
+        """
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = []
+        self._pending_size = 0
+
+
+_writer = _TraceWriter()
+atexit.register(_writer.flush)
+os.register_at_fork(after_in_child=_writer.reset)
+
+
+def flush() -> None:
+    """
+    Write the buffered spans to the trace file.
+    """
+    _writer.flush()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Trace the with block as a child of the current span, or as the root of a new trace.
+
+    :param name: Name of the operation
+    :param attributes: Attributes stored with the span (e.g. group name)
+    :return: Context manager yielding the span, attributes can still be added within the block
+    """
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    start_time = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_span.reset(token)
+        if TRACING:
+            # The spans of a job are written together when its root span ends
+            _writer.write({
+                'trace_id': current.trace_id,
+                'span_id': current.span_id,
+                'parent_id': current.parent_id,
+                'name': current.name,
+                'start': start_time,
+                'duration_ms': duration * 1000,
+                'pid': os.getpid(),
+                'thread': threading.current_thread().name,
+                'attributes': current.attributes,
+                'error': error
+            }, flush=current.parent_id is None)
+
+
+@contextmanager
+def stage(name: str, group: str = '', experiment_type: str = '') -> Iterator[Span]:
+    """
+    Trace a pipeline stage and observe its duration in the stage metrics.
+
+    :param name: Name of the stage
+    :param group: Name of the group (or groups) the stage works on
+    :param experiment_type: Experiment type the stage works for
+    :return: Context manager yielding the span of the stage
+    """
+    with span(name, group=group, experiment_type=experiment_type) as current, \
+            metrics.stage_timer(name, group, experiment_type):
+        yield current
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator tracing every call of a function.
+
+    :param name: Name of the spans
+    :return: Decorator
+    """
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, function=function.__qualname__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SamplingProfiler:
+    """
+    Profiler sampling the stack of one thread at a fixed interval from a background thread. Unlike a deterministic
+    profiler it does not slow down the profiled code, and the stack counts are directly usable for a flamegraph.
+    """
+    stacks: StackCounter
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = PROFILE_INTERVAL):
+        """
+        :param thread_id: Identifier of the thread to sample, the calling thread by default
+        :param interval: Seconds between two samples
+        """
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = StackCounter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        """
+        :return: Sampled stacks in the folded format, one "frame;frame;... count" line per distinct stack
+        """
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+@contextmanager
+def job(name: str, profile: Optional[bool] = None, **attributes: Any) -> Iterator[Span]:
+    """
+    Trace a job (e.g. ingesting a group or generating dashboards), sampling it with the profiler if requested. The
+    path of the profile is stored in the "profile" attribute of the span of the job.
+
+    :param name: Name of the job
+    :param profile: Whether to profile the job, PROFILE_JOBS if None
+    :param attributes: Attributes stored with the span
+    :return: Context manager yielding the span of the job
+    """
+    with span(name, **attributes) as current:
+        if not (PROFILE_JOBS if profile is None else profile):
+            yield current
+            return
+
+        path = os.path.join(TRACE_DIR, f'{name}-{current.trace_id}.folded')
+        current.attributes['profile'] = path
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield current
+        finally:
+            profiler.stop()
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            with open(path, 'w') as file:
+                file.write(profiler.folded())
+            print(f'Profile of {name} saved to {path}')
@@ -0,0 +1,362 @@
+"""
+Module containing a service that ingests trial files uploaded over HTTP.
+"""
+import contextvars
+import os
+import shutil
+import threading
+import uuid
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+from group_service import GroupService
+from models.group import Group
+from models.trial import Trial
+import metrics
+import tracing
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, only gzip compressed uploads are accepted without it
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+
+# Maximum size of an uploaded trial after decompression in bytes, protects the disk against decompression bombs
+MAX_TRIAL_SIZE = int(os.environ.get('MAX_TRIAL_SIZE', str(512 * 1024 * 1024)))
+
+# Errors of corrupt compressed content, reported as invalid uploads
+DECOMPRESSION_ERRORS = (zlib.error,) if zstandard is None else (zlib.error, zstandard.ZstdError)
+
+TRIAL_EXTENSIONS = ('.csv', '.tsv')
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+def _check_name(name: str, kind: str) -> str:
+    if name in ('', '.', '..') or os.path.basename(name) != name:
+        raise ValueError(f'Invalid {kind} "{name}"')
+    return name
+
+
+class _LimitedFile:
+    """
+    File that refuses to grow beyond MAX_TRIAL_SIZE, so a small compressed upload cannot fill the disk.
+    """
+
+    def __init__(self, path: str, filename: str):
+        self._file = open(path, 'wb')
+        self._filename = filename
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > MAX_TRIAL_SIZE:
+            raise ValueError(f'File "{self._filename}" exceeds the maximum trial size of {MAX_TRIAL_SIZE} bytes')
+        self._file.write(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _TrialWriter:
+    """
+    Writes an uploaded trial file to a folder, decompressing it on the fly. The file is written under a temporary
+    name and only renamed when it is complete, so incomplete uploads are never ingested. Decompression is bounded:
+    the output is produced in chunks of CHUNK_SIZE and the upload is rejected once it exceeds MAX_TRIAL_SIZE.
+    """
+
+    def __init__(self, folder: str, filename: str, encoding: Optional[str] = None):
+        """
+        :param folder: Folder the trial is written to
+        :param filename: Name of the uploaded file, e.g. trial_1.csv or trial_1.csv.gz
+        :param encoding: Compression of the content ("gzip" or "zstd"), derived from the file extension if None
+        """
+        filename = _check_name(os.path.basename(filename.replace('\\', '/')), 'file name')
+        stem, extension = os.path.splitext(filename)
+        if extension.lower() in COMPRESSION_EXTENSIONS:
+            encoding = encoding or COMPRESSION_EXTENSIONS[extension.lower()]
+            filename = stem
+        if os.path.splitext(filename)[1].lower() not in TRIAL_EXTENSIONS:
+            raise ValueError(f'File "{filename}" is not a CSV or TSV trial')
+        if encoding not in (None, '', 'identity', 'gzip', 'x-gzip', 'zstd'):
+            raise ValueError(f'Unsupported compression "{encoding}"')
+        if encoding == 'zstd' and zstandard is None:
+            raise ValueError('zstd compressed uploads need the zstandard package')
+
+        self.filename = filename
+        self.path = os.path.join(folder, filename)
+        self._partial_path = os.path.join(folder, f'.{filename}.part')
+        self._file = _LimitedFile(self._partial_path, filename)
+        self._gzip = self._zstd = None
+        if encoding in ('gzip', 'x-gzip'):
+            # gzip header detection also accepts zlib streams
+            self._gzip = zlib.decompressobj(wbits=47)
+        elif encoding == 'zstd':
+            self._zstd = zstandard.ZstdDecompressor().stream_writer(self._file, write_size=CHUNK_SIZE, closefd=False)
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        try:
+            if self._gzip is not None:
+                self._inflate(data)
+            elif self._zstd is not None:
+                self._zstd.write(data)
+            else:
+                self._file.write(data)
+        except DECOMPRESSION_ERRORS as e:
+            raise ValueError(f'File "{self.filename}" is not validly compressed: {e}') from e
+
+    def _inflate(self, data: bytes) -> None:
+        # Decompress at most CHUNK_SIZE bytes at a time, so the size limit applies before the output is in memory
+        while True:
+            if self._gzip.eof:
+                # A gzip file can have several members (e.g. written by pigz or appended to), which are decompressed
+                # one after the other. Anything else after a member is rejected as an invalid header
+                data = self._gzip.unused_data + data
+                if not data:
+                    return
+                self._gzip = zlib.decompressobj(wbits=47)
+            chunk = self._gzip.decompress(data, CHUNK_SIZE)
+            self._file.write(chunk)
+            if self._gzip.eof:
+                # The input after the end of the member is in unused_data (and also left in unconsumed_tail)
+                data = b''
+                continue
+            data = self._gzip.unconsumed_tail
+            if not data and len(chunk) < CHUNK_SIZE:
+                return
+
+    def close(self) -> str:
+        """
+        Finish the file and move it to its final name.
+
+        :return: Path of the trial file
+        """
+        if self._gzip is not None and not self._gzip.eof:
+            raise ValueError(f'File "{self.filename}" is truncated')
+        if self._zstd is not None:
+            self._zstd.flush()
+        self._file.close()
+        os.replace(self._partial_path, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        self._file.close()
+        if os.path.exists(self._partial_path):
+            os.remove(self._partial_path)
+
+
+class _Upload:
+    """
+    Upload of trials to one group: every file is preprocessed in the executor as soon as it is completely received,
+    while the rest of the upload is still streaming in. The files are staged in a folder of their own and only moved
+    to the input and output folders of the group once every file of the upload is preprocessed, so a failing file
+    leaves no trials of the upload behind.
+    """
+
+    def __init__(self, group_name: str, executor: ThreadPoolExecutor):
+        self.group_name = group_name
+        self.folder = os.path.join(Group.input_folder, group_name)
+        self.output_folder = os.path.join(Group.output_folder, group_name)
+        # Staged next to the input folder (not in it, where the folder would be taken for a group), with the group
+        # name as last folder, like the files of the group
+        self._staging = os.path.join(os.path.dirname(os.path.normpath(Group.input_folder)), '.uploads',
+                                     uuid.uuid4().hex)
+        self._staging_folder = os.path.join(self._staging, 'input', group_name)
+        self._staging_output_folder = os.path.join(self._staging, 'output', group_name)
+        for folder in (self.folder, self.output_folder, self._staging_folder, self._staging_output_folder):
+            os.makedirs(folder, exist_ok=True)
+        self._executor = executor
+        self.trials: Dict[str, Future] = {}
+
+    def add_file(self, filename: str, chunks: Iterator[bytes], encoding: Optional[str] = None) -> None:
+        writer = _TrialWriter(self._staging_folder, filename, encoding)
+        if writer.filename in self.trials:
+            writer.abort()
+            raise ValueError(f'File "{writer.filename}" is uploaded more than once')
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+            path = writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+        metrics.BYTES_PROCESSED.labels(stage='upload', group=self.group_name).inc(writer.size)
+
+        output_path = os.path.join(self._staging_output_folder, os.path.splitext(writer.filename)[0] + '.csv')
+        # The trace context is copied, so the preprocessing spans are children of the upload
+        context = contextvars.copy_context()
+        self.trials[writer.filename] = self._executor.submit(context.run, Trial, path, output_path)
+
+    def trial_objects(self, previous: Optional[Group]) -> List[Trial]:
+        """
+        Wait for the uploaded trials, move them to the group and combine them with the other trials of the group.
+        Trials of the previous version of the group are reused, trial files that are new in the input folder are
+        preprocessed.
+
+        :param previous: Previous version of the group, None if the group is new
+        :return: All trials of the group
+        """
+        uploaded, errors = {}, []
+        for filename, future in self.trials.items():
+            try:
+                uploaded[filename] = future.result()
+            except Exception as e:
+                errors.append(f'{filename}: {e}')
+        if errors:
+            raise ValueError(f'Preprocessing uploaded trials failed: {"; ".join(errors)}')
+
+        # Every file of the upload is valid, move the raw and preprocessed files to the group
+        for filename, trial in list(uploaded.items()):
+            raw_path = os.path.join(self.folder, filename)
+            preprocessed_path = os.path.join(self.output_folder, os.path.basename(trial.preprocessed_file_path))
+            os.replace(trial.raw_file_path, raw_path)
+            os.replace(trial.preprocessed_file_path, preprocessed_path)
+            trial.raw_file_path, trial.preprocessed_file_path = raw_path, preprocessed_path
+            uploaded[raw_path] = uploaded.pop(filename)
+
+        existing = {trial.raw_file_path: trial for trial in previous.trials} if previous is not None else {}
+        trials = []
+        for input_path, output_path in Group.trial_paths(self.group_name):
+            trial = uploaded.get(input_path) or existing.get(input_path)
+            trials.append(trial if trial is not None else Trial(input_path, output_path))
+        return trials
+
+    def close(self) -> None:
+        """
+        Remove the staging folder with the files of the upload that were not moved to the group. Preprocessing that
+        is still running is waited for, so it does not write into the removed folder.
+        """
+        for future in self.trials.values():
+            future.cancel()
+        wait(self.trials.values())
+        shutil.rmtree(self._staging, ignore_errors=True)
+
+
+class UploadService:
+    """
+    Service ingesting trials uploaded as multipart/form-data (many files) or as a single (chunked) request body. The
+    upload is streamed to a staging folder, optionally decompressing gzip or zstd, and every trial is preprocessed as
+    soon as it is received. Uploads are all or nothing: the trials are only moved to the group when all are valid.
+    Once the upload is complete, only the group level steps (aggregation, summaries, plots) are left before the group
+    is replaced in the GroupService.
+    """
+    _lock: threading.Lock
+    _group_locks: Dict[str, threading.Lock]
+
+    def __init__(self, group_service: GroupService, workers: Optional[int] = None):
+        """
+        :param group_service: Service the uploaded groups are added to
+        :param workers: Number of threads preprocessing uploaded trials
+        """
+        self._group_service = group_service
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                            thread_name_prefix='upload')
+        self._lock = threading.Lock()
+        self._group_locks = {}
+
+    def _group_lock(self, group_name: str) -> threading.Lock:
+        # Uploads to the same group are processed one at a time, uploads to different groups concurrently
+        with self._lock:
+            return self._group_locks.setdefault(group_name.lower(), threading.Lock())
+
+    def upload_multipart(self, group_name: str, stream: BinaryIO, boundary: str,
+                         profile: Optional[bool] = None) -> Group:
+        """
+        Ingest the files of a multipart/form-data upload. Form fields without a file name are ignored.
+
+        :param group_name: Name of the group, created if it does not exist
+        :param stream: Request body
+        :param boundary: Multipart boundary from the Content-Type header
+        :param profile: Whether to profile the upload, tracing.PROFILE_JOBS if None
+        :return: The ingested group
+        """
+        with self._group_lock(_check_name(group_name, 'group name')), \
+                tracing.job('upload', profile, group=group_name) as job:
+            upload = _Upload(group_name, self._executor)
+            try:
+                for filename, chunks in self._multipart_files(stream, boundary):
+                    upload.add_file(filename, chunks)
+                if not upload.trials:
+                    raise ValueError('The upload contains no files')
+                job.attributes['files'] = len(upload.trials)
+                return self._finish(upload)
+            finally:
+                upload.close()
+
+    def upload_file(self, group_name: str, filename: str, stream: BinaryIO, encoding: Optional[str] = None,
+                    profile: Optional[bool] = None) -> Group:
+        """
+        Ingest a single trial file sent as request body.
+
+        :param group_name: Name of the group, created if it does not exist
+        :param filename: Name of the trial file
+        :param stream: Request body
+        :param encoding: Content-Encoding of the body, or None to derive it from the file name
+        :param profile: Whether to profile the upload, tracing.PROFILE_JOBS if None
+        :return: The ingested group
+        """
+        with self._group_lock(_check_name(group_name, 'group name')), \
+                tracing.job('upload', profile, group=group_name, files=1):
+            upload = _Upload(group_name, self._executor)
+            try:
+                upload.add_file(filename, iter(lambda: stream.read(CHUNK_SIZE), b''), encoding)
+                return self._finish(upload)
+            finally:
+                upload.close()
+
+    def _finish(self, upload: _Upload) -> Group:
+        trials = upload.trial_objects(self._group_service.find_group(upload.group_name))
+        return self._group_service.add_group(upload.group_name, profile=False, trials=trials)
+
+    @staticmethod
+    def _multipart_files(stream: BinaryIO, boundary: str) -> Iterator:
+        """
+        Parse a multipart body while it is received.
+
+        :param stream: Request body
+        :param boundary: Multipart boundary
+        :return: Iterator of (file name, iterator of content chunks) per file, every chunk iterator must be consumed
+                 before advancing to the next file
+        """
+        decoder = MultipartDecoder(boundary.encode())
+        complete = False
+
+        def events() -> Iterator:
+            nonlocal complete
+            while True:
+                event = decoder.next_event()
+                if isinstance(event, NeedData):
+                    if complete:
+                        raise ValueError('Incomplete multipart upload')
+                    chunk = stream.read(CHUNK_SIZE)
+                    complete = not chunk
+                    decoder.receive_data(chunk or None)
+                    continue
+                if isinstance(event, Epilogue):
+                    return
+                yield event
+
+        iterator = events()
+
+        def file_chunks() -> Iterator[bytes]:
+            while True:
+                event = next(iterator)
+                if isinstance(event, Data):
+                    if event.data:
+                        yield event.data
+                    if not event.more_data:
+                        return
+
+        for event in iterator:
+            if isinstance(event, File) and event.filename:
+                yield event.filename, file_chunks()
+            # Fields and their data are skipped
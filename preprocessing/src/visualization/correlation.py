@@ -0,0 +1,225 @@
+import json
+import os
+from typing import List, Dict, Any
+
+import pandas as pd
+import seaborn as sns
+from matplotlib.figure import Figure
+
+import artifacts
+import tracing
+from analysis import correlation
+from models.group import Group
+from models.types.measurement_type import MeasurementType
+from visualization.templating import GROUP_VARIABLE, repeat_row
+
+# Measurement types of the correlation heatmaps of a group -> level of the correlations (see analysis.correlation)
+CORRELATION_LEVELS = {
+    MeasurementType.CORRELATION_SAMPLES: 'samples',
+    MeasurementType.CORRELATION_TRIALS: 'trials'
+}
+
+
+class Correlation:
+    """
+    Class for generating correlation heatmaps of a group and of the difference between two groups. The heatmaps
+    are rendered as images, like the violin plots, as Grafana has no panel for a matrix with named rows and columns.
+    """
+
+    @staticmethod
+    @tracing.traced('generate_panels')
+    def generate_panels(experiment_name: str, groups: List[Group], measurement_types: List[MeasurementType],
+                        y_pos: int = 0) -> List[Dict[str, Any]]:
+        """
+        Generate a Pearson and a Spearman heatmap per group for CORRELATION_SAMPLES and CORRELATION_TRIALS.
+
+        :param experiment_name: Name of the experiment
+        :param groups: List of groups to visualize
+        :param measurement_types: List of measurement types to visualize
+        :param y_pos: Starting vertical position for panels
+        :return: List of panel configurations
+        """
+        panels = []
+        for measurement_type in measurement_types:
+            if measurement_type not in CORRELATION_LEVELS:
+                continue
+            level = CORRELATION_LEVELS[measurement_type]
+            for group in groups:
+                Correlation.render_group_heatmaps(group, level)
+                panels.append(Correlation._create_row_panel(f'{group.name} - {measurement_type.name}', y_pos))
+                y_pos += 1
+                y_pos = Correlation._add_method_panels(panels, group.name, group.name, level, y_pos)
+        return panels
+
+    @staticmethod
+    @tracing.traced('generate_panels')
+    def generate_templated_panels(experiment_name: str, groups: List[Group], measurement_types: List[MeasurementType],
+                                  y_pos: int = 0) -> List[Dict[str, Any]]:
+        """
+        Generate heatmap panels that repeat over the group dashboard variable. The heatmaps of all groups are
+        rendered, as any of them can be selected.
+
+        :param experiment_name: Name of the experiment
+        :param groups: List of groups to visualize (provided through the group variable)
+        :param measurement_types: List of measurement types to visualize
+        :param y_pos: Starting vertical position for panels
+        :return: List of panel configurations
+        """
+        panels = []
+        for measurement_type in measurement_types:
+            if measurement_type not in CORRELATION_LEVELS:
+                continue
+            level = CORRELATION_LEVELS[measurement_type]
+            for group in groups:
+                Correlation.render_group_heatmaps(group, level)
+            row_panel = Correlation._create_row_panel(f'{GROUP_VARIABLE} - {measurement_type.name}', y_pos)
+            panels.append(repeat_row(row_panel, "group"))
+            y_pos += 1
+            y_pos = Correlation._add_method_panels(panels, GROUP_VARIABLE, GROUP_VARIABLE, level, y_pos)
+        return panels
+
+    @staticmethod
+    def generate_comparison_panels(group0: Group, group1: Group, y_pos: int) -> List[Dict[str, Any]]:
+        """
+        Compare the correlations of two groups: save correlation_comparison.csv in the comparison folder and
+        generate heatmaps of the differences (second group minus first group) on both levels.
+
+        :param group0: First group
+        :param group1: Second group
+        :param y_pos: Starting vertical position for panels
+        :return: List of panel configurations
+        """
+        comparison_group = f"{group0.name}_vs_{group1.name}"
+        comparison = Correlation.generate_comparison_file(group0, group1)
+
+        panels = []
+        for level in correlation.LEVELS:
+            for method in correlation.METHODS:
+                Correlation.render_heatmap(
+                    correlation.matrix(comparison, level, method, 'Difference'),
+                    f"{method.capitalize()} correlation difference ({level}) - {group1.name} minus {group0.name}",
+                    os.path.join(Group.image_output_folder, comparison_group,
+                                 Correlation.heatmap_filename(level, method, 'difference')),
+                    limit=2.0)
+            y_pos = Correlation._add_method_panels(panels, comparison_group, comparison_group, level, y_pos,
+                                                   'difference')
+        return panels
+
+    @staticmethod
+    def generate_comparison_file(group0: Group, group1: Group) -> pd.DataFrame:
+        """
+        :param group0: First group
+        :param group1: Second group
+        :return: Comparison of the correlations of the groups (see analysis.correlation.compare), also saved as
+                 correlation_comparison.csv in the comparison folder
+        """
+        comparison = correlation.compare(group0.correlations, group1.correlations, group0.name, group1.name,
+                                         len(group0.aggregated_trials()), len(group1.aggregated_trials()))
+        output_dir = os.path.join(Group.output_folder, f"{group0.name}_vs_{group1.name}")
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, correlation.COMPARISON_FILE)
+        comparison.to_csv(output_path, index=False)
+        artifacts.publish(output_path)
+        return comparison
+
+    @staticmethod
+    def heatmap_filename(level: str, method: str, kind: str = 'correlation') -> str:
+        return f"{kind}_{level}_{method}_heatmap.png"
+
+    @staticmethod
+    def render_group_heatmaps(group: Group, level: str) -> None:
+        """
+        Render the heatmaps of both methods of a level of a group into the image folder of the group.
+
+        :param group: The group
+        :param level: Level of the correlations
+        """
+        for method in correlation.METHODS:
+            Correlation.render_heatmap(
+                correlation.matrix(group.correlations, level, method),
+                f"{method.capitalize()} correlation ({level}) - {group.name}",
+                os.path.join(Group.image_output_folder, group.name, Correlation.heatmap_filename(level, method)))
+
+    @staticmethod
+    def render_heatmap(matrix: pd.DataFrame, title: str, output_path: str, limit: float = 1.0) -> None:
+        """
+        Render a correlation matrix as a heatmap with a diverging color scale centred at 0.
+
+        :param matrix: Square matrix with the names of the columns as index and columns
+        :param title: Title of the plot
+        :param output_path: Path of the PNG image
+        :param limit: Largest absolute value of the color scale
+        """
+        with tracing.stage('plot_render', os.path.basename(os.path.dirname(output_path))):
+            # The figure grows with the number of columns, so the labels stay readable
+            size = max(8.0, 0.22 * len(matrix) + 3)
+            # A figure per plot instead of the global pyplot state, so plots can be rendered from several threads
+            figure = Figure(figsize=(size + 1.5, size))
+            ax = figure.subplots()
+            sns.heatmap(matrix, vmin=-limit, vmax=limit, center=0, cmap="vlag", square=True, ax=ax,
+                        xticklabels=True, yticklabels=True, cbar_kws={"shrink": 0.6})
+            ax.set_title(title)
+            ax.set_xlabel("")
+            ax.set_ylabel("")
+            ax.tick_params(labelsize=7)
+            figure.tight_layout()
+
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            figure.savefig(output_path)
+            artifacts.publish(output_path)
+
+    @staticmethod
+    def _add_method_panels(panels: List[Dict[str, Any]], group_name: str, title_name: str, level: str, y_pos: int,
+                           kind: str = 'correlation') -> int:
+        """
+        Add the heatmap panels of both methods of a level side by side.
+
+        :return: Vertical position below the panels
+        """
+        x_pos = 0
+        for method in correlation.METHODS:
+            panel = Correlation._create_image_panel(
+                group_name, Correlation.heatmap_filename(level, method, kind),
+                f"{title_name} - {method.capitalize()} {kind.capitalize()} ({level})", x_pos, y_pos)
+            panels.append(panel)
+            x_pos += panel["gridPos"]["w"]
+        return y_pos + panels[-1]["gridPos"]["h"]
+
+    @staticmethod
+    def _create_image_panel(group_name: str, image_filename: str, title: str, x_pos: int,
+                            y_pos: int) -> Dict[str, Any]:
+        """
+        Loads and customizes an image panel from the image_panel_template.json file.
+        """
+        with open("csv-data/grafana-templates/image_panel_template.json", "r") as f:
+            template = json.load(f)
+
+        template["title"] = title
+        template["gridPos"]["w"] = 12
+        template["gridPos"]["h"] = 14
+        template["gridPos"]["x"] = x_pos
+        template["gridPos"]["y"] = y_pos
+
+        # Version the image with its content hash
+        digest = artifacts.version(os.path.join(Group.image_output_folder, group_name, image_filename))
+        if digest is not None:
+            image_filename = f"{image_filename}?v={digest}"
+        for element in template["options"].get("elements", []):
+            if "url" in element:
+                element["url"] = element["url"].replace("PLACEHOLDER_GROUPNAME", group_name).replace(
+                    "PLACEHOLDER_IMAGEFILENAME", image_filename)
+
+        root_image = template["options"]["root"]["background"]["image"]
+        root_image["fixed"] = root_image["fixed"].replace("PLACEHOLDER_GROUPNAME", group_name).replace(
+            "PLACEHOLDER_IMAGEFILENAME", image_filename)
+
+        return template
+
+    @staticmethod
+    def _create_row_panel(title: str, y_pos: int) -> Dict[str, Any]:
+        with open("csv-data/grafana-templates/row_panel_template.json", "r") as f:
+            template = json.load(f)
+        template["title"] = title
+        template["gridPos"]["y"] = y_pos
+        template["panels"] = []
+        return template
@@ -0,0 +1,201 @@
+import os
+from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any, Tuple, Union
+from urllib.parse import urlencode
+
+import artifacts
+from downsampling import read_levels, select_static_factor, level_path
+from models.group import Group
+
+# Base URL of the Flask data API as seen from Grafana (e.g. http://flask:5000/api/data).
+# When not set, panels download the CSV files (or a downsampled level of them) from nginx.
+DATA_API_URL = os.environ.get('DATA_API_URL', '')
+
+# Where panels get aggregate data from: "csv" (Infinity datasource on CSV files or the data API) or "postgres"
+# (SQL queries on the tables the DatabaseService loads)
+PANEL_DATA_SOURCE = os.environ.get('PANEL_DATA_SOURCE', 'csv')
+
+# Grafana datasource provisioned for the PostgreSQL database
+POSTGRES_DATASOURCE = {"type": "grafana-postgresql-datasource", "uid": "energibridge-postgres"}
+
+# Points requested per horizontal grid unit of a panel (a dashboard is 24 units wide)
+POINTS_PER_GRID_UNIT = 150
+
+# Grafana variables with the start and end of the time range of the dashboard in ms, interpolated in URLs and SQL
+TIME_FROM = '${__from}'
+TIME_TO = '${__to}'
+
+
+def max_points_for_width(width: int) -> int:
+    """
+    Number of points worth drawing in a panel of the given width.
+
+    :param width: Panel width in Grafana grid units
+    :return: Maximum number of points
+    """
+    return width * POINTS_PER_GRID_UNIT
+
+
+def dashboard_time_range(groups: List[Group]) -> Dict[str, str]:
+    """
+    Time range of a dashboard that shows all samples of the groups. Time is in ms since the start of the trials,
+    which Grafana shows as time since the epoch.
+
+    :param groups: Groups of the dashboard
+    :return: Time range for the "time" of the dashboard
+    """
+    end = max((float(group.aggregate_data['Time'].max()) for group in groups), default=0.0)
+
+    def iso(ms: float) -> str:
+        return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat(timespec='milliseconds').replace(
+            '+00:00', 'Z')
+
+    return {"from": iso(0), "to": iso(end)}
+
+
+def static_url(path: str, base_url: str = "http://nginx") -> str:
+    """
+    URL of an artifact served by nginx, versioned with its content hash so it can be cached until it changes.
+
+    :param path: Path of the artifact relative to the working directory (e.g. csv-data/output/...)
+    :param base_url: Base URL of nginx as seen by the client
+    :return: URL of the artifact
+    """
+    digest = artifacts.version(path)
+    return f"{base_url}/{path}" if digest is None else f"{base_url}/{path}?v={digest}"
+
+
+def aggregate_url(group_name: str, columns: List[str], file_name: str = 'aggregate_data',
+                  max_points: Optional[int] = None) -> str:
+    """
+    URL a panel target uses to load aggregate data of a group (or comparison folder such as "a_vs_b").
+    Targets the data API when DATA_API_URL is configured, so only the selected columns and the points in the time
+    range of the dashboard are transferred, otherwise the CSV file served by nginx, using the pyramid level that fits
+    max_points.
+
+    :param group_name: Name of the group or comparison folder in the output folder
+    :param columns: Columns the panel selects (Time is always included)
+    :param file_name: Name of the aggregate file without extension (aggregate_data or aggregate_summary)
+    :param max_points: Maximum number of points, None to load all points
+    :return: URL for the Infinity datasource
+    """
+    path = os.path.join(Group.output_folder, group_name, f"{file_name}.csv")
+    if not DATA_API_URL:
+        # Without the data API, pick the pyramid level of the file that fits the number of points
+        rows, factors = read_levels(path)
+        return static_url(level_path(path, select_static_factor(rows, max_points, factors)))
+
+    params = [('group', group_name), ('file', file_name),
+              ('columns', ','.join(column for column in columns if column != 'Time'))]
+    # The data API slices the time range of the dashboard, so zooming in loads finer points
+    params += [('from', TIME_FROM), ('to', TIME_TO)]
+    if max_points:
+        params.append(('max_points', str(max_points)))
+    digest = artifacts.version(path)
+    if digest is not None:
+        params.append(('v', digest))
+    # Keep dashboard variables such as ${group} intact, Grafana interpolates them
+    return f"{DATA_API_URL}?{urlencode(params, safe='${}')}"
+
+
+def _sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _sql_reduction(statistic: str) -> str:
+    # Same reductions as downsampling.reduce_buckets: keep the extremes of the bands visible
+    if statistic in ("max", "UQ"):
+        return "max"
+    if statistic in ("min", "LQ"):
+        return "min"
+    return "avg"
+
+
+def _sql_time(value: Union[int, str]) -> str:
+    # Grafana interpolates its time range variables before the query runs
+    return value if value in (TIME_FROM, TIME_TO) else str(int(value))
+
+
+def aggregate_sql(series: List[Tuple[str, str, str, str]], max_points: Optional[int] = None,
+                  start: Optional[Union[int, str]] = None, end: Optional[Union[int, str]] = None) -> str:
+    """
+    SQL query on the aggregates table returning one column per series next to Time, filtered by group and time range
+    and reduced to at most max_points time buckets by the database.
+
+    :param series: (group name, metric, statistic, column alias) for every series to return
+    :param max_points: Maximum number of points, None to return all points
+    :param start: Start of the time range in ms (inclusive) or TIME_FROM, None for the start of the data
+    :param end: End of the time range in ms (inclusive) or TIME_TO, None for the end of the data
+    :return: SQL query
+    """
+    groups = sorted({group_name for group_name, _, _, _ in series})
+    conditions = [
+        f"group_name IN ({', '.join(_sql_string(group_name) for group_name in groups)})",
+        " OR ".join(f"(metric = {_sql_string(metric)} AND statistic = {_sql_string(statistic)})"
+                    for metric, statistic in sorted({(metric, statistic) for _, metric, statistic, _ in series}))
+    ]
+    if start is not None:
+        conditions.append(f"time_ms >= {_sql_time(start)}")
+    if end is not None:
+        conditions.append(f"time_ms <= {_sql_time(end)}")
+    where = " AND ".join(f"({condition})" for condition in conditions)
+
+    if max_points:
+        # Bucket width so that the selected time span gives at most max_points buckets
+        time = "bounds.first_ms + (time_ms - bounds.first_ms) / bounds.bucket_ms * bounds.bucket_ms"
+        source = (f"selected CROSS JOIN (SELECT min(time_ms) AS first_ms, "
+                  f"(max(time_ms) - min(time_ms)) / {int(max_points)} + 1 AS bucket_ms FROM selected) AS bounds")
+    else:
+        time, source = "time_ms", "selected"
+
+    columns = [f'{time} AS "Time"']
+    for group_name, metric, statistic, alias in series:
+        quoted_alias = '"' + alias.replace('"', '""') + '"'
+        columns.append(
+            f"{_sql_reduction(statistic)}(value) FILTER (WHERE group_name = {_sql_string(group_name)} "
+            f"AND metric = {_sql_string(metric)} AND statistic = {_sql_string(statistic)}) AS {quoted_alias}")
+    return (f"WITH selected AS (SELECT group_name, metric, statistic, time_ms, value FROM aggregates WHERE {where}) "
+            f"SELECT {', '.join(columns)} FROM {source} GROUP BY 1 ORDER BY 1")
+
+
+def set_aggregate_target(panel: Dict[str, Any], group_name: str, columns: List[Dict[str, str]],
+                         file_name: str = 'aggregate_data', max_points: Optional[int] = None,
+                         series: Optional[List[Tuple[str, str, str, str]]] = None) -> None:
+    """
+    Point the target of a panel at aggregate data of a group: an Infinity target loading aggregate_url, or a SQL
+    target on the database when PANEL_DATA_SOURCE is "postgres". Both are filtered by the time range of the dashboard
+    on the server.
+
+    :param panel: Panel configuration with one target
+    :param group_name: Name of the group or comparison folder in the output folder
+    :param columns: Infinity column configurations (selector, text, type) the panel shows
+    :param file_name: Name of the aggregate file without extension (aggregate_data or aggregate_summary)
+    :param max_points: Maximum number of points, None to load all points
+    :param series: (group name, metric, statistic, column alias) of the columns for the SQL target, derived from
+                   the "<metric>_<statistic>" selectors of aggregate_data when not given
+    """
+    if PANEL_DATA_SOURCE != 'postgres':
+        panel["targets"][0]["columns"] = columns
+        panel["targets"][0]["url"] = aggregate_url(group_name, [column["selector"] for column in columns],
+                                                   file_name=file_name, max_points=max_points)
+        panel["targets"][0]["source"] = "url"
+        panel["targets"][0]["type"] = "csv"
+        return
+
+    if series is None:
+        series = [(group_name, *column["selector"].rsplit("_", 1), column["text"])
+                  for column in columns if column["selector"] != "Time"]
+    panel["datasource"] = POSTGRES_DATASOURCE
+    panel["targets"] = [{
+        "datasource": POSTGRES_DATASOURCE,
+        "refId": "A",
+        "format": "table",
+        "editorMode": "code",
+        "rawQuery": True,
+        "rawSql": aggregate_sql(series, max_points, start=TIME_FROM, end=TIME_TO)
+    }]
+    # Time is returned in ms, as in the CSV files
+    panel.setdefault("transformations", []).append({
+        "id": "convertFieldType",
+        "options": {"conversions": [{"targetField": "Time", "destinationType": "time"}], "fields": {}}
+    })
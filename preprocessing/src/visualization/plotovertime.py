@@ -2,6 +2,9 @@ import json
 from typing import List, Dict, Any
 from models.types.measurement_type import MeasurementType
 from models.group import Group
+from visualization.data_source import set_aggregate_target, max_points_for_width
+from visualization.templating import GROUP_VARIABLE, CORE_VARIABLE, LOGICAL_VARIABLE, repeat, repeat_row
+import tracing
 
 
 class PlotOverTime:
@@ -10,6 +13,7 @@ class PlotOverTime:
     """
     
     @staticmethod
+    @tracing.traced('generate_panels')
     def generate_panels(experiment_name: str, groups: List[Group], measurement_types: List[MeasurementType], y_pos: int = 0) -> List[Dict[str, Any]]:
         """
         Generate visualization panels for plot over time experiment type.
@@ -37,6 +41,24 @@ class PlotOverTime:
                     panels.extend(stat_panels)
                     y_pos += 4  # Stat panels are smaller
             
+            # A panel per derived per-sample metric of every group
+            elif measurement_type == MeasurementType.DERIVED:
+                for group in groups:
+                    for column in group.derived_columns:
+                        panel = PlotOverTime._create_derived_panel(column, group.name, y_pos)
+                        panels.append(panel)
+                        y_pos += panel["gridPos"]["h"]
+
+            # Only groups whose core energy could be attributed to their logical processors have their power
+            elif measurement_type == MeasurementType.LOGICAL_POWER:
+                for group in groups:
+                    if not group.attributed_columns:
+                        continue
+                    panel = PlotOverTime._create_standard_panel(
+                        measurement_type, group.name, y_pos, group.no_logical)
+                    panels.append(panel)
+                    y_pos += panel["gridPos"]["h"]
+
             # Use specialized panel generators based on measurement type
             elif measurement_type in [MeasurementType.CORE_POWER, MeasurementType.CORE_VOLTAGE]:
                 for group in groups:
@@ -49,7 +71,7 @@ class PlotOverTime:
             else:
                 for group in groups:
                     panel = PlotOverTime._create_standard_panel(
-                        measurement_type, group.name, y_pos)
+                        measurement_type, group.name, y_pos, group.no_logical)
                     panels.append(panel)
                     y_pos += panel["gridPos"]["h"]
 
@@ -65,6 +87,53 @@ class PlotOverTime:
                     
         return panels
 
+    @staticmethod
+    @tracing.traced('generate_panels')
+    def generate_templated_panels(experiment_name: str, groups: List[Group], measurement_types: List[MeasurementType],
+                                  y_pos: int = 0) -> List[Dict[str, Any]]:
+        """
+        Generate panels for plot over time that repeat over the group, core and logical processor dashboard
+        variables, so the number of panels does not depend on the number of groups and cores.
+
+        :param experiment_name: Name of the experiment
+        :param groups: List of groups to visualize (provided through the group variable)
+        :param measurement_types: List of measurement types to visualize
+        :param y_pos: Starting vertical position for panels
+        :return: List of panel configurations
+        """
+        panels = []
+
+        for measurement_type in measurement_types:
+            # Skip ALL type as it's too broad for visualization
+            if measurement_type == MeasurementType.ALL:
+                continue
+            row_panel = PlotOverTime._create_row_panel(
+                f'{GROUP_VARIABLE} - {measurement_type.name.replace("_", " ")}', y_pos)
+            panels.append(repeat_row(row_panel, "group"))
+            y_pos += 1
+
+            if measurement_type == MeasurementType.DERIVED:
+                # The derived metrics of all groups, groups without a metric show an empty panel
+                columns = list(dict.fromkeys(column for group in groups for column in group.derived_columns))
+                for column in columns:
+                    panel = PlotOverTime._create_derived_panel(column, GROUP_VARIABLE, y_pos)
+                    panel["gridPos"]["w"] = 24
+                    panels.append(panel)
+                    y_pos += panel["gridPos"]["h"]
+                continue
+            elif measurement_type in [MeasurementType.CORE_POWER, MeasurementType.CORE_VOLTAGE]:
+                panel = PlotOverTime._create_repeated_core_panel(measurement_type, "core", CORE_VARIABLE, "Core", y_pos)
+            elif measurement_type in [MeasurementType.CPU_USAGE_LOGICAL, MeasurementType.LOGICAL_POWER]:
+                panel = PlotOverTime._create_repeated_core_panel(measurement_type, "logical", LOGICAL_VARIABLE, "LP",
+                                                                 y_pos)
+            else:
+                panel = PlotOverTime._create_standard_panel(measurement_type, GROUP_VARIABLE, y_pos)
+                panel["gridPos"]["w"] = 24
+            panels.append(panel)
+            y_pos += panel["gridPos"]["h"]
+
+        return panels
+
     @staticmethod
     def _load_template_with_placeholders(template_name: str, placeholders: Dict[str, str]) -> Dict[str, Any]:
         """
@@ -111,11 +180,11 @@ class PlotOverTime:
             panel["gridPos"]["y"] = y_pos
             
             # Configure column to display
-            panel["targets"][0]["columns"] = [{
+            set_aggregate_target(panel, group_name, [{
                 "selector": column_name,
                 "text": title,
                 "type": "number"
-            }]
+            }])
             
             if stat == "std":
                 panel["title"] = f"{str(measurement_type)} StdDev"
@@ -171,8 +240,7 @@ class PlotOverTime:
         })
             
         # Add columns for each core
-        core_count = 8  # Based on provided CSV header
-        for i in range(core_count):
+        for i in range(group.no_cores):
             col_name = measurement_type.get_full_column_name(core_num=i, statistic="median")
             columns.append({
                 "selector": col_name,
@@ -181,16 +249,56 @@ class PlotOverTime:
             })
         
         # Update the target columns in the panel and ensure URL is set
-        panel["targets"][0]["columns"] = columns
-        panel["targets"][0]["url"] = f"http://nginx/csv-data/output/{group.name}/aggregate_data.csv"
-        panel["targets"][0]["source"] = "url"
-        panel["targets"][0]["type"] = "csv"
+        set_aggregate_target(panel, group.name, columns,
+                             max_points=max_points_for_width(panel["gridPos"]["w"]))
         
         return panel
     
+    @staticmethod
+    def _create_repeated_core_panel(measurement_type: MeasurementType, variable: str, variable_value: str,
+                                    label: str, y_pos: int) -> Dict[str, Any]:
+        """
+        Generate a panel for one core (or logical processor) of the group in the group variable, repeated for every
+        value of the core (or logical processor) variable.
+
+        :param measurement_type: The per-core or per-logical-processor measurement type
+        :param variable: Name of the variable to repeat over (without $)
+        :param variable_value: Reference to the variable used in column names (e.g. ${core})
+        :param label: Label of a single core in the panel title
+        :param y_pos: Vertical position on the dashboard
+        :return: Panel configuration dictionary for Grafana
+        """
+        metric_name = str(measurement_type).replace("CORE_", "")
+        panel = PlotOverTime._load_template_with_placeholders("panel_template.json", {
+            "MEASUREMENTTYPE": str(measurement_type),
+            "GROUPNAME": GROUP_VARIABLE
+        })
+        panel["title"] = f"{GROUP_VARIABLE} - {label} {variable_value} {metric_name}"
+        panel["gridPos"]["y"] = y_pos
+        panel["gridPos"]["w"] = 6
+        if measurement_type.unit:
+            panel["fieldConfig"]["defaults"]["unit"] = measurement_type.unit
+
+        columns = [{
+            "selector": "Time",
+            "text": "Time (s)",
+            "type": "timestamp_epoch",
+            "format": "unixtimestampms"
+        }]
+        for stat, text in [("median", "Median"), ("LQ", "Lower Quartile"), ("UQ", "Upper Quartile")]:
+            columns.append({
+                "selector": measurement_type.get_full_column_name(core_num=variable_value, statistic=stat),
+                "text": f"{label} {variable_value} ({text})",
+                "type": "number"
+            })
+
+        set_aggregate_target(panel, GROUP_VARIABLE, columns,
+                             max_points=max_points_for_width(panel["gridPos"]["w"]))
+        return repeat(panel, variable)
+
     @staticmethod
     def _create_standard_panel(measurement_type: MeasurementType, 
-                              group_name: str, y_pos: int) -> Dict[str, Any]:
+                              group_name: str, y_pos: int, processor_count: int = 0) -> Dict[str, Any]:
         """
         Generate a standard panel for non-core measurements.
         For power measurements (CPU_POWER), also includes quartile data.
@@ -198,6 +306,7 @@ class PlotOverTime:
         :param measurement_type: The measurement type
         :param group_name: Name of the group to visualize
         :param y_pos: Vertical position on the dashboard
+        :param processor_count: Number of logical processors, for per logical processor measurements
         :return: Panel configuration dictionary for Grafana
         """
         # Get panel from template
@@ -257,12 +366,8 @@ class PlotOverTime:
             })
             
             # Update the target columns in the panel
-            panel["targets"][0]["columns"] = columns
-            
-            # Make sure URL is properly set
-            panel["targets"][0]["url"] = f"http://nginx/csv-data/output/{group_name}/aggregate_data.csv"
-            panel["targets"][0]["source"] = "url"
-            panel["targets"][0]["type"] = "csv"
+            set_aggregate_target(panel, group_name, columns,
+                                 max_points=max_points_for_width(panel["gridPos"]["w"]))
                 
             # Add a special tooltip to explain the quartiles
             if "options" not in panel:
@@ -347,7 +452,7 @@ class PlotOverTime:
             ]
 
         # If this is a logical processor measurement type that needs a core number
-        elif measurement_type in [MeasurementType.CPU_USAGE_LOGICAL]:
+        elif measurement_type in [MeasurementType.CPU_USAGE_LOGICAL, MeasurementType.LOGICAL_POWER]:
             # Create a list of columns for each logical processor
             columns = []
             # Add time column with correct format
@@ -359,7 +464,6 @@ class PlotOverTime:
             })
             
             # Add columns for each logical processor
-            processor_count = 16  # Based on typical hyperthreaded 8-core CPU
             for i in range(processor_count):
                 col_name = measurement_type.get_full_column_name(core_num=i, statistic="median")
                 columns.append({
@@ -369,10 +473,8 @@ class PlotOverTime:
                 })
             
             # Update the target columns in the panel
-            panel["targets"][0]["columns"] = columns
-            panel["targets"][0]["url"] = f"http://nginx/csv-data/output/{group_name}/aggregate_data.csv"
-            panel["targets"][0]["source"] = "url"
-            panel["targets"][0]["type"] = "csv"
+            set_aggregate_target(panel, group_name, columns,
+                                 max_points=max_points_for_width(panel["gridPos"]["w"]))
         
         # For other standard measurement types
         else:
@@ -395,13 +497,34 @@ class PlotOverTime:
             })
             
             # Update the target columns in the panel
-            panel["targets"][0]["columns"] = columns
-            panel["targets"][0]["url"] = f"http://nginx/csv-data/output/{group_name}/aggregate_data.csv"
-            panel["targets"][0]["source"] = "url"
-            panel["targets"][0]["type"] = "csv"
+            set_aggregate_target(panel, group_name, columns,
+                                 max_points=max_points_for_width(panel["gridPos"]["w"]))
         
         return panel
 
+    @staticmethod
+    def _create_derived_panel(column: str, group_name: str, y_pos: int) -> Dict[str, Any]:
+        """
+        Generate a panel for a derived per-sample metric, showing its median over the trials.
+
+        :param column: Name of the derived metric
+        :param group_name: Name of the group to visualize
+        :param y_pos: Vertical position on the dashboard
+        :return: Panel configuration dictionary for Grafana
+        """
+        panel = PlotOverTime._load_template_with_placeholders("panel_template.json", {
+            "MEASUREMENTTYPE": column,
+            "GROUPNAME": group_name
+        })
+        panel["title"] = f"{group_name} - {column}"
+        panel["gridPos"]["y"] = y_pos
+        columns = [
+            {"selector": "Time", "text": "Time (s)", "type": "timestamp_epoch", "format": "unixtimestampms"},
+            {"selector": f"{column}_median", "text": column, "type": "number"}
+        ]
+        set_aggregate_target(panel, group_name, columns, max_points=max_points_for_width(panel["gridPos"]["w"]))
+        return panel
+
     @staticmethod
     def _create_row_panel(title: str, y_pos: int, panels: list = []) -> Dict[str, Any]:
         with open("csv-data/grafana-templates/row_panel_template.json", "r") as f:
@@ -6,9 +6,23 @@ import pandas as pd
 import os
 import json
 from scipy.stats import ttest_ind, mannwhitneyu
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import seaborn as sns
 
+import artifacts
+import tracing
+from analysis import outliers, phases
+from visualization.correlation import Correlation
+from visualization.data_source import set_aggregate_target, max_points_for_width, static_url
+
+
+# Measurement types comparing a single phase of the workload -> compared column of trial_summary.csv
+PHASE_COMPARISONS = {
+    MeasurementType[f'COMPARE_{phase.upper()}_{quantity}']: phases.column(phase, column)
+    for phase in phases.PHASES
+    for quantity, column in (('ENERGY', 'Energy (J)'), ('MEAN_POWER', 'Mean_Power (W)'))
+}
+
 
 class SignificanceTest:
     """
@@ -16,6 +30,7 @@ class SignificanceTest:
     """
 
     @staticmethod
+    @tracing.traced('generate_panels')
     def generate_panels(experiment_name: str, groups: List[Group], measurement_types: List[MeasurementType], y_pos: int = 0) -> List[Dict[str, Any]]:
         """
         Generate visualization panels for significance test experiment type.
@@ -32,8 +47,9 @@ class SignificanceTest:
             raise ValueError("Significance test requires exactly two groups.")
         group0 = groups[0]
         group1 = groups[1]
-        SignificanceTest.generate_comparison_file(group0.name, group1.name)
-        SignificanceTest.generate_aggregate_summary_file(group0.name, group1.name)
+        with tracing.stage('comparison', f'{group0.name}_vs_{group1.name}', 'SIGNIFICANCE_TEST'):
+            SignificanceTest.generate_comparison_file(group0.name, group1.name)
+            SignificanceTest.generate_aggregate_summary_file(group0.name, group1.name)
 
 
         x_pos = 0
@@ -47,6 +63,28 @@ class SignificanceTest:
             elif measurement_type == MeasurementType.COMPARE_TOTAL_ENERGY:
                 base_column = "CPU_Total_Energy (J)"
                 title_suffix = "Total Energy"
+            elif measurement_type == MeasurementType.COMPARE_DERIVED:
+                # The derived per-trial metrics both groups have, tested like the built-in trial statistics
+                for base_column in group0.derived_summary.columns.intersection(group1.derived_summary.columns):
+                    panels.append(SignificanceTest.generate_value_diff_panel(
+                        group0.name, group1.name, base_column, x_pos, y_pos
+                    ))
+                    y_pos += 4
+                    panels.append(SignificanceTest.generate_significance_panel(
+                        group0.name, group1.name, base_column, x_pos, y_pos
+                    ))
+                    y_pos += 4
+                continue
+            elif measurement_type == MeasurementType.COMPARE_CORRELATION:
+                # Heatmaps of the differences of the correlation matrices of the groups
+                correlation_panels = Correlation.generate_comparison_panels(group0, group1, y_pos)
+                panels.extend(correlation_panels)
+                y_pos = max([y_pos] + [panel["gridPos"]["y"] + panel["gridPos"]["h"] for panel in correlation_panels])
+                continue
+            elif measurement_type in PHASE_COMPARISONS:
+                # The samples of the test are the values of the phase in every trial, the rest of the run is left out
+                base_column = PHASE_COMPARISONS[measurement_type]
+                title_suffix = base_column
             elif measurement_type == MeasurementType.COMPARE_POWER_OVER_TIME:
                 panels.append(SignificanceTest.create_plot_over_time_2_groups(
                     group0.name, group1.name, y_pos, "CPU_POWER (W)_mean"
@@ -101,10 +139,12 @@ class SignificanceTest:
 
         df0 = pd.read_csv(summary_path0)
         df1 = pd.read_csv(summary_path1)
-        trials0 = pd.read_csv(trials_path0)
-        trials1 = pd.read_csv(trials_path1)
+        # Trials excluded as outliers are not part of the samples
+        trials0 = outliers.included(pd.read_csv(trials_path0))
+        trials1 = outliers.included(pd.read_csv(trials_path1))
 
-        mean_cols = [col for col in df0.columns if col.endswith("_mean")]
+        # Columns only one group has (e.g. derived metrics of columns the other group does not have) are not compared
+        mean_cols = [col for col in df0.columns if col.endswith("_mean") and col in df1.columns]
         comparison_data = {}
 
         for mean_col in mean_cols:
@@ -124,7 +164,10 @@ class SignificanceTest:
             if base_col in trials0.columns and base_col in trials1.columns:
                 sample0 = trials0[base_col].dropna()
                 sample1 = trials1[base_col].dropna()
-                if normal == 1:
+                # A phase can be empty in every trial of a group, then there is nothing to test
+                if len(sample0) == 0 or len(sample1) == 0:
+                    pval = float("nan")
+                elif normal == 1:
                     _, pval = ttest_ind(sample0, sample1, equal_var=False, alternative='two-sided')
                 else:
                     _, pval = mannwhitneyu(sample0, sample1, alternative='two-sided')
@@ -146,6 +189,7 @@ class SignificanceTest:
         os.makedirs(output_dir, exist_ok=True)
         output_path = os.path.join(output_dir, "group_comparison.csv")
         comparison_df.to_csv(output_path, index=False)
+        artifacts.publish(output_path)
         print(f"Comparison file saved to {output_path}")
 
     @staticmethod
@@ -171,6 +215,7 @@ class SignificanceTest:
         os.makedirs(output_dir, exist_ok=True)
         output_path = os.path.join(output_dir, "aggregate_summary.csv")
         combined_df.to_csv(output_path, index=False)
+        artifacts.publish(output_path)
         print(f"Aggregate summary saved to {output_path}")
 
 
@@ -208,7 +253,7 @@ class SignificanceTest:
         ]
 
         panel["targets"][0]["columns"] = columns
-        panel["targets"][0]["url"] = f"http://nginx/csv-data/output/{output_group}/group_comparison.csv"
+        panel["targets"][0]["url"] = static_url(f"csv-data/output/{output_group}/group_comparison.csv")
         panel["targets"][0]["source"] = "url"
         panel["targets"][0]["type"] = "csv"
         panel["transformations"] = []
@@ -241,7 +286,7 @@ class SignificanceTest:
         ]
 
         panel["targets"][0]["columns"] = columns
-        panel["targets"][0]["url"] = f"http://nginx/csv-data/output/{output_group}/group_comparison.csv"
+        panel["targets"][0]["url"] = static_url(f"csv-data/output/{output_group}/group_comparison.csv")
         panel["targets"][0]["source"] = "url"
         panel["targets"][0]["type"] = "csv"
         panel["transformations"] = [
@@ -277,15 +322,18 @@ class SignificanceTest:
         panel["fieldConfig"]["defaults"]["unit"] = "watt"
 
 
-        panel["targets"][0]["columns"] = [
+        columns = [
             {"selector": "Time", "text": "Time", "type": "timestamp_epoch", "format": "unixtimestampms"},
             {"selector": f"{metric_prefix}_{group_name0}", "text": f"CPU {metric_prefix_formatted} {group_name0}", "type": "number"},
             {"selector": f"{metric_prefix}_{group_name1}", "text": f"CPU {metric_prefix_formatted} {group_name1}", "type": "number"}
         ]
-        panel["targets"][0]["url"] = f"http://nginx/csv-data/output/{output_group}/aggregate_summary.csv"
-        panel["targets"][0]["source"] = "url"
-        panel["targets"][0]["type"] = "csv"
+        # The database has the aggregates of both groups, the comparison file is only needed for CSV targets
+        metric, statistic = metric_prefix.rsplit("_", 1)
+        series = [(group_name, metric, statistic, column["text"])
+                  for group_name, column in zip([group_name0, group_name1], columns[1:])]
         panel["transformations"] = []
+        set_aggregate_target(panel, output_group, columns, file_name="aggregate_summary",
+                             max_points=max_points_for_width(panel["gridPos"]["w"]), series=series)
         panel["refresh"] = True
 
         return panel
@@ -309,8 +357,8 @@ class SignificanceTest:
         if not os.path.exists(path1):
             raise FileNotFoundError(f"Trial summary not found for group {group_name1} at: {path1}")
 
-        df0 = pd.read_csv(path0)
-        df1 = pd.read_csv(path1)
+        df0 = outliers.included(pd.read_csv(path0))
+        df1 = outliers.included(pd.read_csv(path1))
 
         if metric_name not in df0.columns or metric_name not in df1.columns:
             raise ValueError(f"Metric '{metric_name}' not found in trial summaries.")
@@ -322,18 +370,21 @@ class SignificanceTest:
 
         combined_df = pd.concat([df0, df1], ignore_index=True)
 
-        plt.figure(figsize=(8, 6))
-        sns.violinplot(data=combined_df, x="Group", y=metric_name)
-        plt.title(f"Violin Plot of '{metric_name}' — {group_name0} vs {group_name1}")
-        plt.ylabel(metric_name)
-        plt.xlabel("Group")
-        plt.tight_layout()
-
-        os.makedirs(output_folder, exist_ok=True)
-        safe_metric = metric_name.replace(" ", "_").replace("/", "_")
-        output_path = os.path.join(output_folder, f"{safe_metric}_{group_name0}_vs_{group_name1}_violin.png")
-        plt.savefig(output_path)
-        plt.close()
+        with tracing.stage('plot_render', f'{group_name0}_vs_{group_name1}', 'SIGNIFICANCE_TEST'):
+            # A figure per plot instead of the global pyplot state, so plots can be rendered from several threads
+            figure = Figure(figsize=(8, 6))
+            ax = figure.subplots()
+            sns.violinplot(data=combined_df, x="Group", y=metric_name, ax=ax)
+            ax.set_title(f"Violin Plot of '{metric_name}' — {group_name0} vs {group_name1}")
+            ax.set_ylabel(metric_name)
+            ax.set_xlabel("Group")
+            figure.tight_layout()
+
+            os.makedirs(output_folder, exist_ok=True)
+            safe_metric = metric_name.replace(" ", "_").replace("/", "_")
+            output_path = os.path.join(output_folder, f"{safe_metric}_{group_name0}_vs_{group_name1}_violin.png")
+            figure.savefig(output_path)
+            artifacts.publish(output_path)
 
     @staticmethod
     def create_violin_image_panel(group_name0: str, group_name1: str, metric_name: str, x_pos: int, y_pos: int) -> \
@@ -363,12 +414,13 @@ class SignificanceTest:
         template["gridPos"]["y"] = y_pos
 
         # Replace image URLs in elements and root background
+        image_url = static_url(f"csv-data/output/violin_plots/{image_filename}", base_url)
         for element in template["options"].get("elements", []):
             if "url" in element:
-                element["url"] = f"{base_url}/csv-data/output/violin_plots/{image_filename}"
+                element["url"] = image_url
 
         root_image = template["options"]["root"]["background"]["image"]
-        root_image["fixed"] = f"{base_url}/csv-data/output/violin_plots/{image_filename}"
+        root_image["fixed"] = image_url
 
         return template
 
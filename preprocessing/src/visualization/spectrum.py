@@ -0,0 +1,198 @@
+import json
+import os
+from typing import List, Dict, Any, Optional
+from analysis.spectrum import SPECTRUM_FILE, FREQUENCY_COLUMN
+from models.types.measurement_type import MeasurementType
+from models.group import Group
+from visualization.data_source import static_url
+from visualization.templating import GROUP_VARIABLE, CORE_VARIABLE, repeat, repeat_row
+import tracing
+
+
+class Spectrum:
+    """
+    Class for generating power spectral density visualizations (see analysis.spectrum).
+    The spectra are not time series, so the panels are trend panels over the frequency, with a logarithmic density
+    axis. They always load spectrum_data.csv, which is small, also when the other panels use the data API or the
+    database.
+    """
+
+    @staticmethod
+    @tracing.traced('generate_panels')
+    def generate_panels(experiment_name: str, groups: List[Group], measurement_types: List[MeasurementType],
+                        y_pos: int = 0) -> List[Dict[str, Any]]:
+        """
+        Generate a spectrum panel per group: for SPECTRUM_CPU_POWER the median and quartiles of the CPU power
+        spectrum, for SPECTRUM_CORE_POWER the median spectrum of every core.
+
+        :param experiment_name: Name of the experiment
+        :param groups: List of groups to visualize
+        :param measurement_types: List of measurement types to visualize
+        :param y_pos: Starting vertical position for panels
+        :return: List of panel configurations
+        """
+        panels = []
+
+        for measurement_type in measurement_types:
+            if measurement_type not in [MeasurementType.SPECTRUM_CPU_POWER, MeasurementType.SPECTRUM_CORE_POWER]:
+                continue
+            panels.append(Spectrum._create_row_panel(measurement_type.name.replace("_", " "), y_pos))
+            y_pos += 1
+
+            x_pos = 0
+            for group in groups:
+                if measurement_type == MeasurementType.SPECTRUM_CPU_POWER:
+                    panel = Spectrum._create_quartile_panel(measurement_type, group.name, "CPU")
+                else:
+                    panel = Spectrum._create_per_core_panel(measurement_type, group)
+                # 2 graphs per line
+                panel["gridPos"]["x"] = x_pos
+                panel["gridPos"]["y"] = y_pos
+                panels.append(panel)
+                x_pos += panel["gridPos"]["w"]
+                if x_pos >= 24:
+                    x_pos = 0
+                    y_pos += panel["gridPos"]["h"]
+            if x_pos > 0:
+                y_pos += panels[-1]["gridPos"]["h"]
+        return panels
+
+    @staticmethod
+    @tracing.traced('generate_panels')
+    def generate_templated_panels(experiment_name: str, groups: List[Group], measurement_types: List[MeasurementType],
+                                  y_pos: int = 0) -> List[Dict[str, Any]]:
+        """
+        Generate spectrum panels that repeat over the group and core dashboard variables, so the number of panels
+        does not depend on the number of groups and cores.
+
+        :param experiment_name: Name of the experiment
+        :param groups: List of groups to visualize (provided through the group variable)
+        :param measurement_types: List of measurement types to visualize
+        :param y_pos: Starting vertical position for panels
+        :return: List of panel configurations
+        """
+        panels = []
+
+        for measurement_type in measurement_types:
+            if measurement_type not in [MeasurementType.SPECTRUM_CPU_POWER, MeasurementType.SPECTRUM_CORE_POWER]:
+                continue
+            row_panel = Spectrum._create_row_panel(f'{GROUP_VARIABLE} - {measurement_type.name.replace("_", " ")}',
+                                                   y_pos)
+            panels.append(repeat_row(row_panel, "group"))
+            y_pos += 1
+
+            if measurement_type == MeasurementType.SPECTRUM_CPU_POWER:
+                panel = Spectrum._create_quartile_panel(measurement_type, GROUP_VARIABLE, "CPU")
+                panel["gridPos"]["w"] = 24
+            else:
+                panel = Spectrum._create_quartile_panel(measurement_type, GROUP_VARIABLE, f"Core {CORE_VARIABLE}",
+                                                        core_num=CORE_VARIABLE)
+                panel["gridPos"]["w"] = 6
+                repeat(panel, "core")
+            panel["gridPos"]["y"] = y_pos
+            panels.append(panel)
+            y_pos += panel["gridPos"]["h"]
+        return panels
+
+    @staticmethod
+    def _load_template_with_placeholders(template_name: str, placeholders: Dict[str, str]) -> Dict[str, Any]:
+        with open("csv-data/grafana-templates/" + template_name, 'r') as file:
+            template = file.read()
+            for key, value in placeholders.items():
+                template = template.replace("PLACEHOLDER_" + key, value)
+            return json.loads(template)
+
+    @staticmethod
+    def _create_spectrum_panel(measurement_type: MeasurementType, group_name: str, title: str,
+                               columns: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Loads the panel template and turns it into a trend panel of spectrum_data.csv of a group.
+
+        :param measurement_type: The spectrum measurement type
+        :param group_name: Name of the group (or the group variable)
+        :param title: Title of the panel
+        :param columns: Infinity column configurations of the densities, the frequency is added in front
+        :return: Panel configuration dictionary for Grafana
+        """
+        panel = Spectrum._load_template_with_placeholders("panel_template.json", {
+            "MEASUREMENTTYPE": str(measurement_type),
+            "GROUPNAME": group_name
+        })
+        panel["type"] = "trend"
+        panel["title"] = title
+        panel["options"]["xField"] = FREQUENCY_COLUMN
+        panel["options"]["tooltip"]["mode"] = "multi"
+        panel["fieldConfig"]["defaults"]["unit"] = measurement_type.unit
+        # Peaks of periodic behaviour are orders of magnitude above the noise floor
+        panel["fieldConfig"]["defaults"]["custom"]["scaleDistribution"] = {"type": "log", "log": 10}
+
+        panel["targets"][0]["columns"] = [{
+            "selector": FREQUENCY_COLUMN,
+            "text": FREQUENCY_COLUMN,
+            "type": "number"
+        }] + columns
+        panel["targets"][0]["url"] = static_url(os.path.join(Group.output_folder, group_name, SPECTRUM_FILE))
+        panel["targets"][0]["source"] = "url"
+        panel["targets"][0]["type"] = "csv"
+        return panel
+
+    @staticmethod
+    def _create_quartile_panel(measurement_type: MeasurementType, group_name: str, label: str,
+                               core_num: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate a panel with the median spectrum and the band between the quartiles of the spectra of the trials.
+
+        :param measurement_type: The spectrum measurement type
+        :param group_name: Name of the group (or the group variable)
+        :param label: Label of the CPU or core in the title and legend
+        :param core_num: Core number (or the core variable) for per-core measurement types
+        :return: Panel configuration dictionary for Grafana
+        """
+        columns = [{
+            "selector": measurement_type.get_full_column_name(core_num=core_num, statistic=stat),
+            "text": f"{label} ({text})",
+            "type": "number"
+        } for stat, text in [("median", "Median"), ("LQ", "Lower Quartile"), ("UQ", "Upper Quartile")]]
+        panel = Spectrum._create_spectrum_panel(measurement_type, group_name, f"{group_name} - {label} Power Spectrum",
+                                                columns)
+        panel["fieldConfig"]["overrides"] = [{
+            "matcher": {"id": "byName", "options": f"{label} (Upper Quartile)"},
+            "properties": [
+                {"id": "custom.fillBelowTo", "value": f"{label} (Lower Quartile)"},
+                {"id": "custom.lineStyle", "value": {"dash": [3, 3], "fill": "dash"}},
+                {"id": "color", "value": {"fixedColor": "rgba(77, 112, 255, 0.4)", "mode": "fixed"}}
+            ]
+        }, {
+            "matcher": {"id": "byName", "options": f"{label} (Lower Quartile)"},
+            "properties": [
+                {"id": "custom.lineStyle", "value": {"dash": [3, 3], "fill": "dash"}},
+                {"id": "color", "value": {"fixedColor": "rgba(77, 112, 255, 0.4)", "mode": "fixed"}}
+            ]
+        }]
+        return panel
+
+    @staticmethod
+    def _create_per_core_panel(measurement_type: MeasurementType, group: Group) -> Dict[str, Any]:
+        """
+        Generate a panel with the median spectrum of every core of a group.
+
+        :param measurement_type: The per-core spectrum measurement type
+        :param group: The group whose spectra will be visualized
+        :return: Panel configuration dictionary for Grafana
+        """
+        columns = [{
+            "selector": measurement_type.get_full_column_name(core_num=core, statistic="median"),
+            "text": f"Core {core}",
+            "type": "number"
+        } for core in range(group.no_cores)]
+        return Spectrum._create_spectrum_panel(measurement_type, group.name, f"{group.name} - Per Core Power Spectrum",
+                                               columns)
+
+    @staticmethod
+    def _create_row_panel(title: str, y_pos: int) -> Dict[str, Any]:
+        with open("csv-data/grafana-templates/row_panel_template.json", "r") as f:
+            template = json.load(f)
+        template["title"] = title
+        template["gridPos"]["y"] = y_pos
+        template["panels"] = []
+        return template
@@ -1,8 +1,13 @@
 import os
 import json
+import artifacts
 from typing import List, Dict, Any
 from models.types.measurement_type import MeasurementType
 from models.group import Group
+from visualization.correlation import Correlation, CORRELATION_LEVELS
+from visualization.data_source import static_url
+from visualization.templating import GROUP_VARIABLE, CORE_VARIABLE, repeat, repeat_row
+import tracing
 
 
 class Statistics:
@@ -11,12 +16,14 @@ class Statistics:
     """
 
     @staticmethod
+    @tracing.traced('generate_panels')
     def generate_panels(experiment_name: str, groups: List[Group], measurement_types: List[MeasurementType],
                         y_pos: int = 0) -> List[Dict[str, Any]]:
         """
         Displays statistics of energy and power based on measurement types.
         For CPU_STATS, shows CPU-level panels.
         For CORE_STATS, shows per-core panels.
+        For CORRELATION_SAMPLES and CORRELATION_TRIALS, shows correlation heatmaps.
 
         :param experiment_name: Name of the experiment (used in dashboard title)
         :param groups: List of groups to visualize
@@ -58,7 +65,7 @@ class Statistics:
             elif measurement_type == MeasurementType.CORE_STATS:
                 for group in groups:
 
-                    for core_num in range(8):  # TODO: currently assuming 8 cores
+                    for core_num in range(group.no_cores):
                         panels.append(Statistics._create_row_panel(
                             f'{group.name} - {measurement_type.name} - CORE {core_num}', y_pos))
                         y_pos += 1
@@ -88,10 +95,73 @@ class Statistics:
                             panels.extend([panel, test_panel])
                             image_panels.append(image_panel)
                         panels.extend(image_panels)
+            elif measurement_type in CORRELATION_LEVELS:
+                correlation_panels = Correlation.generate_panels(experiment_name, groups, [measurement_type], y_pos)
+                panels.extend(correlation_panels)
+                y_pos = max([y_pos] + [panel["gridPos"]["y"] + panel["gridPos"]["h"] for panel in correlation_panels])
             else:
                 continue
         return panels
 
+    @staticmethod
+    @tracing.traced('generate_panels')
+    def generate_templated_panels(experiment_name: str, groups: List[Group], measurement_types: List[MeasurementType],
+                                  y_pos: int = 0) -> List[Dict[str, Any]]:
+        """
+        Displays statistics of energy and power with panels that repeat over the group and core dashboard variables,
+        so the number of panels does not depend on the number of groups and cores.
+
+        :param experiment_name: Name of the experiment (used in dashboard title)
+        :param groups: List of groups to visualize (provided through the group variable)
+        :param measurement_types: List of measurement types to visualize
+        :param y_pos: Starting vertical position for panels
+        :return: List of panel configurations
+        """
+        panels = []
+        metrics = ["CPU_Total_Energy (J)", "CPU_Peak_Power (W)"]
+
+        for measurement_type in measurement_types:
+            if measurement_type in CORRELATION_LEVELS:
+                correlation_panels = Correlation.generate_templated_panels(experiment_name, groups,
+                                                                           [measurement_type], y_pos)
+                panels.extend(correlation_panels)
+                y_pos = max([y_pos] + [panel["gridPos"]["y"] + panel["gridPos"]["h"] for panel in correlation_panels])
+                continue
+            if measurement_type not in [MeasurementType.CPU_STATS, MeasurementType.CORE_STATS]:
+                continue
+            row_panel = Statistics._create_row_panel(f'{GROUP_VARIABLE} - {measurement_type.name}', y_pos)
+            panels.append(repeat_row(row_panel, "group"))
+            y_pos += row_panel["gridPos"]["h"]
+
+            for cpu_col in metrics:
+                if measurement_type == MeasurementType.CPU_STATS:
+                    col = cpu_col
+                    title = col.replace("CPU_", "").replace(" (J)", "").replace(" (W)", "").replace("_", " ")
+                else:
+                    base_name = cpu_col.replace("CPU_", "")
+                    col = f"CORE{CORE_VARIABLE}_{base_name}"
+                    title = f"CORE {CORE_VARIABLE} {base_name.split(' ')[0].replace('_', ' ')}"
+
+                metric_panels = [
+                    Statistics._create_combined_stat_panel(GROUP_VARIABLE, 0, y_pos, col, title),
+                    Statistics._create_test_stat_panel(GROUP_VARIABLE, 0, y_pos, col, title),
+                    Statistics._create_image_panel(GROUP_VARIABLE, 0, y_pos, col + "_violin.png", title)
+                ]
+                if measurement_type == MeasurementType.CORE_STATS:
+                    # Stack the statistics of a core vertically, and repeat them for every core
+                    for panel in metric_panels:
+                        panel["gridPos"]["y"] = y_pos
+                        panels.append(repeat(panel, "core"))
+                        y_pos += panel["gridPos"]["h"]
+                else:
+                    x_pos = 0
+                    for panel in metric_panels:
+                        panel["gridPos"]["x"] = x_pos
+                        x_pos += panel["gridPos"]["w"]
+                        panels.append(panel)
+                    y_pos += max(panel["gridPos"]["h"] for panel in metric_panels)
+        return panels
+
     @staticmethod
     def _load_template_with_placeholders(template_name: str, placeholders: Dict[str, str]) -> Dict[str, Any]:
         with open("csv-data/grafana-templates/" + template_name, 'r') as file:
@@ -125,7 +195,7 @@ class Statistics:
         } for stat in stats]
 
         panel["targets"][0]["columns"] = columns
-        panel["targets"][0]["url"] = f"http://nginx/csv-data/output/{group_name}/group_summary.csv"
+        panel["targets"][0]["url"] = static_url(os.path.join(Group.output_folder, group_name, "group_summary.csv"))
         panel["targets"][0]["source"] = "url"
         panel["targets"][0]["type"] = "csv"
         panel["transformations"] = []
@@ -162,7 +232,7 @@ class Statistics:
         ]
 
         panel["targets"][0]["columns"] = columns
-        panel["targets"][0]["url"] = f"http://nginx/csv-data/output/{group_name}/group_summary.csv"
+        panel["targets"][0]["url"] = static_url(os.path.join(Group.output_folder, group_name, "group_summary.csv"))
         panel["targets"][0]["source"] = "url"
         panel["targets"][0]["type"] = "csv"
         panel["transformations"] = [
@@ -198,7 +268,10 @@ class Statistics:
         template["gridPos"]["x"] = x_pos
         template["gridPos"]["y"] = y_pos
 
-        # Replace placeholders in URLs
+        # Replace placeholders in URLs, versioning the image with its content hash
+        digest = artifacts.version(os.path.join(Group.image_output_folder, group_name, image_filename))
+        if digest is not None:
+            image_filename = f"{image_filename}?v={digest}"
         for element in template["options"].get("elements", []):
             if "url" in element:
                 element["url"] = element["url"].replace("PLACEHOLDER_GROUPNAME", group_name).replace(
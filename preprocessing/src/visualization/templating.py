@@ -0,0 +1,80 @@
+from typing import List, Dict, Any
+
+from models.group import Group
+
+# Dashboard variables used by templated (repeating) panels
+GROUP_VARIABLE = "${group}"
+CORE_VARIABLE = "${core}"
+LOGICAL_VARIABLE = "${logical}"
+
+
+def _custom_variable(name: str, label: str, values: List[str]) -> Dict[str, Any]:
+    """
+    Create a Grafana custom variable with all values selected. Grafana builds the options from the query when the
+    dashboard loads, so the options are not stored in the dashboard.
+
+    :param name: Name of the variable
+    :param label: Label shown on the dashboard
+    :param values: Values of the variable
+    :return: Variable configuration
+    """
+    return {
+        "type": "custom",
+        "name": name,
+        "label": label,
+        "query": ",".join(values),
+        "multi": True,
+        "includeAll": True,
+        "current": {
+            "selected": True,
+            "text": ["All"],
+            "value": ["$__all"]
+        },
+        "options": [],
+        "hide": 0,
+        "skipUrlSync": False
+    }
+
+
+def dashboard_variables(groups: List[Group]) -> List[Dict[str, Any]]:
+    """
+    Create the group, core and logical processor variables for a templated dashboard, with the core and logical
+    processor counts detected from the groups.
+
+    :param groups: Groups shown on the dashboard
+    :return: List of variable configurations for the dashboard templating
+    """
+    no_cores = max((group.no_cores for group in groups), default=0)
+    no_logical = max((group.no_logical for group in groups), default=0)
+    return [
+        _custom_variable("group", "Group", [group.name for group in groups]),
+        _custom_variable("core", "Core", [str(core) for core in range(no_cores)]),
+        _custom_variable("logical", "Logical processor", [str(lp) for lp in range(no_logical)])
+    ]
+
+
+def repeat(panel: Dict[str, Any], variable: str, max_per_row: int = 4) -> Dict[str, Any]:
+    """
+    Make a panel repeat horizontally for every selected value of a variable.
+
+    :param panel: Panel configuration
+    :param variable: Name of the variable (without $)
+    :param max_per_row: Maximum number of repeated panels per row
+    :return: The panel
+    """
+    panel["repeat"] = variable
+    panel["repeatDirection"] = "h"
+    panel["maxPerRow"] = max_per_row
+    return panel
+
+
+def repeat_row(row_panel: Dict[str, Any], variable: str) -> Dict[str, Any]:
+    """
+    Make a row (and the panels below it) repeat for every selected value of a variable.
+
+    :param row_panel: Row panel configuration
+    :param variable: Name of the variable (without $)
+    :return: The row panel
+    """
+    row_panel["repeat"] = variable
+    return row_panel
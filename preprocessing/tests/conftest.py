@@ -0,0 +1,72 @@
+import hashlib
+import os
+import shutil
+import sys
+
+import pandas as pd
+import pytest
+
+# The modules are imported like in the container, with src on the path (PYTHONPATH=/app/src)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+SAMPLE_GROUP = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'csv-data',
+                            'input', 'sample_group')
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+    Empty working directory with the folder layout of the app (csv-data/input, csv-data/output, images/output).
+
+    :return: Function copying the first trials of the sample group into a group of the workspace
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('csv-data', 'input'))
+
+    def add_group(name: str, trials: int = 3) -> str:
+        folder = os.path.join('csv-data', 'input', name)
+        os.makedirs(folder, exist_ok=True)
+        for index in range(trials):
+            shutil.copy(os.path.join(SAMPLE_GROUP, f'large_specific_extensions_{index}.csv'), folder)
+        return folder
+
+    return add_group
+
+
+class SyntheticTrial:
+    """
+    Trial with given preprocessed columns, for the analyses that only read the columns of the trials.
+    """
+
+    def __init__(self, filename: str, columns: dict):
+        self.filename = filename
+        self.preprocessed_data = pd.DataFrame(columns)
+        self.added_columns = []
+        # Like the hash of a preprocessed file, which the added columns do not change
+        self._fingerprint = hashlib.sha256(pd.util.hash_pandas_object(self.preprocessed_data).to_numpy().tobytes())
+
+    @property
+    def columns(self) -> list:
+        return list(self.preprocessed_data.columns)
+
+    def column(self, name: str) -> pd.Series:
+        return self.preprocessed_data[name]
+
+    def add_columns(self, columns: dict) -> None:
+        self.added_columns += [name for name in columns if name not in self.preprocessed_data]
+        self.preprocessed_data = self.preprocessed_data.assign(**columns)
+
+    def measured_columns(self, kind: str) -> list:
+        # Only power columns are told apart, by their unit
+        return [column for column in self.preprocessed_data.columns if kind == 'power' and column.endswith('(W)')]
+
+    def fingerprint(self) -> str:
+        return self._fingerprint.hexdigest()
+
+
+@pytest.fixture
+def synthetic_trial():
+    """
+    :return: Function creating a trial named after its first argument with the columns of the other arguments
+    """
+    return SyntheticTrial
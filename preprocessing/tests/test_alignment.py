@@ -0,0 +1,79 @@
+"""
+Tests of the alignment of trials: the sign of the estimated lags, shifting trials by them and the cache of the lags.
+"""
+import json
+
+import numpy as np
+import pytest
+
+from analysis import alignment
+
+
+@pytest.fixture
+def shifted_trial(synthetic_trial):
+    """
+    :return: Function creating a trial whose heavy phase starts delay samples after the one of a trial with delay 0
+    """
+    def create(name: str, delay: int, seed: int = 0):
+        power = np.full(400, 5.0)
+        power[100 + delay:250 + delay] = 40.0
+        power += np.random.default_rng(seed).normal(0, 0.5, len(power))
+        return synthetic_trial(name, {alignment.ALIGNMENT_COLUMN: power})
+    return create
+
+
+def test_lag_sign(shifted_trial) -> None:
+    reference = shifted_trial('reference', 0)
+    trials = [shifted_trial('late', 12, seed=1), shifted_trial('early', -7, seed=2), shifted_trial('same', 0, seed=3)]
+    lags = alignment.estimate_lags(trials, reference, max_lag=50)
+    # Positive when the trial is behind the reference
+    np.testing.assert_array_equal(lags, [12, -7, 0])
+
+    # Shifting the trials by their lag lines their heavy phase up with the one of the reference
+    for trial, lag in zip(trials, lags):
+        source, destination = alignment.shifted_slices(400, int(lag), 400)
+        shifted = np.full(400, np.nan)
+        shifted[destination] = trial.column(alignment.ALIGNMENT_COLUMN).to_numpy()[source]
+        assert np.nanmean(shifted[100:250]) > 35 and np.nanmax(shifted[260:]) < 10
+
+
+def test_max_lag(shifted_trial) -> None:
+    lags = alignment.estimate_lags([shifted_trial('late', 30, seed=1)], shifted_trial('reference', 0), max_lag=10)
+    assert abs(lags[0]) <= 10
+
+
+def test_shifted_slices() -> None:
+    # A trial that is behind is moved earlier: its first samples are dropped
+    assert alignment.shifted_slices(10, 3, 10) == (slice(3, 10), slice(0, 7))
+    # A trial that is ahead is moved later, within the rows of the destination
+    assert alignment.shifted_slices(10, -3, 10) == (slice(0, 7), slice(3, 10))
+    assert alignment.shifted_slices(5, -3, 10) == (slice(0, 5), slice(3, 8))
+    assert alignment.shifted_slices(5, 8, 10) == (slice(8, 8), slice(0, 0))
+
+
+def test_lags_are_cached(shifted_trial, tmp_path, monkeypatch) -> None:
+    trials = [shifted_trial(f'trial_{index}', delay, seed=index) for index, delay in enumerate([0, 5, -4, 2])]
+    lags = alignment.align(trials, str(tmp_path))
+    # The lags are relative to the medoid, the differences between the trials do not depend on it
+    assert lags['trial_1'] - lags['trial_0'] == 5 and lags['trial_2'] - lags['trial_0'] == -4
+    with open(tmp_path / alignment.LAGS_FILE) as file:
+        cached = json.load(file)
+
+    estimate_lags = alignment.estimate_lags
+    estimated = []
+
+    def counting_estimate_lags(trials, reference, max_lag):
+        estimated.extend(trial.filename for trial in trials)
+        return estimate_lags(trials, reference, max_lag)
+
+    monkeypatch.setattr(alignment, 'estimate_lags', counting_estimate_lags)
+    assert alignment.align(trials, str(tmp_path)) == lags
+    assert estimated == []
+
+    # Only a new trial is estimated, against the same reference
+    trials.append(shifted_trial('trial_4', 3, seed=4))
+    new_lags = alignment.align(trials, str(tmp_path))
+    assert estimated == ['trial_4']
+    assert new_lags['trial_4'] - new_lags['trial_0'] == 3
+    with open(tmp_path / alignment.LAGS_FILE) as file:
+        assert json.load(file)['reference'] == cached['reference']
@@ -0,0 +1,70 @@
+"""
+Tests of the attribution of core energy to logical processors: the split always sums to the energy of the core.
+"""
+import numpy as np
+import pytest
+
+from analysis import attribution
+from models.schema import schema_for
+
+
+@pytest.fixture
+def trials(synthetic_trial) -> list:
+    rng = np.random.default_rng(0)
+    trials = []
+    for index, length in enumerate([50, 30]):
+        usage = rng.uniform(0, 100, (length, 4))
+        # Idle cores, and missing or negative usage values
+        usage[:5, [0, 2]] = 0
+        usage[5, 1] = np.nan
+        usage[6, 3] = -1
+        columns = {'Delta': np.full(length, 200.0), 'Time': np.arange(length) * 200.0}
+        columns.update({f'DIFF_CORE{core}_ENERGY (J)': rng.uniform(0, 2, length) for core in range(2)})
+        columns.update({f'CPU_USAGE_{number}': usage[:, number] for number in range(4)})
+        trial = synthetic_trial(f'trial_{index}', columns)
+        trial.schema = schema_for(tuple(columns), ',')
+        trials.append(trial)
+    return trials
+
+
+def test_split_sums_to_core_energy() -> None:
+    rng = np.random.default_rng(1)
+    energy = rng.uniform(0, 2, (100, 3))
+    usage = rng.uniform(0, 100, (100, 6))
+    usage[:10] = 0
+    usage[10:20, 4] = np.nan
+    mapping = np.array([[0, 3], [1, 4], [2, 5]])
+    attributed = attribution.split(energy, usage, mapping)
+    np.testing.assert_allclose(attributed[:, mapping].sum(axis=-1), energy, rtol=1e-12)
+    assert (attributed >= 0).all()
+    # Idle cores are split evenly, missing usage counts as 0
+    np.testing.assert_allclose(attributed[:10, 0], energy[:10, 0] / 2)
+    np.testing.assert_array_equal(attributed[10:20, 4], 0)
+    # Otherwise in proportion to the usage
+    np.testing.assert_allclose(attributed[50, 0] / attributed[50, 3], usage[50, 0] / usage[50, 3])
+
+
+@pytest.mark.parametrize('layout', attribution.LAYOUTS)
+def test_attribute(trials, layout) -> None:
+    columns = attribution.attribute(trials, layout)
+    assert columns == [column for number in range(4)
+                       for column in (attribution.energy_column(number), attribution.power_column(number))]
+    siblings = attribution.siblings(trials[0].schema, layout)
+    for trial in trials:
+        for core, numbers in siblings.items():
+            total = sum(trial.column(attribution.energy_column(number)) for number in numbers)
+            np.testing.assert_allclose(total, trial.column(f'DIFF_CORE{core}_ENERGY (J)'), rtol=1e-12)
+        power = trial.column(attribution.power_column(0))
+        np.testing.assert_allclose(power, trial.column(attribution.energy_column(0)) / 0.2)
+
+
+def test_siblings(trials) -> None:
+    schema = trials[0].schema
+    assert attribution.siblings(schema, 'interleaved') == {0: [0, 2], 1: [1, 3]}
+    assert attribution.siblings(schema, 'adjacent') == {0: [0, 1], 1: [2, 3]}
+    with pytest.raises(ValueError):
+        attribution.siblings(schema, 'random')
+    # Logical processors that cannot be divided evenly over the cores are not attributed
+    uneven = schema_for(('Delta', 'Time', 'DIFF_CORE0_ENERGY (J)', 'DIFF_CORE1_ENERGY (J)', 'CPU_USAGE_0',
+                         'CPU_USAGE_1', 'CPU_USAGE_2'), ',')
+    assert attribution.siblings(uneven) == {}
@@ -0,0 +1,70 @@
+"""
+Tests of the correlation matrices against NumPy and SciPy, with batches, padding and constant columns.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from analysis import correlation
+
+
+@pytest.fixture
+def data() -> np.ndarray:
+    # Observations x columns: related, unrelated and monotonic but non-linear columns, with ties
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=200)
+    return np.column_stack([x, 2 * x + rng.normal(size=200), rng.normal(size=200), np.exp(x),
+                            np.round(x * 2) / 2])
+
+
+def test_pearson(data) -> None:
+    np.testing.assert_allclose(correlation.correlate(data, 'pearson'), np.corrcoef(data, rowvar=False),
+                               rtol=1e-12, atol=1e-12)
+
+
+def test_spearman(data) -> None:
+    np.testing.assert_allclose(correlation.correlate(data, 'spearman'), stats.spearmanr(data).statistic,
+                               rtol=1e-12, atol=1e-12)
+    # A monotonic transformation does not change the ranks
+    assert correlation.correlate(data, 'spearman')[0, 3] == pytest.approx(1)
+
+
+def test_batches_and_padding(data) -> None:
+    batch = np.full((2, 250, data.shape[1]), np.nan)
+    batch[0, :200] = data
+    batch[1, :150] = data[:150]
+    for method, reference in [('pearson', lambda values: np.corrcoef(values, rowvar=False)),
+                              ('spearman', lambda values: stats.spearmanr(values).statistic)]:
+        matrices = correlation.correlate(batch, method)
+        # The padding of shorter trials does not change their correlations
+        np.testing.assert_allclose(matrices[0], reference(data), rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(matrices[1], reference(data[:150]), rtol=1e-12, atol=1e-12)
+
+
+def test_constant_columns(data) -> None:
+    data = np.column_stack([data[:, :2], np.full(len(data), 3.0)])
+    matrix = correlation.correlate(data, 'pearson')
+    assert np.isnan(matrix[2]).all() and np.isnan(matrix[:, 2]).all()
+    assert matrix[0, 0] == pytest.approx(1)
+    with pytest.raises(ValueError):
+        correlation.correlate(data, 'kendall')
+
+
+def test_fisher_mean() -> None:
+    matrices = np.array([[[1.0, 0.2], [0.2, 1.0]], [[1.0, 0.6], [0.6, 1.0]], [[1.0, np.nan], [np.nan, 1.0]]])
+    mean = correlation.fisher_mean(matrices)
+    assert mean[0, 1] == pytest.approx(np.tanh((np.arctanh(0.2) + np.arctanh(0.6)) / 2))
+    np.testing.assert_allclose(np.diag(mean), 1, rtol=1e-6)
+
+
+def test_compare() -> None:
+    data0 = pd.DataFrame({'Level': ['trials', 'samples'], 'Method': 'pearson', 'Row': 'A', 'Column': 'B',
+                          'Correlation': [0.1, 0.1]})
+    data1 = data0.assign(Correlation=[0.8, 0.8])
+    compared = correlation.compare(data0, data1, 'g0', 'g1', 20, 30)
+    assert list(compared['Difference']) == pytest.approx([0.7, 0.7])
+    z = (np.arctanh(0.8) - np.arctanh(0.1)) / np.sqrt(1 / 17 + 1 / 27)
+    assert compared['P_Value'][0] == pytest.approx(2 * stats.norm.sf(z))
+    # Samples are not independent, there is no test
+    assert np.isnan(compared['P_Value'][1])
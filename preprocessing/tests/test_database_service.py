@@ -0,0 +1,97 @@
+"""
+Tests of loading groups into the SQL tables, on an embedded SQLite database, and of the queries Grafana panels run on
+them.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from database_service import DatabaseService
+from models.group import Group
+from visualization.data_source import aggregate_sql
+
+TABLES = ['trial_samples', 'aggregates', 'trial_summaries', 'group_summaries']
+METRIC = 'CPU_POWER (W)'
+
+
+@pytest.fixture
+def database(workspace, tmp_path):
+    service = DatabaseService(f'sqlite:///{tmp_path / "analytics.db"}')
+    yield service
+    service.close()
+
+
+def count_rows(database: DatabaseService, group_name: str) -> dict:
+    return {table: int(database.query(f'SELECT count(*) AS n FROM {table} WHERE group_name = %s',
+                                      (group_name,))['n'][0])
+            for table in TABLES}
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_load_group(workspace, database) -> None:
+    workspace('sample', trials=2)
+    group = Group('sample')
+    database.load_group(group)
+
+    assert count_rows(database, 'sample') == {
+        'trial_samples': len(DatabaseService.samples_frame(group)),
+        'aggregates': len(DatabaseService.aggregates_frame(group)),
+        'trial_summaries': len(DatabaseService.trial_summaries_frame(group)),
+        'group_summaries': len(DatabaseService.group_summaries_frame(group))
+    }
+    means = database.query('SELECT time_ms, value FROM aggregates WHERE group_name = %s AND metric = %s '
+                           'AND statistic = %s ORDER BY sample', ('sample', METRIC, 'mean'))
+    data = group.aggregate_data
+    np.testing.assert_allclose(means['value'], data[f'{METRIC}_mean'])
+    np.testing.assert_array_equal(means['time_ms'], data['Time'].astype(np.int64))
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_reload_group(workspace, database) -> None:
+    folder = workspace('sample', trials=2)
+    workspace('other', trials=1)
+    group = Group('sample')
+    database.load_group(group)
+    database.load_group(Group('other'))
+    loaded = count_rows(database, 'sample')
+    other = count_rows(database, 'other')
+
+    # Loading the same group again replaces its rows
+    database.load_group(group)
+    assert count_rows(database, 'sample') == loaded
+
+    # Rows of trials that were removed from the group are removed, other groups are left alone
+    os.remove(os.path.join(folder, 'large_specific_extensions_1.csv'))
+    group = Group('sample')
+    database.load_group(group)
+    trials = database.query('SELECT DISTINCT trial FROM trial_summaries WHERE group_name = %s ORDER BY trial',
+                            ('sample',))['trial']
+    assert list(trials) == sorted(DatabaseService.trial_summaries_frame(group)['trial'].unique())
+    assert len(trials) == 1
+    assert count_rows(database, 'sample')['trial_samples'] == len(DatabaseService.samples_frame(group))
+    assert count_rows(database, 'other') == other
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_aggregate_sql_time_range(workspace, database) -> None:
+    workspace('sample', trials=2)
+    group = Group('sample')
+    database.load_group(group)
+    data = group.aggregate_data
+    times = data['Time'].astype(np.int64)
+    start, end = int(times.iloc[len(times) // 4]), int(times.iloc[len(times) // 2])
+    series = [('sample', METRIC, 'mean', 'Mean'), ('sample', METRIC, 'max', 'Max')]
+
+    result = database.query(aggregate_sql(series, start=start, end=end))
+    selected = data[(times >= start) & (times <= end)]
+    np.testing.assert_array_equal(result['Time'], selected['Time'].astype(np.int64))
+    np.testing.assert_allclose(result['Mean'], selected[f'{METRIC}_mean'])
+    np.testing.assert_allclose(result['Max'], selected[f'{METRIC}_max'])
+
+    # Reduced to buckets, the extremes are kept
+    reduced = database.query(aggregate_sql(series, max_points=10, start=start, end=end))
+    assert 1 < len(reduced) <= 10
+    assert reduced['Time'].is_monotonic_increasing
+    assert reduced['Time'].iloc[0] == start
+    assert reduced['Max'].max() == pytest.approx(selected[f'{METRIC}_max'].max())
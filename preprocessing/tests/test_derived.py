@@ -0,0 +1,94 @@
+"""
+Tests of derived metrics: expressions outside of the language are rejected, valid ones are evaluated over all trials
+of a group at once.
+"""
+import numpy as np
+import pytest
+
+from analysis import derived
+from analysis.derived import DerivedMetric
+
+
+@pytest.fixture
+def trials(synthetic_trial) -> list:
+    # The second trial is shorter, its missing samples are padding
+    return [synthetic_trial(f'trial_{index}', {
+        'Delta': np.full(length, 200.0),
+        'CPU_POWER (W)': np.arange(length, dtype=float) + 10 * index,
+        'CORE0_POWER (W)': np.full(length, 1.0 + index),
+        'CORE1_POWER (W)': np.full(length, 2.0),
+        'DIFF_CPU_ENERGY (J)': np.full(length, 0.5)
+    }) for index, length in enumerate([5, 3])]
+
+
+@pytest.mark.parametrize('name, expression, message', [
+    ('METRIC', '[CPU_POWER (W)].__class__', 'unsupported expression'),
+    ('METRIC', '__import__([CPU_POWER (W)])', 'unknown function'),
+    ('METRIC', '[CPU_POWER (W)] + "os"', 'unsupported expression'),
+    ('METRIC', 'open([CPU_POWER (W)])', 'unknown function'),
+    ('METRIC', 'x + [CPU_POWER (W)]', 'unknown name "x"'),
+    ('METRIC', '_c0 + [CPU_POWER (W)]', 'unknown name "_c0"'),
+    ('METRIC', 'lambda: [CPU_POWER (W)]', 'unsupported expression'),
+    ('METRIC', '[CPU_POWER (W)] if 1 else 2', 'unsupported expression'),
+    ('METRIC', '[CPU_POWER (W)] + True', 'unsupported expression'),
+    ('METRIC', '[CPU_POWER (W)] % 2', 'unsupported expression'),
+    ('METRIC', '[CPU_POWER (W)] +', 'invalid expression'),
+    ('METRIC', 'sqrt([CPU_POWER (W)], 2)', 'exactly one argument'),
+    ('METRIC', '[CORE*_POWER (W)]', 'must be reduced'),
+    ('METRIC', 'total([CORE*_POWER (W)])', 'reduce the column set'),
+    ('METRIC', 'sum_of([CPU_POWER (W)])', 'needs a column set'),
+    ('METRIC', '2 * 3', 'does not use any column'),
+    ('CPU_Total_Energy (J)', 'total([DIFF_CPU_ENERGY (J)])', 'the name is a column'),
+    ('Outlier', 'total([DIFF_CPU_ENERGY (J)])', 'the name is a column'),
+    ('A/B', 'total([DIFF_CPU_ENERGY (J)])', 'must not contain'),
+    ('', 'total([DIFF_CPU_ENERGY (J)])', 'non-empty'),
+])
+def test_invalid_expressions(name, expression, message) -> None:
+    with pytest.raises(ValueError, match=message):
+        DerivedMetric(name, expression)
+
+
+def test_too_large_number() -> None:
+    with pytest.raises(ValueError, match='too large'):
+        DerivedMetric('METRIC', '1' + '0' * 400 + ' * [CPU_POWER (W)]')
+
+
+def test_levels() -> None:
+    assert DerivedMetric('UNCORE_POWER (W)', '[CPU_POWER (W)] - sum_of([CORE*_POWER (W)])').level == 'sample'
+    assert DerivedMetric('CPU_EDP (J*s)', 'total([DIFF_CPU_ENERGY (J)]) * duration').level == 'trial'
+    # A per-trial value combined with a column is a per-sample metric
+    assert DerivedMetric('RELATIVE_POWER', '[CPU_POWER (W)] / mean([CPU_POWER (W)])').level == 'sample'
+
+
+def test_evaluate(trials) -> None:
+    uncore = DerivedMetric('UNCORE_POWER (W)', '[CPU_POWER (W)] - sum_of([CORE*_POWER (W)])').evaluate(trials, {})
+    assert uncore.shape == (5, 2)
+    np.testing.assert_array_equal(uncore[:, 0], np.arange(5) - 3)
+    np.testing.assert_array_equal(uncore[:3, 1], np.arange(3) + 10 - 4)
+    assert np.isnan(uncore[3:, 1]).all()
+
+    edp = DerivedMetric('CPU_EDP (J*s)', 'total([DIFF_CPU_ENERGY (J)]) * duration').evaluate(trials, {})
+    # Energy times duration, the padding of the shorter trial is left out
+    np.testing.assert_allclose(edp, [2.5 * 1.0, 1.5 * 0.6])
+    peak = DerivedMetric('PEAK', 'max(sqrt(abs([CPU_POWER (W)] - 2)) + 1)').evaluate(trials, {})
+    np.testing.assert_allclose(peak, [np.sqrt(2) + 1, np.sqrt(10) + 1])
+
+
+def test_derive(trials, tmp_path, monkeypatch) -> None:
+    metrics = derived.parse_metrics({
+        'UNCORE_POWER (W)': '[CPU_POWER (W)] - sum_of([CORE*_POWER (W)])',
+        'UNCORE_PEAK (W)': 'max([UNCORE_POWER (W)])',
+        'GPU_ENERGY (J)': 'total([GPU_ENERGY (J)])',
+        'CPU_POWER (W)': '[CORE0_POWER (W)] * 2'
+    })
+    per_sample, per_trial = derived.derive(trials, str(tmp_path), metrics)
+    # Metrics on missing columns or named after a column are skipped
+    assert per_sample == ['UNCORE_POWER (W)']
+    assert list(per_trial.columns) == ['UNCORE_PEAK (W)']
+    np.testing.assert_array_equal(per_trial['UNCORE_PEAK (W)'], [1, 8])
+    np.testing.assert_array_equal(trials[1].column('UNCORE_POWER (W)'), np.arange(3) + 6)
+
+    # The results are cached
+    monkeypatch.setattr(DerivedMetric, 'evaluate', lambda *args: pytest.fail('metric was evaluated again'))
+    _, cached = derived.derive(trials, str(tmp_path), metrics[:2])
+    np.testing.assert_array_equal(cached['UNCORE_PEAK (W)'], [1, 8])
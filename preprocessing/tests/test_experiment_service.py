@@ -0,0 +1,34 @@
+"""
+Tests of adding experiments: experiments are only added, to the store or to memory, when their groups exist and their
+name is new.
+"""
+import pytest
+
+from experiment_service import ExperimentService
+from experiment_store import ExperimentStore
+from group_service import GroupService
+from models.types.experiment_type import ExperimentType
+from models.types.measurement_type import MeasurementType
+
+
+@pytest.mark.parametrize('stored', [True, False])
+def test_add_experiment_validates_groups_and_name(workspace, tmp_path, stored) -> None:
+    workspace('sample', trials=2)
+    store = ExperimentStore(str(tmp_path / 'experiments.db')) if stored else None
+    service = ExperimentService(GroupService(), store)
+
+    with pytest.raises(ValueError, match='missing'):
+        service.add_experiment('bad', ['sample', 'missing'], [MeasurementType.CPU_POWER],
+                               ExperimentType.PLOT_OVER_TIME)
+    assert service.get_experiments() == ()
+    if stored:
+        assert store.load() == []
+
+    experiments = service.add_experiment('first', ['sample'], [MeasurementType.CPU_POWER],
+                                         ExperimentType.PLOT_OVER_TIME)
+    assert [experiment.name for experiment in experiments] == ['first']
+    assert experiments[0].groups[0].name == 'sample'
+
+    with pytest.raises(ValueError, match='already exists'):
+        service.add_experiment('FIRST', ['sample'], [MeasurementType.CPU_POWER], ExperimentType.STATISTICS)
+    assert [experiment.name for experiment in service.get_experiments()] == ['first']
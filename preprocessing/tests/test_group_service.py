@@ -0,0 +1,30 @@
+"""
+Tests of the group registry: groups ingested by one process are picked up by the registries of the other processes.
+"""
+import shutil
+
+from group_service import GroupService
+
+
+def test_groups_ingested_elsewhere_are_reloaded(workspace) -> None:
+    folder = workspace('sample', trials=2)
+    worker = GroupService()
+    # A second server worker, forked with the registry of the first
+    other = GroupService(groups=worker.get_groups())
+    loaded = other.find_group('sample')
+    assert loaded is worker.find_group('sample')
+
+    # Without changes, the registry is not reloaded
+    assert other.find_group('sample') is loaded
+
+    shutil.copy(f'{folder}/large_specific_extensions_0.csv', f'{folder}/large_specific_extensions_9.csv')
+    worker.add_group('sample')
+    workspace('new', trials=2)
+    worker.add_group('new')
+
+    reloaded = other.find_group('sample')
+    assert reloaded is not loaded
+    assert len(reloaded.trials) == 3
+    assert sorted(group.name for group in other.get_groups()) == ['new', 'sample']
+    # The reloaded group is kept until the group changes again
+    assert other.find_group('sample') is reloaded
@@ -0,0 +1,187 @@
+"""
+Tests of the kernels: the results of the NumPy reference backend, and the parity of the Numba backend with it.
+"""
+import numpy as np
+import pytest
+
+import kernels
+
+needs_numba = pytest.mark.skipif(kernels.NUMBA is None, reason='numba is not installed')
+
+BACKENDS = ['numpy', pytest.param('numba', marks=needs_numba)]
+
+
+@pytest.fixture
+def rng() -> np.random.Generator:
+    return np.random.default_rng(0)
+
+
+def assert_parity(reference, results) -> None:
+    for expected, actual in zip(reference, results):
+        np.testing.assert_allclose(actual, expected, rtol=1e-12, atol=1e-12, equal_nan=True)
+
+
+# ------------------------------------------------------------------------------------------------------
+
+# energy_power and power_energy
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_energy_power(backend: str) -> None:
+    energy = np.array([[10.0, 100.0], [12.0, 101.0], [15.0, 101.5]])
+    deltas = np.array([0.0, 200.0, 500.0])
+    with kernels.using(backend):
+        diff, power = kernels.energy_power(energy, deltas)
+    np.testing.assert_array_equal(diff, [[0, 0], [2, 1], [3, 0.5]])
+    np.testing.assert_array_equal(power, [[0, 0], [10, 5], [6, 1]])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_energy_power_delta_zero(backend: str) -> None:
+    energy = np.array([[1.0], [2.0], [4.0], [4.0]])
+    deltas = np.array([100.0, 0.0, 0.0, 100.0])
+    with kernels.using(backend):
+        diff, power = kernels.energy_power(energy, deltas)
+    np.testing.assert_array_equal(diff[:, 0], [0, 1, 2, 0])
+    # The power of samples with a delta of 0 (a division by 0, also 0 / 0) is 0
+    np.testing.assert_array_equal(power[:, 0], [0, 0, 0, 0])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_energy_power_nan(backend: str) -> None:
+    energy = np.array([[1.0], [np.nan], [3.0], [5.0]])
+    deltas = np.full(4, 1000.0)
+    with kernels.using(backend):
+        diff, power = kernels.energy_power(energy, deltas)
+    # Differences with a missing value are 0
+    np.testing.assert_array_equal(diff[:, 0], [0, 0, 0, 2])
+    np.testing.assert_array_equal(power[:, 0], [0, 0, 0, 2])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_power_energy(backend: str) -> None:
+    power = np.array([[10.0], [np.nan], [4.0]])
+    deltas = np.array([500.0, 500.0, 0.0])
+    with kernels.using(backend):
+        energy = kernels.power_energy(power, deltas)
+    np.testing.assert_array_equal(energy[:, 0], [5, 0, 0])
+
+
+@needs_numba
+def test_energy_power_parity(rng: np.random.Generator) -> None:
+    energy = np.cumsum(rng.uniform(0, 5, (500, 9)), axis=0)
+    energy[rng.random(energy.shape) < 0.02] = np.nan
+    deltas = rng.choice([0.0, 100.0, 200.0, 201.0], size=500)
+    assert_parity(kernels.NUMPY.energy_power(energy, deltas), kernels.NUMBA.energy_power(energy, deltas))
+    assert_parity([kernels.NUMPY.power_energy(energy, deltas)], [kernels.NUMBA.power_energy(energy, deltas)])
+
+
+# ------------------------------------------------------------------------------------------------------
+
+# order_statistics
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_order_statistics(backend: str, rng: np.random.Generator) -> None:
+    values = rng.normal(10, 3, (50, 7))
+    with kernels.using(backend):
+        statistics = kernels.order_statistics(values)
+    assert list(statistics) == list(kernels.STATISTICS)
+    np.testing.assert_allclose(statistics['mean'], values.mean(axis=1))
+    np.testing.assert_allclose(statistics['std'], values.std(axis=1, ddof=1))
+    np.testing.assert_allclose(statistics['median'], np.median(values, axis=1))
+    np.testing.assert_allclose(statistics['min'], values.min(axis=1))
+    np.testing.assert_allclose(statistics['max'], values.max(axis=1))
+    np.testing.assert_allclose(statistics['LQ'], np.quantile(values, 0.25, axis=1))
+    np.testing.assert_allclose(statistics['UQ'], np.quantile(values, 0.75, axis=1))
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_order_statistics_single_trial(backend: str) -> None:
+    values = np.array([[1.0], [2.0]])
+    with kernels.using(backend):
+        statistics = kernels.order_statistics(values)
+    assert np.isnan(statistics['std']).all()
+    for statistic in ('mean', 'median', 'min', 'max', 'LQ', 'UQ'):
+        np.testing.assert_array_equal(statistics[statistic], [1, 2])
+
+
+@needs_numba
+@pytest.mark.parametrize('trials', [1, 2, 3, 4, 30])
+def test_order_statistics_parity(rng: np.random.Generator, trials: int) -> None:
+    values = rng.normal(0, 1, (200, trials))
+    assert_parity(kernels.NUMPY.order_statistics(values), kernels.NUMBA.order_statistics(values))
+
+
+@needs_numba
+def test_order_statistics_parity_nan(rng: np.random.Generator) -> None:
+    values = rng.normal(0, 1, (20, 5))
+    values[3, 2] = np.nan
+    values[7, :] = np.nan
+    reference = kernels.NUMPY.order_statistics(values)
+    for statistic in reference:
+        assert np.isnan(statistic[[3, 7]]).all()
+    assert_parity(reference, kernels.NUMBA.order_statistics(values))
+
+
+# ------------------------------------------------------------------------------------------------------
+
+# change_points
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_change_points_steps(backend: str, rng: np.random.Generator) -> None:
+    values = np.concatenate([np.full(40, 1.0), np.full(30, 8.0), np.full(50, 3.0)]) + rng.normal(0, 0.1, 120)
+    with kernels.using(backend):
+        np.testing.assert_array_equal(kernels.change_points(values, penalty=1.0, min_size=3), [40, 70])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_change_points_constant_and_short(backend: str) -> None:
+    with kernels.using(backend):
+        assert len(kernels.change_points(np.full(100, 5.0), penalty=1.0)) == 0
+        # Too short for two segments of min_size
+        assert len(kernels.change_points(np.array([1.0, 9.0, 1.0]), penalty=0.0, min_size=2)) == 0
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_change_points_min_size(backend: str) -> None:
+    values = np.array([0.0] * 10 + [10.0] + [0.0] * 10)
+    with kernels.using(backend):
+        change_points = kernels.change_points(values, penalty=0.5, min_size=4)
+    assert np.all(np.diff(np.concatenate(([0], change_points, [len(values)]))) >= 4)
+
+
+@needs_numba
+@pytest.mark.parametrize('penalty', [0.1, 2.0, 50.0])
+@pytest.mark.parametrize('min_size', [1, 3, 10])
+def test_change_points_parity(rng: np.random.Generator, penalty: float, min_size: int) -> None:
+    levels = rng.choice([1.0, 5.0, 20.0], size=12)
+    values = np.repeat(levels, rng.integers(5, 40, size=12))
+    values = values + rng.normal(0, 0.5, len(values))
+    np.testing.assert_array_equal(kernels.NUMBA.change_points(values, penalty, min_size),
+                                  kernels.NUMPY.change_points(values, penalty, min_size))
+
+
+# ------------------------------------------------------------------------------------------------------
+
+# quantise and backend selection
+
+
+@needs_numba
+def test_quantise_parity(rng: np.random.Generator) -> None:
+    time = np.cumsum(rng.normal(200, 5, 300)) + 1e6
+    deltas = rng.normal(200, 5, 300)
+    assert_parity(kernels.NUMPY.quantise(time, deltas, 200.0), kernels.NUMBA.quantise(time, deltas, 200.0))
+
+
+def test_quantise_integers() -> None:
+    time, deltas = kernels.quantise(np.array([1000, 1199, 1405]), np.array([0, 199, 206]), 200)
+    assert time.dtype == np.int64 and deltas.dtype == np.int64
+    np.testing.assert_array_equal(time, [0, 200, 400])
+    np.testing.assert_array_equal(deltas, [0, 200, 200])
+
+
+def test_unknown_backend() -> None:
+    with pytest.raises(ValueError):
+        kernels.get_backend('fortran')
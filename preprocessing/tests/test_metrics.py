@@ -0,0 +1,47 @@
+"""
+Tests of the metrics exposition, in a single process and summed over several worker processes.
+"""
+import math
+import os
+import subprocess
+import sys
+
+import metrics
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def test_render_special_values() -> None:
+    metrics.GROUP_MEMORY.set_function(lambda: {('nan',): math.nan, ('inf',): math.inf})
+    try:
+        text = metrics.render().decode()
+    finally:
+        metrics.GROUP_MEMORY.set_function(lambda: {})
+    assert 'energibridge_group_memory_bytes{group="nan"} NaN' in text
+    assert 'energibridge_group_memory_bytes{group="inf"} +Inf' in text
+
+
+def test_render_counters_and_histograms() -> None:
+    metrics.ROWS_PROCESSED.labels(stage='test', group='render').inc(3)
+    with metrics.stage_timer('test', 'render'):
+        pass
+    text = metrics.render().decode()
+    assert 'energibridge_rows_processed_total{group="render",stage="test"} 3.0' in text
+    assert 'energibridge_stage_duration_seconds_count{experiment_type="",group="render",stage="test"} 1.0' in text
+    assert 'process_resident_memory_bytes' in text
+
+
+def run(code: str, folder: str) -> str:
+    environment = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=folder, PYTHONPATH=SRC)
+    return subprocess.run([sys.executable, '-c', code], env=environment, check=True, capture_output=True,
+                          text=True).stdout
+
+
+def test_multiprocess_counters_are_summed(tmp_path) -> None:
+    # Two workers count, a third answers the scrape
+    for amount in (2, 5):
+        run(f"import metrics; metrics.ROWS_PROCESSED.labels(stage='upload', group='g').inc({amount}); "
+            "metrics.cache_lookup('data', True)", str(tmp_path))
+    text = run("import metrics; print(metrics.render().decode())", str(tmp_path))
+    assert 'energibridge_rows_processed_total{group="g",stage="upload"} 7.0' in text
+    assert 'energibridge_cache_requests_total{cache="data",result="hit"} 2.0' in text
@@ -0,0 +1,115 @@
+"""
+Tests of the detection of outlier trials: robust z-scores, the scores of trials, their cache and the decisions of the
+outlier policies.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import outliers
+from analysis.outliers import OutlierPolicy
+
+COLUMNS = ['CPU_POWER (W)', 'CORE0_POWER (W)']
+
+
+@pytest.fixture
+def group_trials(synthetic_trial):
+    """
+    :return: Function creating trials with the same noisy power trace, except for the given offsets of trial_2
+    """
+    def create(count: int = 6, power_offset: float = 0.0, energy_factor: float = 1.0) -> list:
+        rng = np.random.default_rng(0)
+        base = np.concatenate([np.full(50, 5.0), np.full(150, 30.0)])
+        trials = []
+        for index in range(count):
+            power = base + rng.normal(0, 0.5, len(base))
+            energy = np.full(len(base), 0.2 + rng.normal(0, 0.001))
+            if index == 2:
+                power = power + power_offset
+                energy = energy * energy_factor
+            trials.append(synthetic_trial(f'trial_{index}', {'CPU_POWER (W)': power, 'CORE0_POWER (W)': power / 4,
+                                                             'DIFF_CPU_ENERGY (J)': energy}))
+        return trials
+    return create
+
+
+def test_robust_z() -> None:
+    values = np.array([1.0, 2.0, 3.0, 4.0, 100.0])
+    # Median 3, median absolute deviation 1
+    np.testing.assert_allclose(outliers.robust_z(values), (values - 3) / outliers.MAD_SCALE)
+    np.testing.assert_allclose(outliers.robust_z(np.array([1.0, np.nan, 3.0, 5.0]))[[0, 2, 3]],
+                               np.array([-2.0, 0.0, 2.0]) / (2 * outliers.MAD_SCALE))
+    # Without spread there are no outliers
+    np.testing.assert_array_equal(outliers.robust_z(np.array([2.0, 2.0, 2.0, 7.0])), np.zeros(4))
+
+
+def test_score_trials(group_trials) -> None:
+    scores = outliers.score_trials(group_trials(), COLUMNS)
+    assert list(scores.index) == [f'trial_{index}' for index in range(6)]
+    assert (scores.abs() < 3.5).all().all()
+
+    # A trial with a higher power is found by its deviation, a trial using more energy by its energy
+    scores = outliers.score_trials(group_trials(power_offset=3.0), COLUMNS)
+    assert scores['deviation_z'].idxmax() == 'trial_2' and scores.loc['trial_2', 'deviation_z'] > 3.5
+    scores = outliers.score_trials(group_trials(energy_factor=1.5), COLUMNS)
+    assert scores['energy_z'].idxmax() == 'trial_2' and scores.loc['trial_2', 'energy_z'] > 3.5
+    assert scores.drop(index='trial_2')['energy_z'].abs().max() < 3.5
+
+
+def test_shorter_trials_are_padded(group_trials, synthetic_trial) -> None:
+    trials = group_trials()
+    trials[4] = synthetic_trial('trial_4', trials[4].preprocessed_data.iloc[:120])
+    scores = outliers.score_trials(trials, COLUMNS)
+    assert np.isfinite(scores.to_numpy()).all()
+    assert scores.loc['trial_4', 'deviation_z'] < 3.5
+
+
+def test_scores_are_cached(group_trials, tmp_path, monkeypatch) -> None:
+    trials = group_trials(power_offset=3.0)
+    flag = outliers.decide(trials, str(tmp_path), OutlierPolicy('flag', 3.5))
+    assert os.path.exists(tmp_path / outliers.SCORES_FILE)
+
+    # Changing the threshold or mode reuses the scores
+    monkeypatch.setattr(outliers, 'score_trials', lambda *args: pytest.fail('trials were scored again'))
+    strict = outliers.decide(trials, str(tmp_path), OutlierPolicy('exclude', 1000.0))
+    pd.testing.assert_series_equal(strict['Outlier_Deviation_Z'], flag['Outlier_Deviation_Z'])
+    assert strict['Outlier'].sum() == 0
+
+    # Changed trials or lags are scored again
+    with pytest.raises(pytest.fail.Exception):
+        outliers.decide(trials[:-1], str(tmp_path), OutlierPolicy('flag', 3.5))
+    with pytest.raises(pytest.fail.Exception):
+        outliers.decide(trials, str(tmp_path), OutlierPolicy('flag', 3.5), lags={'trial_0': 1})
+
+
+def test_decisions(group_trials, tmp_path) -> None:
+    trials = group_trials(power_offset=3.0)
+    flag = outliers.decide(trials, str(tmp_path), OutlierPolicy('flag', 3.5))
+    assert list(flag.columns) == outliers.DECISION_COLUMNS
+    assert list(flag.index[flag['Outlier'] == 1]) == ['trial_2']
+    assert flag['Excluded'].sum() == 0
+
+    exclude = outliers.decide(trials, str(tmp_path), OutlierPolicy('exclude', 3.5))
+    assert list(exclude.index[exclude['Excluded'] == 1]) == ['trial_2']
+
+    off = outliers.decide(trials, str(tmp_path), OutlierPolicy('off'))
+    assert off[['Outlier', 'Excluded']].sum().sum() == 0 and off['Outlier_Energy_Z'].isna().all()
+    # Too few trials to estimate the spread
+    few = outliers.decide(trials[:outliers.MIN_TRIALS - 1], str(tmp_path), OutlierPolicy('exclude', 3.5))
+    assert few['Excluded'].sum() == 0
+
+    summary = pd.DataFrame({'Trial': exclude.index, 'CPU_Total_Energy (J)': 1.0}).join(exclude, on='Trial')
+    assert list(outliers.included(summary)['Trial']) == ['trial_0', 'trial_1', 'trial_3', 'trial_4', 'trial_5']
+    assert list(outliers.included(summary).columns) == ['Trial', 'CPU_Total_Energy (J)']
+
+
+def test_policy(tmp_path) -> None:
+    with pytest.raises(ValueError):
+        OutlierPolicy('drop')
+    with pytest.raises(ValueError):
+        OutlierPolicy('flag', 0)
+    assert OutlierPolicy.load(str(tmp_path)).to_dict() == OutlierPolicy().to_dict()
+    OutlierPolicy('exclude', 2.5).save(str(tmp_path))
+    assert OutlierPolicy.load(str(tmp_path)).to_dict() == {'mode': 'exclude', 'threshold': 2.5}
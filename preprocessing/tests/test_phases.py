@@ -0,0 +1,91 @@
+"""
+Tests of the segmentation of trials into phases on synthetic power traces.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import phases
+
+DELTA = 200.0
+
+
+class SyntheticTrial:
+    """
+    Power and energy of a trial like in a preprocessed file: a padding row without a duration at the start and the end,
+    the last one with energy but no power like the quantised last sample of EnergiBridge.
+    """
+
+    def __init__(self, power: np.ndarray, last_energy: float = 1.2):
+        self.power = np.concatenate(([0.0], power, [0.0]))
+        self.deltas = np.concatenate(([0.0], np.full(len(power), DELTA), [0.0]))
+        self.energy = self.power * self.deltas / 1000
+        self.energy[-1] = last_energy
+
+    def column(self, name: str) -> pd.Series:
+        return pd.Series({'CPU_POWER (W)': self.power, 'Delta': self.deltas, 'DIFF_CPU_ENERGY (J)': self.energy}[name])
+
+
+def trace(*parts, noise: float = 0.3, seed: int = 0) -> np.ndarray:
+    """
+    :param parts: (number of samples, start power, end power) of the consecutive parts of the trace
+    :return: Power trace with Gaussian noise
+    """
+    power = np.concatenate([np.linspace(start, end, samples) for samples, start, end in parts])
+    return power + np.random.default_rng(seed).normal(0, noise, len(power))
+
+
+def mean_power(summary: dict, phase: str) -> float:
+    return summary[phases.column(phase, 'Mean_Power (W)')]
+
+
+def test_idle_ramp_steady_tail() -> None:
+    trial = SyntheticTrial(trace((30, 5, 5), (10, 8, 37), (80, 40, 40), (20, 8, 8)))
+    segmentation = phases.segment(trial)
+    ranges = segmentation.ranges
+    # One padding row before the 30 idle samples, the ramp starts at sample 31
+    assert ranges['idle'][0] == 0 and 31 <= ranges['idle'][1] <= 34
+    assert ranges['ramp'][1] - ranges['ramp'][0] <= 10
+    assert 35 <= ranges['steady'][0] <= 41 and ranges['steady'][1] == 121
+    assert ranges['tail'] == (121, 142)
+
+    summary = phases.summarize(trial, segmentation)
+    assert mean_power(summary, 'idle') == pytest.approx(5, abs=0.5)
+    assert mean_power(summary, 'steady') == pytest.approx(40, rel=0.05)
+    # The energy of the last row without a duration does not inflate the power of the tail
+    assert mean_power(summary, 'tail') == pytest.approx(8, abs=0.5)
+
+
+def test_summary_counts_the_same_rows() -> None:
+    trial = SyntheticTrial(trace((30, 5, 5), (10, 8, 37), (80, 40, 40), (20, 8, 8)))
+    summary = phases.summarize(trial)
+    durations = sum(summary[phases.column(phase, 'Duration (s)')] for phase in phases.PHASES)
+    energy = sum(summary[phases.column(phase, 'Energy (J)')] for phase in phases.PHASES)
+    assert durations == pytest.approx(trial.deltas.sum() / 1000)
+    assert energy == pytest.approx(trial.energy[trial.deltas > 0].sum())
+
+
+def test_spikes_do_not_stretch_steady() -> None:
+    # Steady load, then idle with short spikes until the end of the run
+    trial = SyntheticTrial(trace((20, 5, 5), (60, 30, 30), (30, 5, 5), (4, 30, 30), (30, 5, 5), (4, 30, 30),
+                                 (20, 5, 5)))
+    ranges = phases.segment(trial).ranges
+    assert ranges['idle'] == (0, 21)
+    assert ranges['steady'] == (21, 81)
+    summary = phases.summarize(trial)
+    assert mean_power(summary, 'steady') > mean_power(summary, 'idle')
+    assert mean_power(summary, 'steady') > mean_power(summary, 'tail')
+
+
+def test_steady_without_idle() -> None:
+    trial = SyntheticTrial(trace((60, 30, 30), (40, 5, 5)))
+    ranges = phases.segment(trial).ranges
+    assert ranges['idle'] == (0, 0) and ranges['ramp'] == (0, 0)
+    assert ranges['steady'] == (0, 61)
+
+
+def test_constant_trial_is_steady() -> None:
+    trial = SyntheticTrial(trace((100, 12, 12)))
+    segmentation = phases.segment(trial)
+    assert segmentation.ranges == {'idle': (0, 0), 'ramp': (0, 0), 'steady': (0, 102), 'tail': (102, 102)}
+    assert mean_power(phases.summarize(trial, segmentation), 'steady') == pytest.approx(12, abs=0.1)
@@ -0,0 +1,48 @@
+"""
+Tests of the precision policy: the files a group writes do not depend on how compact its in-memory data is.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import precision
+from analysis import correlation, spectrum
+from models.group import Group
+
+FILES = ['aggregate_data.csv', 'trial_summary.csv', 'group_summary.csv', spectrum.SPECTRUM_FILE,
+         correlation.CORRELATION_FILE]
+
+
+def read_files(group_name: str) -> dict:
+    return {name: pd.read_csv(os.path.join(Group.output_folder, group_name, name)) for name in FILES}
+
+
+def assert_same_files(expected: dict, actual: dict) -> None:
+    # The trials may be listed in another order, which changes sums in the last bit only. Statistics of float32 data
+    # differ by up to 1e-6
+    for name in FILES:
+        pd.testing.assert_frame_equal(actual[name], expected[name], check_exact=False, rtol=1e-12, atol=0, obj=name)
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_files_do_not_depend_on_policy(workspace, monkeypatch) -> None:
+    workspace('full')
+    workspace('compact')
+    monkeypatch.setattr(precision, 'PRECISION_POLICY', 'full')
+    Group('full')
+    monkeypatch.setattr(precision, 'PRECISION_POLICY', 'compact')
+    group = Group('compact')
+
+    full = read_files('full')
+    assert_same_files(full, read_files('compact'))
+    # The data kept in memory is compacted
+    assert group.memory_report()['saved_bytes'] > 0
+    assert all(trial.compacted for trial in group.trials)
+
+    # Reusing the compacted trials (uploads, outlier policy changes) aggregates them with full precision again
+    regrouped = Group('compact', trials=group.trials)
+    assert_same_files(full, read_files('compact'))
+    # The previous version of the group keeps its data
+    assert all(trial.compacted for trial in group.trials)
+    assert all(trial.compacted for trial in regrouped.trials)
@@ -0,0 +1,78 @@
+"""
+Tests of the query service: invalid limits are rejected and queries run concurrently, on both engines.
+"""
+import threading
+import time
+
+import pytest
+
+from models.group import Group
+from query_service import QueryService
+
+ENGINES = ['duckdb', 'sqlite']
+ROWS = 'SELECT 1 AS x UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4'
+
+
+def slow_query(count: int) -> str:
+    return (f'WITH RECURSIVE numbers(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM numbers WHERE x < {count}) '
+            f'SELECT count(*) AS n FROM numbers')
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('limits', [{'max_rows': '5'}, {'max_rows': 0}, {'max_rows': -1}, {'max_rows': 2.5},
+                                    {'max_rows': True}, {'timeout': '1'}, {'timeout': 0}, {'timeout': -1.0},
+                                    {'timeout': float('nan')}, {'timeout': float('inf')}])
+def test_invalid_limits_are_rejected(workspace, engine, limits) -> None:
+    with pytest.raises(ValueError):
+        QueryService(engine=engine).query('SELECT 1', **limits)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_limits(workspace, engine) -> None:
+    service = QueryService(max_rows=3, engine=engine)
+    df, truncated = service.query(ROWS, max_rows=2, timeout=0.5)
+    assert len(df) == 2 and truncated
+    # The server maximum caps larger limits
+    df, truncated = service.query(ROWS, max_rows=100)
+    assert len(df) == 3 and truncated
+
+    with pytest.raises(TimeoutError):
+        service.query(slow_query(10 ** 9), timeout=0.2)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_queries_run_concurrently(workspace, engine) -> None:
+    service = QueryService(engine=engine)
+    errors = []
+
+    def run_slow_query() -> None:
+        try:
+            service.query(slow_query(10 ** 10), timeout=3)
+        except TimeoutError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run_slow_query)
+    thread.start()
+    time.sleep(0.2)
+    # Another query does not wait for the slow query
+    df, _ = service.query('SELECT 42 AS answer')
+    assert df['answer'][0] == 42
+    assert thread.is_alive()
+    thread.join()
+    assert len(errors) == 1
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_views_are_refreshed(workspace) -> None:
+    workspace('first', trials=1)
+    Group('first')
+    services = [QueryService(engine=engine) for engine in ENGINES]
+    for service in services:
+        df, _ = service.query('SELECT group_name, count(*) AS n FROM trials GROUP BY group_name')
+        assert df.to_dict('records') == [{'group_name': 'first', 'n': 1}]
+
+    workspace('second', trials=1)
+    Group('second')
+    for service in services:
+        df, _ = service.query('SELECT group_name FROM trials ORDER BY group_name')
+        assert list(df['group_name']) == ['first', 'second']
@@ -0,0 +1,27 @@
+"""
+Tests of the sequential test: results are saved in the comparison folder and returned, without being printed.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis.sequential import SequentialTest
+from models.group import Group
+
+
+def summaries(mean: float, trials: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({metric: rng.normal(mean, 1, trials) for metric in SequentialTest.metrics})
+
+
+def test_run(workspace, monkeypatch, capsys) -> None:
+    monkeypatch.setattr(Group, 'output_folder', os.path.join('results', 'output'))
+    test = SequentialTest('a', 'b', max_trials=10)
+    results = test.run(summaries(100, 10, 0), summaries(110, 10, 1))
+
+    assert capsys.readouterr().out == ''
+    assert test.output_path() == os.path.join('results', 'output', 'a_vs_b', 'sequential_test.csv')
+    pd.testing.assert_frame_equal(pd.read_csv(test.output_path()), results, check_dtype=False)
+    assert test.is_decided(results)
+    assert {row['Decision'] for row in test.latest(results)} == {SequentialTest.DIFFERENT}
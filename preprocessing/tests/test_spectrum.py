@@ -0,0 +1,57 @@
+"""
+Tests of the power spectra: the batched Welch estimate matches scipy.signal.welch, also with padded trials.
+"""
+import numpy as np
+import pytest
+from scipy import signal
+
+from analysis import spectrum
+
+RATE = 5.0
+
+
+@pytest.fixture
+def block() -> np.ndarray:
+    # (trials x columns x time): a 0.5 Hz oscillation in noise
+    rng = np.random.default_rng(0)
+    time = np.arange(1000) / RATE
+    return 20 + 3 * np.sin(2 * np.pi * 0.5 * time) + rng.normal(0, 1, (3, 2, len(time)))
+
+
+@pytest.mark.parametrize('segment, overlap', [(64, 0.5), (128, 0.75), (33, 0.5), (1000, 0.5)])
+def test_matches_scipy(block, segment, overlap) -> None:
+    frequencies, densities = spectrum.welch(block, RATE, segment, overlap)
+    expected_frequencies, expected = signal.welch(block, fs=RATE, nperseg=segment,
+                                                  noverlap=segment - int(round(segment * (1 - overlap))), axis=-1)
+    np.testing.assert_allclose(frequencies, expected_frequencies)
+    np.testing.assert_allclose(densities, expected, rtol=1e-10, atol=1e-12)
+    # The peak of the oscillation
+    assert frequencies[np.argmax(densities[0, 0])] == pytest.approx(0.5, abs=RATE / segment)
+
+
+def test_padding_is_left_out(block) -> None:
+    padded = block.copy()
+    padded[1, :, 600:] = np.nan
+    padded[2, 0, :] = np.nan
+    frequencies, densities = spectrum.welch(padded, RATE, 64)
+    _, expected = signal.welch(block[1, :, :600], fs=RATE, nperseg=64, axis=-1)
+    # Only the complete segments of the shorter trial are averaged
+    np.testing.assert_allclose(densities[1], expected, rtol=1e-10)
+    np.testing.assert_allclose(densities[0], signal.welch(block[0], fs=RATE, nperseg=64, axis=-1)[1], rtol=1e-10)
+    assert np.isnan(densities[2, 0]).all()
+
+
+def test_spectrum_of_trials(synthetic_trial) -> None:
+    rng = np.random.default_rng(1)
+    trials = [synthetic_trial(f'trial_{index}', {
+        'Delta': np.full(500, 1000 / RATE),
+        'CPU_POWER (W)': 20 + np.sin(2 * np.pi * 1.25 * np.arange(500) / RATE) + rng.normal(0, 0.2, 500)
+    }) for index in range(3)]
+    assert spectrum.sample_rate(trials) == RATE
+    data = spectrum.spectrum(trials, segment=64)
+    assert list(data.columns) == [spectrum.FREQUENCY_COLUMN] + [f'CPU_POWER (W)_{statistic}'
+                                                               for statistic in spectrum.STATISTICS]
+    assert data[spectrum.FREQUENCY_COLUMN].iloc[-1] == RATE / 2
+    assert data[spectrum.FREQUENCY_COLUMN][data['CPU_POWER (W)_median'].idxmax()] == pytest.approx(1.25, abs=0.1)
+    assert (data['CPU_POWER (W)_LQ'] <= data['CPU_POWER (W)_median']).all()
+    assert (data['CPU_POWER (W)_median'] <= data['CPU_POWER (W)_UQ']).all()
@@ -0,0 +1,57 @@
+"""
+Tests of the trace file: spans are written per job through one open file, which is rotated once it is too large.
+"""
+import json
+import os
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def traces(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, 'TRACING', True)
+    monkeypatch.setattr(tracing, 'TRACE_DIR', str(tmp_path))
+    monkeypatch.setattr(tracing, '_writer', tracing._TraceWriter())
+    yield tmp_path
+    tracing._writer._close()
+
+
+def read_spans(path) -> list:
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_spans_are_written_when_the_job_ends(traces) -> None:
+    with tracing.job('ingest', group='sample') as job:
+        with tracing.span('trial', trial=0):
+            pass
+        assert not os.path.exists(tracing.trace_path())
+    spans = read_spans(tracing.trace_path())
+    assert [span['name'] for span in spans] == ['trial', 'ingest']
+    assert spans[0]['parent_id'] == job.span_id == spans[1]['span_id']
+
+    file = tracing._writer._file
+    with tracing.span('generate'):
+        pass
+    assert tracing._writer._file is file
+    assert len(read_spans(tracing.trace_path())) == 3
+
+
+def test_trace_file_is_rotated(traces, monkeypatch) -> None:
+    monkeypatch.setattr(tracing, 'TRACE_MAX_BYTES', 1000)
+    for i in range(20):
+        with tracing.span('job', i=i):
+            pass
+    current = read_spans(tracing.trace_path())
+    rotated = read_spans(tracing.trace_path() + '.1')
+    assert os.path.getsize(tracing.trace_path()) <= 1000
+    assert [span['attributes']['i'] for span in rotated + current] == list(range(20 - len(rotated + current), 20))
+
+
+def test_tracing_is_disabled(traces, monkeypatch) -> None:
+    monkeypatch.setattr(tracing, 'TRACING', False)
+    with tracing.job('ingest'):
+        pass
+    assert not os.path.exists(tracing.trace_path())
@@ -0,0 +1,49 @@
+"""
+Tests of writing uploaded trials: compressed uploads are decompressed completely, whatever the chunks they arrive in.
+"""
+import gzip
+import os
+import zlib
+
+import pytest
+
+import upload_service
+from upload_service import _TrialWriter
+
+CONTENT = b''.join(b'Delta,Time,CPU_POWER (W)\n' if i == 0 else f'200,{i * 200},{i % 37}.5\n'.encode()
+                   for i in range(20000))
+
+
+def upload(folder, data: bytes, chunk_size: int) -> bytes:
+    writer = _TrialWriter(str(folder), 'trial_0.csv.gz')
+    try:
+        for start in range(0, len(data), chunk_size):
+            writer.write(data[start:start + chunk_size])
+        path = writer.close()
+    except ValueError:
+        writer.abort()
+        raise
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('chunk_size', [7, 1000, 10 ** 7])
+def test_gzip_members(tmp_path, monkeypatch, chunk_size) -> None:
+    # Small chunks of output, so members also end within a chunk of input
+    monkeypatch.setattr(upload_service, 'CHUNK_SIZE', 4096)
+    assert upload(tmp_path, gzip.compress(CONTENT), chunk_size) == CONTENT
+
+    middle = len(CONTENT) // 3
+    members = gzip.compress(CONTENT[:middle]) + gzip.compress(b'') + gzip.compress(CONTENT[middle:])
+    assert upload(tmp_path, members, chunk_size) == CONTENT
+    # zlib streams are accepted too
+    assert upload(tmp_path, zlib.compress(CONTENT[:middle]) + gzip.compress(CONTENT[middle:]), chunk_size) == CONTENT
+
+
+@pytest.mark.parametrize('data', [gzip.compress(CONTENT)[:-10], gzip.compress(CONTENT) + gzip.compress(CONTENT)[:20],
+                                  gzip.compress(CONTENT) + b'trailing data'],
+                         ids=['truncated', 'truncated member', 'trailing data'])
+def test_invalid_gzip(tmp_path, data) -> None:
+    with pytest.raises(ValueError):
+        upload(tmp_path, data, 1000)
+    assert os.listdir(tmp_path) == []